@@ -0,0 +1,122 @@
+"""Benchmark extracting project cards and member headers from parsed pages,
+comparing `structables.utils.helpers` with the per-field CSS queries it
+replaced.
+
+Usage: python benchmarks/extract.py [--pages DIR] [--member NAME]
+    [--repeat N]
+"""
+
+import logging
+
+from structables.utils import helpers
+from structables.utils.parsing import EXPLORE, MEMBER, parse_html
+
+from pages import best_of, load_pages, parse_args
+
+
+def select_explore_lists(soup):
+    """Extract the project cards with one query per field."""
+    list_ = []
+    for ible in soup.select(".home-content-explore-ible"):
+        link = ible.a["href"]
+        img = helpers.proxy(ible.select("a img")[0].get("data-src"))
+        alt = ible.select("a img")[0].get("alt")
+        title = ible.select("div strong a")[0].text
+        author = ible.select("div span.ible-author a")[0].text
+        author_link = ible.select("div span.ible-author a")[0].get("href")
+        channel = ible.select("div span.ible-channel a")[0].text
+        channel_link = ible.select("div span.ible-channel a")[0].get("href")
+        views = 0
+        if ible.select("span.ible-views") != []:
+            views = ible.select("span.ible-views")[0].text
+        favorites = 0
+        if ible.select("span.ible-favorites") != []:
+            favorites = ible.select("span.ible-favorites")[0].text
+        list_.append(
+            {
+                "link": link,
+                "img": img,
+                "alt": alt,
+                "title": title,
+                "author": author,
+                "author_link": author_link,
+                "channel": channel,
+                "channel_link": channel_link,
+                "favorites": favorites,
+                "views": views,
+            }
+        )
+    return list_
+
+
+def select_member_header(header):
+    """Extract the member header with one query per field."""
+
+    def text(selector, default=0):
+        found = header.select(selector)
+        return found[0].text if found != [] else default
+
+    return {
+        "avatar": helpers.proxy(
+            header.select("div.profile-avatar-container img.profile-avatar")[0].get(
+                "src"
+            )
+        ),
+        "title": header.select(
+            "div.profile-top div.profile-headline h1.profile-title"
+        )[0].text,
+        "location": text("span.member-location"),
+        "signup": text("span.member-signup-date"),
+        "instructables": text("span.ible-count"),
+        "views": text("span.total-views"),
+        "comments": text("span.total-comments"),
+        "followers": text("span.follower-count"),
+        "bio": text("span.member-bio", ""),
+    }
+
+
+def compare(name, before, after, argument, repeat, count=None):
+    if before(argument) != after(argument):
+        print(f"{name}: the results differ")
+
+    old = best_of(lambda: before(argument), repeat)
+    new = best_of(lambda: after(argument), repeat)
+    print(f"{name}: {old:.1f}ms before, {new:.1f}ms after ({old / new:.1f}x)")
+
+    if count:
+        print(
+            f"{'':{len(name)}}  {old * 1000 / count:.0f}us before, "
+            f"{new * 1000 / count:.0f}us after per card ({count} cards)"
+        )
+
+
+def main():
+    args = parse_args(__doc__.splitlines()[0])
+    pages = load_pages(args.pages, args.member, None)
+
+    # The helpers log every card they parse
+    logging.disable(logging.CRITICAL)
+
+    home = parse_html(pages["home"], EXPLORE)
+    cards = len(home.select(".home-content-explore-ible"))
+    compare(
+        "explore_lists",
+        select_explore_lists,
+        helpers.explore_lists,
+        home,
+        args.repeat,
+        cards,
+    )
+
+    member = parse_html(pages["member"], MEMBER)
+    compare(
+        "member_header",
+        select_member_header,
+        helpers.member_header,
+        member,
+        args.repeat,
+    )
+
+
+if __name__ == "__main__":
+    main()
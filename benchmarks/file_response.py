@@ -0,0 +1,134 @@
+"""Benchmark sending files with `structables.utils.file_response` in each
+send mode.
+
+Each request is sent through the WSGI interface of a minimal app. Servers
+are emulated with a `wsgi.file_wrapper` that copies the file to /dev/null
+with `os.sendfile()`, as uwsgi does, and bodies iterated in Python are
+written to /dev/null as well.
+
+Usage: python benchmarks/file_response.py [--size BYTES] [--requests N]
+"""
+
+from flask import Flask, request
+from werkzeug.test import EnvironBuilder
+import argparse
+import os
+import tempfile
+import time
+
+from structables.utils.file_response import SEND_MODES, make_file_response
+
+
+class SendfileWrapper:
+    """A `wsgi.file_wrapper` sending the file with `os.sendfile()`."""
+
+    def __init__(self, file, block_size):
+        self.file = file
+
+    def __iter__(self):
+        return iter(())
+
+    def close(self):
+        self.file.close()
+
+
+def make_app(path, size, mode):
+    app = Flask(__name__)
+
+    @app.route("/")
+    def send():
+        return make_file_response(
+            request.environ,
+            open(path, "rb"),
+            size,
+            "application/octet-stream",
+            '"benchmark"',
+            os.path.getmtime(path),
+            {},
+            mode,
+            "/internal/benchmark",
+        )
+
+    return app
+
+
+def find_wrapper(body):
+    """Find the file wrapper within the response iterable, if any."""
+    while body is not None:
+        if isinstance(body, SendfileWrapper):
+            return body
+        body = getattr(body, "iterable", None)
+    return None
+
+
+def serve(app, requests, devnull):
+    """Send a number of requests.
+
+    Returns:
+        tuple: The duration in seconds and the number of bytes sent.
+    """
+    sent = 0
+    start = time.perf_counter()
+
+    for _ in range(requests):
+        environ = EnvironBuilder(path="/").get_environ()
+        environ["wsgi.file_wrapper"] = SendfileWrapper
+        body = app(environ, lambda status, headers, exc_info=None: None)
+
+        wrapper = find_wrapper(body)
+        if wrapper is not None:
+            fd = wrapper.file.fileno()
+            length = os.fstat(fd).st_size
+            offset = 0
+            while offset < length:
+                offset += os.sendfile(devnull, fd, offset, length - offset)
+            sent += length
+        else:
+            for chunk in body:
+                os.write(devnull, chunk)
+                sent += len(chunk)
+
+        if hasattr(body, "close"):
+            body.close()
+
+    return time.perf_counter() - start, sent
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--size",
+        type=int,
+        action="append",
+        help="size of the sent file in bytes, can be repeated "
+        "(default: 16384 and 8388608)",
+    )
+    parser.add_argument(
+        "--requests",
+        type=int,
+        default=200,
+        help="number of requests per mode and size (default: %(default)s)",
+    )
+    args = parser.parse_args()
+
+    devnull = os.open(os.devnull, os.O_WRONLY)
+
+    with tempfile.TemporaryDirectory() as directory:
+        for size in args.size or [16 * 1024, 8 * 1024 * 1024]:
+            path = os.path.join(directory, f"{size}.bin")
+            with open(path, "wb") as f:
+                f.write(os.urandom(size))
+
+            for mode in SEND_MODES:
+                app = make_app(path, size, mode)
+                duration, sent = serve(app, args.requests, devnull)
+                print(
+                    f"{mode:17} {size:>9} bytes {args.requests / duration:>8.0f} req/s"
+                    f" {sent / duration / 2**20:>8.0f} MiB/s"
+                )
+
+    os.close(devnull)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""Scraped pages used by the parsing benchmarks.
+
+Pages are fetched from Instructables on the first run and saved, so that
+later runs, and runs comparing two versions of the code, parse the same
+markup.
+"""
+
+from pathlib import Path
+import argparse
+import timeit
+
+from structables.utils.upstream import fetch_text
+
+DEFAULT_DIRECTORY = Path(__file__).parent / "pages"
+
+
+def get_urls(member, contest):
+    """Get the URLs of the benchmarked pages.
+
+    Args:
+        member (str): The member whose profile pages to fetch.
+        contest (str): The contest whose page to fetch, or None.
+
+    Returns:
+        dict: A dictionary mapping page names to URLs.
+    """
+    urls = {
+        "home": "https://www.instructables.com/",
+        "sitemap": "https://www.instructables.com/sitemap/",
+        "member": f"https://www.instructables.com/member/{member}/",
+        "member_instructables": (
+            f"https://www.instructables.com/member/{member}/instructables/"
+        ),
+    }
+
+    if contest:
+        urls["contest"] = f"https://www.instructables.com/contest/{contest}/"
+
+    return urls
+
+
+def load_pages(directory, member, contest):
+    """Load the saved pages, fetching the missing ones.
+
+    Args:
+        directory (Path): The directory the pages are saved in.
+        member (str): The member whose profile pages to fetch.
+        contest (str): The contest whose page to fetch, or None.
+
+    Returns:
+        dict: A dictionary mapping page names to their HTML.
+    """
+    directory.mkdir(parents=True, exist_ok=True)
+    pages = {}
+
+    for name, url in get_urls(member, contest).items():
+        path = directory / f"{name}.html"
+        if not path.exists():
+            print(f"Fetching {url}")
+            path.write_text(fetch_text(url))
+        pages[name] = path.read_text()
+
+    return pages
+
+
+def add_arguments(parser):
+    parser.add_argument(
+        "--pages",
+        type=Path,
+        default=DEFAULT_DIRECTORY,
+        help="directory to save the fetched pages in (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--member",
+        default="instructables",
+        help="member whose profile pages to parse (default: %(default)s)",
+    )
+    parser.add_argument("--contest", help="contest whose page to parse")
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=5,
+        help="number of runs to take the best of (default: %(default)s)",
+    )
+
+
+def best_of(function, repeat):
+    """Time a function.
+
+    Args:
+        function (callable): The function to time.
+        repeat (int): The number of runs.
+
+    Returns:
+        float: The duration of the fastest run in milliseconds.
+    """
+    return min(timeit.repeat(function, number=1, repeat=repeat)) * 1000
+
+
+def parse_args(description):
+    parser = argparse.ArgumentParser(description=description)
+    add_arguments(parser)
+    return parser.parse_args()
@@ -0,0 +1,51 @@
+"""Benchmark parsing scraped pages with each parser, with and without the
+strainers of `structables.utils.parsing`.
+
+Usage: python benchmarks/parsing.py [--pages DIR] [--member NAME]
+    [--contest NAME] [--repeat N]
+"""
+
+from bs4 import BeautifulSoup
+
+from structables.utils import parsing
+
+from pages import best_of, load_pages, parse_args
+
+STRAINERS = {
+    "home": parsing.EXPLORE,
+    "sitemap": parsing.SITEMAP,
+    "member": parsing.MEMBER,
+    "member_instructables": parsing.MEMBER_INSTRUCTABLES,
+    "contest": parsing.CONTEST,
+}
+
+
+def main():
+    args = parse_args(__doc__.splitlines()[0])
+    pages = load_pages(args.pages, args.member, args.contest)
+
+    parsers = [parsing.FALLBACK_PARSER]
+    if parsing.lxml is not None:
+        parsers.append("lxml")
+    else:
+        print("lxml is not installed - only timing html.parser")
+
+    print(f"{'page':22} {'size':>8}", end="")
+    for name in parsers:
+        print(f" {name:>12} {'+ strainer':>12}", end="")
+    print()
+
+    for name, html in pages.items():
+        print(f"{name:22} {len(html) // 1024:>5}KiB", end="")
+        for parser in parsers:
+            full = best_of(lambda: BeautifulSoup(html, parser), args.repeat)
+            strained = best_of(
+                lambda: BeautifulSoup(html, parser, parse_only=STRAINERS[name]),
+                args.repeat,
+            )
+            print(f" {full:>10.1f}ms {strained:>10.1f}ms", end="")
+        print()
+
+
+if __name__ == "__main__":
+    main()
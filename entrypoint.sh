@@ -2,6 +2,7 @@
 args="--plugin python3 \
 	--http-socket 0.0.0.0:$PORT \
 	--master \
+	--enable-threads \
 	--module structables.main:app \
 	-H /opt/venv"
 
@@ -4,8 +4,6 @@ import logging
 
 from pathlib import Path
 
-from .utils.helpers import get_typesense_api_key
-
 logger = logging.getLogger(__name__)
 
 
@@ -17,7 +15,6 @@ class Config:
     UNSAFE = os.environ.get("STRUCTABLES_UNSAFE", False)
     PRIVACY_FILE = os.environ.get("STRUCTABLES_PRIVACY_FILE")
     THEME = os.environ.get("STRUCTABLES_THEME", "auto")
-    TYPESENSE_API_KEY = get_typesense_api_key()
 
     # Cache settings
     CACHE_ENABLED = os.environ.get("STRUCTABLES_CACHE_ENABLED", "true").lower() not in (
@@ -53,6 +50,144 @@ class Config:
     CACHE_CLEANUP_INTERVAL = int(
         os.environ.get("STRUCTABLES_CACHE_CLEANUP_INTERVAL", 60 * 60)
     )  # 1 hour default
+    # Fraction of the maximum size to evict down to once it is exceeded
+    CACHE_LOW_WATERMARK = float(os.environ.get("STRUCTABLES_CACHE_LOW_WATERMARK", 0.9))
+    CACHE_EVICTION_BATCH_SIZE = int(
+        os.environ.get("STRUCTABLES_CACHE_EVICTION_BATCH_SIZE", 100)
+    )
+    CACHE_EVICTION_POLICY = os.environ.get(
+        "STRUCTABLES_CACHE_EVICTION_POLICY", "lru"
+    ).lower()  # "lru", "lfu", "gdsf" or "fifo"
+    CACHE_SEND_MODE = os.environ.get(
+        "STRUCTABLES_CACHE_SEND_MODE", "sendfile"
+    ).lower()  # "sendfile", "stream", "x-accel-redirect" or "x-sendfile"
+    CACHE_ACCEL_REDIRECT_PREFIX = os.environ.get(
+        "STRUCTABLES_CACHE_ACCEL_REDIRECT_PREFIX", "/structables-cache/"
+    )
+    # Downloads into the cache are finished after all clients disconnected
+    # if the file is at most this large
+    CACHE_DETACHED_FILL_MAX_SIZE = int(
+        os.environ.get("STRUCTABLES_CACHE_DETACHED_FILL_MAX_SIZE", 32 * 1024 * 1024)
+    )  # 32MB default
+    CACHE_DETACHED_FILL_WORKERS = int(
+        os.environ.get("STRUCTABLES_CACHE_DETACHED_FILL_WORKERS", 2)
+    )
+
+    # How long browsers and CDNs may cache proxied files
+    PROXY_MAX_AGES = {
+        "image": int(
+            os.environ.get("STRUCTABLES_PROXY_MAX_AGE_IMAGE", 60 * 60 * 24 * 365)
+        ),  # 1 year default
+        "download": int(
+            os.environ.get("STRUCTABLES_PROXY_MAX_AGE_DOWNLOAD", 60 * 60 * 24)
+        ),  # 1 day default
+    }
+
+    # Resized variants of proxied images, generated with Pillow if installed
+    IMAGE_RESIZE_WORKERS = int(os.environ.get("STRUCTABLES_IMAGE_RESIZE_WORKERS", 2))
+    IMAGE_QUALITY = int(os.environ.get("STRUCTABLES_IMAGE_QUALITY", 75))
+    IMAGE_FORMATS = [
+        name.strip().lower()
+        for name in os.environ.get("STRUCTABLES_IMAGE_FORMATS", "avif,webp").split(",")
+        if name.strip()
+    ]
+
+    # Download the images of listings and articles into the proxy cache while
+    # the pages are rendered
+    PREFETCH_ENABLED = os.environ.get(
+        "STRUCTABLES_PREFETCH_ENABLED", "false"
+    ).lower() in ("true", "1", "yes", "on", "y")
+    PREFETCH_WORKERS = int(os.environ.get("STRUCTABLES_PREFETCH_WORKERS", 2))
+    PREFETCH_PER_PAGE = int(os.environ.get("STRUCTABLES_PREFETCH_PER_PAGE", 24))
+    PREFETCH_RATE = float(os.environ.get("STRUCTABLES_PREFETCH_RATE", 4))
+
+    # Upstream connection settings
+    UPSTREAM_POOL_SIZE = int(os.environ.get("STRUCTABLES_UPSTREAM_POOL_SIZE", 10))
+    UPSTREAM_POOL_IDLE_TIMEOUT = int(
+        os.environ.get("STRUCTABLES_UPSTREAM_POOL_IDLE_TIMEOUT", 60)
+    )  # 1 minute default
+    UPSTREAM_TIMEOUT = int(os.environ.get("STRUCTABLES_UPSTREAM_TIMEOUT", 30))
+    UPSTREAM_CONCURRENCY = int(os.environ.get("STRUCTABLES_UPSTREAM_CONCURRENCY", 4))
+
+    # Upstream API response cache settings
+    RESPONSE_CACHE_BACKEND = os.environ.get(
+        "STRUCTABLES_RESPONSE_CACHE_BACKEND", "memory"
+    ).lower()  # "memory", "disk" or "none"
+    RESPONSE_CACHE_MAX_ENTRIES = int(
+        os.environ.get("STRUCTABLES_RESPONSE_CACHE_MAX_ENTRIES", 1000)
+    )
+    RESPONSE_CACHE_TTLS = {
+        "article": int(
+            os.environ.get("STRUCTABLES_RESPONSE_CACHE_TTL_ARTICLE", 60 * 10)
+        ),  # 10 minutes default
+        "contests": int(
+            os.environ.get("STRUCTABLES_RESPONSE_CACHE_TTL_CONTESTS", 60 * 5)
+        ),  # 5 minutes default
+        "closed_contests": int(
+            os.environ.get("STRUCTABLES_RESPONSE_CACHE_TTL_CLOSED_CONTESTS", 60 * 60 * 24)
+        ),  # 1 day default
+        "search": int(
+            os.environ.get("STRUCTABLES_RESPONSE_CACHE_TTL_SEARCH", 60 * 2)
+        ),  # 2 minutes default
+    }
+
+    # Rendered page cache settings
+    PAGE_CACHE_ENABLED = os.environ.get(
+        "STRUCTABLES_PAGE_CACHE_ENABLED", "false"
+    ).lower() in ("true", "1", "yes", "on", "y")
+    PAGE_CACHE_MAX_ENTRIES = int(
+        os.environ.get("STRUCTABLES_PAGE_CACHE_MAX_ENTRIES", 500)
+    )
+    # Stale pages are dropped once they could not be refreshed for this long
+    PAGE_CACHE_MAX_STALE = int(
+        os.environ.get("STRUCTABLES_PAGE_CACHE_MAX_STALE", 60 * 60)
+    )  # 1 hour default
+    PAGE_CACHE_TTLS = {
+        "explore": int(
+            os.environ.get("STRUCTABLES_PAGE_CACHE_TTL_EXPLORE", 60 * 5)
+        ),  # 5 minutes default
+        "sitemap": int(
+            os.environ.get("STRUCTABLES_PAGE_CACHE_TTL_SITEMAP", 60 * 60)
+        ),  # 1 hour default
+        "article": int(
+            os.environ.get("STRUCTABLES_PAGE_CACHE_TTL_ARTICLE", 60 * 10)
+        ),  # 10 minutes default
+        "category": int(
+            os.environ.get("STRUCTABLES_PAGE_CACHE_TTL_CATEGORY", 60 * 5)
+        ),  # 5 minutes default
+        "projects": int(
+            os.environ.get("STRUCTABLES_PAGE_CACHE_TTL_PROJECTS", 60 * 5)
+        ),  # 5 minutes default
+    }
+
+    # Send long pages in chunks while they are rendered
+    STREAM_PAGES = os.environ.get("STRUCTABLES_STREAM_PAGES", "true").lower() not in (
+        "false",
+        "0",
+        "no",
+        "off",
+        "n",
+    )
+
+    # HTML parser for scraped pages: "auto" uses lxml if it is installed
+    HTML_PARSER = os.environ.get("STRUCTABLES_HTML_PARSER", "auto")
+
+    # Background data refresh settings
+    PROJECTS_REFRESH_INTERVAL = int(
+        os.environ.get("STRUCTABLES_PROJECTS_REFRESH_INTERVAL", 60 * 5)
+    )  # 5 minutes default
+    SITEMAP_REFRESH_INTERVAL = int(
+        os.environ.get("STRUCTABLES_SITEMAP_REFRESH_INTERVAL", 60 * 60)
+    )  # 1 hour default
+    DATA_REFRESH_JITTER = int(os.environ.get("STRUCTABLES_DATA_REFRESH_JITTER", 30))
+
+    STATS_ENABLED = os.environ.get("STRUCTABLES_STATS_ENABLED", "false").lower() in (
+        "true",
+        "1",
+        "yes",
+        "on",
+        "y",
+    )
 
     @staticmethod
     def init_app(app):
@@ -6,7 +6,14 @@ import time
 
 from .config import Config
 from .routes import init_routes
-from .utils.data import maybe_update_data
+from .utils.data import init_data
+from .utils.images import init_images
+from .utils.page_cache import init_page_cache
+from .utils.parsing import init_parsing
+from .utils.proxy_cache import init_proxy_cache
+from .utils.response_cache import init_response_cache
+from .utils.typesense import init_typesense
+from .utils.upstream import init_upstream
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -14,10 +21,24 @@ logger = logging.getLogger(__name__)
 app = Flask(__name__, template_folder="templates", static_folder="static")
 app.config.from_object(Config)
 
+logger.debug("Configuring upstream connections")
+init_upstream(app)
+logger.debug("Configuring response cache")
+init_response_cache(app)
+logger.debug("Selecting HTML parser")
+init_parsing(app)
+logger.debug("Opening proxy cache")
+init_proxy_cache(app)
+logger.debug("Configuring image resizing")
+init_images(app)
+logger.debug("Configuring page cache")
+init_page_cache(app)
+logger.debug("Configuring Typesense API key storage")
+init_typesense(app)
 logger.debug("Initializing routes")
 init_routes(app)
-logger.debug("Performing initial data update")
-maybe_update_data(app)
+logger.debug("Setting up data refresh")
+init_data(app)
 
 
 def main():
@@ -3,10 +3,12 @@ from .category import init_category_routes
 from .member import init_member_routes
 from .proxy import init_proxy_routes
 from .contest import init_contest_routes
+from .stats import init_stats_routes
 
 def init_routes(app):
     init_main_routes(app)
     init_category_routes(app)
     init_member_routes(app)
     init_proxy_routes(app)
-    init_contest_routes(app)
\ No newline at end of file
+    init_contest_routes(app)
+    init_stats_routes(app)
\ No newline at end of file
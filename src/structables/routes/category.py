@@ -1,6 +1,8 @@
 from flask import redirect
 from werkzeug.exceptions import NotFound
 from ..utils.helpers import project_list, category_page
+from ..utils.index import CATEGORIES
+from ..utils.page_cache import cached_page
 import logging
 
 logger = logging.getLogger(__name__)
@@ -8,11 +10,13 @@ logger = logging.getLogger(__name__)
 
 def init_category_routes(app):
     @app.route("/<category>/<channel>/projects/")
+    @cached_page(app, "projects")
     def route_channel_projects(category, channel):
         logger.debug(f"Rendering channel projects for {category}/{channel}")
         return project_list(app, channel.title())
 
     @app.route("/<category>/<channel>/projects/<sort>/")
+    @cached_page(app, "projects")
     def route_channel_projects_sort(category, channel, sort):
         logger.debug(
             f"Rendering channel projects for {category}/{channel} sorted by {sort}"
@@ -24,56 +28,67 @@ def init_category_routes(app):
         )
 
     @app.route("/<category>/projects/")
+    @cached_page(app, "projects")
     def route_category_projects(category):
         logger.debug(f"Rendering category projects for {category}")
         return project_list(app, category.title())
 
     @app.route("/<category>/projects/<sort>/")
+    @cached_page(app, "projects")
     def route_category_projects_sort(category, sort):
         logger.debug(f"Rendering category projects for {category} sorted by {sort}")
         return project_list(app, category.title(), " Sorted by " + sort.title())
 
     @app.route("/projects/")
+    @cached_page(app, "projects")
     def route_projects():
         logger.debug("Rendering all projects")
         return project_list(app, "")
 
     @app.route("/projects/<sort>/")
+    @cached_page(app, "projects")
     def route_projects_sort(sort):
         logger.debug(f"Rendering all projects sorted by {sort}")
         return project_list(app, "", " Sorted by " + sort.title())
 
     @app.route("/circuits/")
+    @cached_page(app, "category")
     def route_circuits():
         logger.debug("Rendering circuits category page")
         return category_page(app, "Circuits")
 
     @app.route("/workshop/")
+    @cached_page(app, "category")
     def route_workshop():
         logger.debug("Rendering workshop category page")
         return category_page(app, "Workshop")
 
     @app.route("/craft/")
+    @cached_page(app, "category")
     def route_craft():
         logger.debug("Rendering craft category page")
         return category_page(app, "Craft")
 
     @app.route("/cooking/")
+    @cached_page(app, "category")
     def route_cooking():
         logger.debug("Rendering cooking category page")
         return category_page(app, "Cooking")
 
     @app.route("/living/")
+    @cached_page(app, "category")
     def route_living():
         logger.debug("Rendering living category page")
         return category_page(app, "Living")
 
     @app.route("/outside/")
+    @cached_page(app, "category")
     def route_outside():
         logger.debug("Rendering outside category page")
         return category_page(app, "Outside")
 
     @app.route("/teachers/")
+    @cached_page(app, "category")
     def route_teachers():
         logger.debug("Rendering teachers category page")
         return category_page(app, "Teachers", True)
@@ -81,15 +96,7 @@ def init_category_routes(app):
     @app.route("/<category>/<channel>/")
     def route_channel_redirect(category, channel):
         logger.debug(f"Channel redirect for {category}/{channel}")
-        if (
-            category == "circuits"
-            or category == "workshop"
-            or category == "craft"
-            or category == "cooking"
-            or category == "living"
-            or category == "outside"
-            or category == "teachers"
-        ):
+        if category in CATEGORIES:
             logger.debug(f"Redirecting to /{category}/{channel}/projects/")
             return redirect(f"/{category}/{channel}/projects/", 307)
         else:
@@ -1,10 +1,12 @@
 from flask import render_template, request, abort, url_for
-from urllib.request import urlopen, Request
 from urllib.error import HTTPError
 from ..utils.helpers import proxy
-from bs4 import BeautifulSoup
-import json
+from ..utils.parsing import CONTEST, parse_html
+from ..utils.streaming import PageStream
+from ..utils.typesense import with_api_key
+from ..utils.upstream import client, fetch_json, fetch_text, map_concurrent
 import logging
+import math
 
 logger = logging.getLogger(__name__)
 
@@ -20,11 +22,10 @@ def init_contest_routes(app):
         logger.debug(f"Fetching contest archive page {page} with limit {limit}")
 
         try:
-            # Fetch data using urlopen
+            # Fetch data from the JSON API
             url = f"https://www.instructables.com/json-api/getClosedContests?limit={limit}&offset={offset}"
             logger.debug(f"Making request to {url}")
-            response = urlopen(url)
-            data = json.loads(response.read().decode())
+            data = fetch_json(url, cache="closed_contests")
             logger.debug(
                 f"Received contest archive data with {len(data.get('contests', []))} contests"
             )
@@ -75,33 +76,36 @@ def init_contest_routes(app):
 
     def get_entries(contest):
         base_url = "https://www.instructables.com/api_proxy/search/collections/projects/documents/search"
-        headers = {"x-typesense-api-key": app.config["TYPESENSE_API_KEY"]}
-        page, per_page = 1, 100
-        all_entries = []
+        per_page = 100
 
         logger.debug(f"Fetching entries for contest: {contest}")
 
-        while True:
+        def get_page(page):
             try:
                 url = f"{base_url}?q=*&filter_by=contestPath:{contest}&sort_by=contestEntryDate:desc&per_page={per_page}&page={page}"
                 logger.debug(f"Making request to {url} (page {page})")
-                request = Request(url, headers=headers)
-                response = urlopen(request)
-                data = json.loads(response.read().decode())
+                data = with_api_key(
+                    lambda headers: fetch_json(url, headers=headers, cache="search")
+                )
             except HTTPError as e:
                 logger.error(f"HTTP error fetching contest entries: {e.code}")
                 abort(e.code)
 
             hits = data.get("hits", [])
             logger.debug(f"Received {len(hits)} entries on page {page}")
+            return data
 
-            if not hits:
-                break
+        # The first page tells us how many entries there are, so the
+        # remaining pages can be fetched in parallel
+        data = get_page(1)
+        all_entries = list(data.get("hits", []))
 
-            all_entries.extend(hits)
-            if len(hits) < per_page:
-                break
-            page += 1
+        if len(all_entries) == per_page:
+            total_pages = math.ceil(data.get("found", 0) / per_page)
+            logger.debug(f"Fetching {total_pages - 1} more pages of entries")
+
+            for page_data in map_concurrent(get_page, range(2, total_pages + 1)):
+                all_entries.extend(page_data.get("hits", []))
 
         logger.debug(f"Total entries fetched: {len(all_entries)}")
         return all_entries
@@ -111,9 +115,18 @@ def init_contest_routes(app):
         logger.debug(f"Fetching contest page for: {contest}")
 
         try:
-            data = urlopen(f"https://www.instructables.com/contest/{contest}/")
-            html = data.read().decode()
-            soup = BeautifulSoup(html, "html.parser")
+            # Fetch the contest page while the entries are being collected
+            html_future = client.submit(
+                fetch_text, f"https://www.instructables.com/contest/{contest}/"
+            )
+
+            logger.debug(f"Fetching entries for contest: {contest}")
+            entries = get_entries(contest)
+            entry_count = len(entries)
+            logger.debug(f"Found {entry_count} entries")
+
+            html = html_future.result()
+            soup = parse_html(html, CONTEST)
 
             title_tag = soup.find("h1")
             title = title_tag.get_text() if title_tag else "Contest"
@@ -122,11 +135,6 @@ def init_contest_routes(app):
             img_tag = soup.find("img", alt=lambda x: x and "Banner" in x)
             img = img_tag.get("src") if img_tag else "default.jpg"
 
-            logger.debug(f"Fetching entries for contest: {contest}")
-            entries = get_entries(contest)
-            entry_count = len(entries)
-            logger.debug(f"Found {entry_count} entries")
-
             prizes_items = soup.select("article")
             prizes = len(prizes_items) if prizes_items else 0
             logger.debug(f"Found {prizes} prizes")
@@ -142,29 +150,29 @@ def init_contest_routes(app):
             logger.error(f"HTTP error fetching contest page: {e.code}")
             abort(e.code)
 
-        entry_list = []
-        for entry in entries:
-            doc = entry["document"]
-            entry_details = {
-                "link": url_for("route_article", article=doc["urlString"]),
-                "entry_img": doc["coverImageUrl"],
-                "entry_title": doc["title"],
-                "author": doc["screenName"],
-                "author_link": url_for("route_member", member=doc["screenName"]),
-                "channel": doc["channel"][0],
-                "channel_link": f"/{doc['primaryClassification']}",
-                "views": doc.get("views", 0),
-            }
-            entry_list.append(entry_details)
-
-        return render_template(
+        def generate_entries():
+            for entry in entries:
+                doc = entry["document"]
+                yield {
+                    "link": url_for("route_article", article=doc["urlString"]),
+                    "entry_img": doc["coverImageUrl"],
+                    "entry_title": doc["title"],
+                    "author": doc["screenName"],
+                    "author_link": url_for("route_member", member=doc["screenName"]),
+                    "channel": doc["channel"][0],
+                    "channel_link": f"/{doc['primaryClassification']}",
+                    "views": doc.get("views", 0),
+                }
+
+        stream = PageStream()
+        return stream.render(
             "contest.html",
             title=title,
             img=img,
             entry_count=entry_count,
             prizes=prizes,
             info=info,
-            entry_list=entry_list,
+            entry_list=stream.items(generate_entries()),
         )
 
     @app.route("/contest/")
@@ -173,10 +181,10 @@ def init_contest_routes(app):
 
         try:
             # Fetch current contests from the JSON API
-            response = urlopen(
-                "https://www.instructables.com/json-api/getCurrentContests?limit=50&offset=0"
+            data = fetch_json(
+                "https://www.instructables.com/json-api/getCurrentContests?limit=50&offset=0",
+                cache="contests",
             )
-            data = json.loads(response.read().decode())
             logger.debug("Received current contests data")
         except HTTPError as e:
             logger.error(f"HTTP error fetching current contests: {e.code}")
@@ -1,40 +1,40 @@
 from flask import render_template, abort, request
-from urllib.request import urlopen
 from urllib.error import HTTPError
-from bs4 import BeautifulSoup
 from urllib.parse import quote
 from werkzeug.exceptions import InternalServerError
 from markdown2 import Markdown
 from traceback import print_exc
 
 import pathlib
-import json
 import logging
 
-from ..utils.data import update_data
+from ..utils.embeds import EmbedRules, get_iframe_attributes
 from ..utils.helpers import explore_lists, proxy
+from ..utils.page_cache import cached_page
+from ..utils.parsing import EXPLORE, SITEMAP, parse_html
+from ..utils.prefetch import prefetcher
+from ..utils.scheduler import scheduler
+from ..utils.streaming import PageStream
+from ..utils.upstream import fetch_json, fetch_text
 from .category import project_list
-from ..utils.data import maybe_update_data
 
 logger = logging.getLogger(__name__)
 
 
 def init_main_routes(app):
     @app.route("/")
+    @cached_page(app, "explore")
     def route_explore():
         logger.debug("Rendering explore page")
 
-        # Check if data needs to be updated
-        maybe_update_data(app)
-
         try:
             logger.debug("Fetching data from instructables.com")
-            data = urlopen("https://www.instructables.com/")
+            data = fetch_text("https://www.instructables.com/")
         except HTTPError as e:
             logger.error(f"HTTP error fetching explore page: {e.code}")
             abort(e.code)
 
-        soup = BeautifulSoup(data.read().decode(), "html.parser")
+        soup = parse_html(data, EXPLORE, require=".home-content-explore-wrap")
 
         explore = soup.select(".home-content-explore-wrap")[0]
 
@@ -80,6 +80,7 @@ def init_main_routes(app):
 
     @app.route("/sitemap/")
     @app.route("/sitemap/<path:path>")
+    @cached_page(app, "sitemap")
     def route_sitemap(path=""):
         logger.debug(f"Rendering sitemap for path: {path}")
 
@@ -87,12 +88,12 @@ def init_main_routes(app):
             logger.debug(
                 f"Fetching sitemap data from instructables.com for path: {path}"
             )
-            data = urlopen("https://www.instructables.com/sitemap/" + path)
+            data = fetch_text("https://www.instructables.com/sitemap/" + path)
         except HTTPError as e:
             logger.error(f"HTTP error fetching sitemap: {e.code}")
             abort(e.code)
 
-        soup = BeautifulSoup(data.read().decode(), "html.parser")
+        soup = parse_html(data, SITEMAP, require="div.sitemap-content")
 
         main = soup.select("div.sitemap-content")[0]
 
@@ -129,17 +130,98 @@ def init_main_routes(app):
 
         return render_template("sitemap.html", title="Sitemap", groups=groups)
 
+    embed_rules = EmbedRules(app.config["INVIDIOUS"], app.config["UNSAFE"])
+
+    def get_step(step):
+        """Build the template data for a step of an article.
+
+        Args:
+            step (dict): The step from the article data.
+
+        Returns:
+            dict: The step information.
+        """
+        step_title = step["title"]
+        logger.debug(f"Processing step: {step_title}")
+
+        step_imgs = []
+        step_iframes = []
+        step_downloads = []
+
+        for file in step["files"]:
+            if file["image"]:
+                if "embedType" not in "file":
+                    step_imgs.append(
+                        {
+                            "src": proxy(file["downloadUrl"], file["name"]),
+                            "alt": file["name"],
+                        }
+                    )
+                if file["embedType"] == "VIDEO":
+                    iframe = get_iframe_attributes(file["embedHtmlCode"])
+                    if iframe:
+                        src, width, height = iframe
+                        logger.debug(f"Processing video iframe with src: {src}")
+
+                        step_iframes.append(
+                            {
+                                "src": embed_rules.rewrite(src),
+                                "width": width,
+                                "height": height,
+                            }
+                        )
+
+            elif not file["image"]:
+                if "downloadUrl" in file.keys():
+                    step_downloads.append(
+                        {
+                            "src": proxy(file["downloadUrl"], file["name"]),
+                            "name": file["name"],
+                        }
+                    )
+
+                else:  # Leaves us with embeds
+                    src = get_iframe_attributes(file["embedHtmlCode"])[0]
+                    logger.debug(f"Processing iframe with src: {src}")
+
+                    step_iframes.append(
+                        {
+                            "src": embed_rules.rewrite(src),
+                            "width": file.get("width"),
+                            "height": file.get("height"),
+                        }
+                    )
+
+        step_text = step["body"]
+        step_text = step_text.replace(
+            "https://content.instructables.com",
+            "/proxy/?url=https://content.instructables.com",
+        )
+
+        logger.debug(
+            f"Step {step_title}: {len(step_imgs)} images, {len(step_iframes)} iframes, {len(step_downloads)} downloads"
+        )
+
+        return {
+            "title": step_title,
+            "imgs": step_imgs,
+            "text": step_text,
+            "iframes": step_iframes,
+            "downloads": step_downloads,
+        }
+
     @app.route("/<article>/")
+    @cached_page(app, "article")
     def route_article(article):
         logger.debug(f"Rendering article page for: {article}")
 
         try:
             logger.debug(f"Fetching article data from instructables.com for: {article}")
             article_path = quote(article)
-            data = urlopen(
-                f"https://www.instructables.com/json-api/showInstructableModel?urlString={article_path}"
+            data = fetch_json(
+                f"https://www.instructables.com/json-api/showInstructableModel?urlString={article_path}",
+                cache="article",
             )
-            data = json.loads(data.read().decode())
             logger.debug("Successfully fetched article data")
         except HTTPError as e:
             logger.error(f"HTTP error fetching article: {e.code}")
@@ -163,7 +245,10 @@ def init_main_routes(app):
 
             if "steps" in data:
                 logger.debug(f"Article has {len(data['steps'])} steps")
-                steps = []
+
+                # The fetched data may be shared with other requests, so the
+                # list of steps is copied before inserting the supplies
+                article_steps = list(data["steps"])
 
                 if "supplies" in data:
                     supplies = data["supplies"]
@@ -175,7 +260,7 @@ def init_main_routes(app):
                         supplies_files = data["suppliesFiles"]
                         logger.debug(f"Article has {len(supplies_files)} supply files")
 
-                    data["steps"].insert(
+                    article_steps.insert(
                         1,
                         {
                             "title": "Supplies",
@@ -184,147 +269,30 @@ def init_main_routes(app):
                         },
                     )
 
-                for step in data["steps"]:
-                    step_title = step["title"]
-                    logger.debug(f"Processing step: {step_title}")
-
-                    step_imgs = []
-                    step_iframes = []
-                    step_downloads = []
-
-                    for file in step["files"]:
-                        if file["image"]:
-                            if "embedType" not in "file":
-                                step_imgs.append(
-                                    {
-                                        "src": proxy(file["downloadUrl"], file["name"]),
-                                        "alt": file["name"],
-                                    }
-                                )
-                            if file["embedType"] == "VIDEO":
-                                embed_html_code = file["embedHtmlCode"]
-                                soup = BeautifulSoup(embed_html_code, "html.parser")
-                                if soup.select("iframe"):
-                                    src = soup.select("iframe")[0].get("src")
-                                    width = soup.select("iframe")[0].get("width")
-                                    height = soup.select("iframe")[0].get("height")
-                                    logger.debug(
-                                        f"Processing video iframe with src: {src}"
-                                    )
-
-                                    if src.startswith(
-                                        "https://content.instructables.com"
-                                    ):
-                                        src = src.replace(
-                                            "https://content.instructables.com",
-                                            f"/proxy/?url={src}",
-                                        )
-                                        logger.debug(
-                                            f"Proxying instructables content: {src}"
-                                        )
-
-                                    elif app.config["INVIDIOUS"] and src.startswith(
-                                        "https://www.youtube.com"
-                                    ):
-                                        src = src.replace(
-                                            "https://www.youtube.com",
-                                            app.config["INVIDIOUS"],
-                                        )
-                                        logger.debug(
-                                            f"Using Invidious for YouTube: {src}"
-                                        )
-
-                                    elif not app.config["UNSAFE"]:
-                                        src = "/iframe/?url=" + quote(src)
-                                        logger.debug(
-                                            f"Using iframe wrapper for safety: {src}"
-                                        )
-
-                                    step_iframes.append(
-                                        {
-                                            "src": src,
-                                            "width": width,
-                                            "height": height,
-                                        }
-                                    )
-
-                        elif not file["image"]:
-                            if "downloadUrl" in file.keys():
-                                step_downloads.append(
-                                    {
-                                        "src": proxy(file["downloadUrl"], file["name"]),
-                                        "name": file["name"],
-                                    }
-                                )
-
-                            else:  # Leaves us with embeds
-                                embed_code = file["embedHtmlCode"]
-                                soup = BeautifulSoup(embed_code, "html.parser")
-
-                                iframe = soup.select("iframe")[0]
-
-                                src = iframe.get("src")
-                                logger.debug(f"Processing iframe with src: {src}")
-
-                                if src.startswith("https://content.instructables.com"):
-                                    src = src.replace(
-                                        "https://content.instructables.com",
-                                        f"/proxy/?url={src}",
-                                    )
-                                    logger.debug(
-                                        f"Proxying instructables content: {src}"
-                                    )
-
-                                elif app.config["INVIDIOUS"] and src.startswith(
-                                    "https://www.youtube.com"
-                                ):
-                                    src = src.replace(
-                                        "https://www.youtube.com",
-                                        app.config["INVIDIOUS"],
-                                    )
-                                    logger.debug(f"Using Invidious for YouTube: {src}")
-
-                                elif not app.config["UNSAFE"]:
-                                    src = "/iframe/?url=" + quote(src)
-                                    logger.debug(
-                                        f"Using iframe wrapper for safety: {src}"
-                                    )
-
-                                step_iframes.append(
-                                    {
-                                        "src": src,
-                                        "width": file.get("width"),
-                                        "height": file.get("height"),
-                                    }
-                                )
-
-                    step_text = step["body"]
-                    step_text = step_text.replace(
-                        "https://content.instructables.com",
-                        "/proxy/?url=https://content.instructables.com",
-                    )
-
-                    logger.debug(
-                        f"Step {step_title}: {len(step_imgs)} images, {len(step_iframes)} iframes, {len(step_downloads)} downloads"
-                    )
+                prefetcher.queue(
+                    proxy(file["downloadUrl"])
+                    for step in article_steps
+                    for file in step["files"]
+                    if file["image"]
+                )
 
-                    steps.append(
-                        {
-                            "title": step_title,
-                            "imgs": step_imgs,
-                            "text": step_text,
-                            "iframes": step_iframes,
-                            "downloads": step_downloads,
-                        }
-                    )
+                def generate_steps():
+                    try:
+                        for step in article_steps:
+                            yield get_step(step)
+                    except Exception as e:
+                        logger.error(f"Error processing article step: {str(e)}")
+                        print_exc()
+                        raise
 
                 comments_list = []
                 comment_count = 0
 
                 # TODO: Fix comments
 
-                logger.debug(f"Rendering article template with {len(steps)} steps")
-                return render_template(
+                logger.debug(f"Rendering article template with {len(article_steps)} steps")
+                stream = PageStream()
+                return stream.render(
                     "article.html",
                     title=title,
                     author=author,
@@ -335,7 +303,7 @@ def init_main_routes(app):
                     channel_link=channel_link,
                     views=views,
                     favorites=favorites,
-                    steps=steps,
+                    steps=stream.items(generate_steps()),
                     comment_count=comment_count,
                     comments_list=comments_list,
                     enumerate=enumerate,
@@ -406,7 +374,7 @@ def init_main_routes(app):
     @app.route("/cron/")
     def cron():
         logger.debug("Manual cron update triggered")
-        update_data(app)
+        scheduler.trigger()
         return "OK"
 
     @app.route("/privacypolicy/")
@@ -1,14 +1,46 @@
 from flask import render_template, abort
-from urllib.request import urlopen
 from urllib.error import HTTPError
 from urllib.parse import quote
 from ..utils.helpers import proxy, member_header
-from bs4 import BeautifulSoup
-from urllib.request import Request
+from ..utils.parsing import (
+    MEMBER,
+    MEMBER_INSTRUCTABLES,
+    Extractor,
+    get_text,
+    parse_html,
+)
+from ..utils.upstream import fetch_text
 import logging
 
 logger = logging.getLogger(__name__)
 
+MEMBER_IBLE = Extractor(
+    {
+        "thumbnail": "div.thumbnail-image",
+        "link": ("thumbnail", "a"),
+        "img": "div.thumbnail-image a noscript img",
+        "title": "div.caption-inner a.title",
+        "stats": "div.ible-stats-right-col",
+        "views": ("stats", "span.ible-views"),
+        "favorites": ("stats", "span.ible-favorites"),
+    }
+)
+
+PROMOTED_IBLE = Extractor(
+    {
+        "wrapper": "div.image-wrapper",
+        "link": ("wrapper", "a"),
+        "img": "div.image-wrapper a img",
+    }
+)
+
+ACHIEVEMENT = Extractor(
+    {
+        "title": "div.achievement-info span.achievement-title",
+        "description": "div.achievement-info span.achievement-description",
+    }
+)
+
 def init_member_routes(app):
     """This function initializes all the routes related to Instructables member profiles.
 
@@ -31,14 +63,16 @@ def init_member_routes(app):
 
         try:
             logger.debug(f"Making request to https://www.instructables.com/member/{member}/instructables/")
-            data = urlopen(
+            data = fetch_text(
                 f"https://www.instructables.com/member/{member}/instructables/"
             )
         except HTTPError as e:
             logger.error(f"HTTP error fetching member instructables: {e.code}")
             abort(e.code)
 
-        soup = BeautifulSoup(data.read().decode(), "html.parser")
+        soup = parse_html(
+            data, MEMBER_INSTRUCTABLES, require=".profile-header.profile-header-social"
+        )
 
         header = soup.select(".profile-header.profile-header-social")[0]
         header_content = member_header(header)
@@ -47,17 +81,18 @@ def init_member_routes(app):
         ibles = soup.select("ul.ible-list-items")[0]
         ible_list = []
         for ible in ibles.select("li"):
-            link = ible.select("div.thumbnail-image")[0].a.get("href")
-            img = proxy(ible.select("div.thumbnail-image a noscript img")[0].get("src"))
-            title = ible.select("div.caption-inner a.title")[0].text
-
-            stats = ible.select("div.ible-stats-right-col")[0]
-            views = 0
-            if stats.select("span.ible-views") != []:
-                views = stats.select("span.ible-views")[0].text
-            favorites = 0
-            if stats.select("span.ible-favorites") != []:
-                favorites = stats.select("span.ible-favorites")[0].text
+            found = MEMBER_IBLE.extract(ible)
+            link = found["link"].get("href")
+            img = proxy(found["img"].get("src"))
+            title = found["title"].text
+
+            # Cards without a stats column are listed without counts
+            if found["stats"] is None:
+                logger.debug(f"No stats found for instructable {link}")
+                views = favorites = 0
+            else:
+                views = get_text(found["views"])
+                favorites = get_text(found["favorites"])
 
             ible_list.append(
                 {
@@ -91,16 +126,14 @@ def init_member_routes(app):
         logger.debug(f"Fetching profile for member: {member}")
         member = quote(member)
 
-        request = Request(f"https://www.instructables.com/member/{member}/")
-
         try:
             logger.debug(f"Making request to https://www.instructables.com/member/{member}/")
-            data = urlopen(request)
+            data = fetch_text(f"https://www.instructables.com/member/{member}/")
         except HTTPError as e:
             logger.error(f"HTTP error fetching member profile: {e.code}")
             abort(e.code)
 
-        soup = BeautifulSoup(data.read().decode(), "html.parser")
+        soup = parse_html(data, MEMBER, require="div.member-profile-body")
 
         header_content = member_header(soup)
         logger.debug(f"Parsed member header for {header_content['title']}")
@@ -118,9 +151,10 @@ def init_member_routes(app):
             logger.debug(f"Found promoted content: {ible_list_title}")
             
             for ible in ible_list.select("ul.promoted-items li"):
+                found = PROMOTED_IBLE.extract(ible)
                 ible_title = ible.get("data-title")
-                ible_link = ible.select("div.image-wrapper")[0].a.get("href")
-                ible_img = proxy(ible.select("div.image-wrapper a img")[0].get("src"))
+                ible_link = found["link"].get("href")
+                ible_img = proxy(found["img"].get("src"))
 
                 ibles.append({"title": ible_title, "link": ible_link, "img": ible_img})
             
@@ -141,17 +175,11 @@ def init_member_routes(app):
             for ach in ach_list.select(
                 "div.achievements-section.main-achievements.contest-achievements div.achievement-item:not(.two-column-filler)"
             ):
-                try:
-                    ach_title = ach.select(
-                        "div.achievement-info span.achievement-title"
-                    )[0].text
-                    ach_desc = ach.select(
-                        "div.achievement-info span.achievement-description"
-                    )[0].text
-                    achs.append([ach_title, ach_desc])
-                except IndexError:
+                found = ACHIEVEMENT.extract(ach)
+                if found["title"] is None or found["description"] is None:
                     logger.warning("Failed to parse an achievement item")
-                    pass
+                    continue
+                achs.append([found["title"].text, found["description"].text])
             
             logger.debug(f"Found {len(achs)} achievements")
 
@@ -2,218 +2,306 @@ from flask import render_template, request, Response, abort
 from werkzeug.exceptions import BadRequest, InternalServerError
 from urllib.parse import unquote
 from urllib.error import HTTPError
-from urllib.request import urlopen
+from werkzeug.http import http_date
 import logging
 import os
-import hashlib
+import secrets
 import time
-import shutil
+
+from ..utils.buffers import get_chunk_size, read_chunk
+from ..utils.file_response import SEND_MODES, make_file_response
+from ..utils.images import MAX_SOURCE_SIZE, SOURCE_TYPES, resizer
+from ..utils.inflight import fills
+from ..utils.prefetch import prefetcher
+from ..utils.proxy_cache import get_etag, proxy_cache
+from ..utils.upstream import fetch
 
 logger = logging.getLogger(__name__)
 
-# Track last cache cleanup time
-last_cache_cleanup = 0
 
+def get_cache_headers(app, content_type, attachment):
+    """Get the caching headers for a proxied file.
 
-def get_cache_path(app, url):
-    """Generate a cache file path for a URL.
+    Files on the Instructables CDNs never change once uploaded, so images
+    are marked as immutable. Downloads are cached for a shorter time.
 
     Args:
         app: The Flask app instance.
-        url (str): The URL to cache.
+        content_type (str): The content type of the file.
+        attachment (bool): Whether the file is sent as a download.
 
     Returns:
-        str: The path to the cache file.
+        dict: The Cache-Control and Expires headers.
     """
-    # Create a hash of the URL to use as the filename
-    url_hash = hashlib.sha256(url.encode()).hexdigest()
-    cache_dir = app.config["CACHE_DIR"]
-    return os.path.join(cache_dir, url_hash)
+    image = content_type.startswith("image/") and not attachment
+    max_age = app.config["PROXY_MAX_AGES"]["image" if image else "download"]
+
+    if max_age <= 0:
+        return {"Cache-Control": "no-cache"}
+
+    cache_control = f"public, max-age={max_age}"
+    if image:
+        cache_control += ", immutable"
+
+    return {
+        "Cache-Control": cache_control,
+        "Expires": http_date(time.time() + max_age),
+    }
 
 
-def is_cached(app, url):
-    """Check if a URL is cached and not expired.
+def proxy_uncached(url, headers, cache_headers):
+    """Stream content from upstream without caching it.
+
+    Status, headers and body are all taken from a single upstream request.
 
     Args:
-        app: The Flask app instance.
-        url (str): The URL to check.
+        url (str): The URL to proxy.
+        headers (dict): Additional response headers.
+        cache_headers (callable): A function taking the content type and
+            returning the caching headers for a successful response.
 
     Returns:
-        bool: True if the URL is cached and not expired, False otherwise.
+        Response: The streamed response.
     """
-    # If caching is disabled, always return False
-    if not app.config["CACHE_ENABLED"]:
-        return False
+    try:
+        logger.debug(f"Opening connection to {url}")
+        data = fetch(url, method=request.method)
+    except HTTPError as e:
+        logger.error(f"HTTP error fetching content: {e.code}")
+        abort(e.code)
+    except Exception as e:
+        logger.error(f"Error fetching content: {str(e)}")
+        abort(500)
 
-    cache_path = get_cache_path(app, url)
+    content_type = data.headers.get("content-type")
+    if content_type is None:
+        logger.error("Content-Type header missing")
+        data.close()
+        raise InternalServerError()
 
-    # Check if the file exists
-    if not os.path.exists(cache_path):
-        return False
+    logger.debug(f"Content type: {content_type}")
 
-    # Check if the cache has expired
-    cache_time = os.path.getmtime(cache_path)
-    max_age = app.config["CACHE_MAX_AGE"]
-    if time.time() - cache_time > max_age:
-        # Cache has expired, remove it
-        try:
-            os.remove(cache_path)
-            # Also remove metadata file if it exists
-            meta_path = cache_path + ".meta"
-            if os.path.exists(meta_path):
-                os.remove(meta_path)
-            return False
-        except OSError:
-            logger.warning(f"Failed to remove expired cache file: {cache_path}")
-            return False
+    content_length = data.headers.get("content-length")
+    if content_length is not None:
+        headers["Content-Length"] = content_length
 
-    # Cache exists and is not expired
-    return True
+    if data.status == 200:
+        headers.update(cache_headers(content_type))
 
+    if request.method == "HEAD":
+        data.close()
+        return Response(status=data.status, content_type=content_type, headers=headers)
 
-def get_content_type(cache_path):
-    """Get the content type from a cache file.
+    chunk_size = get_chunk_size(content_length)
 
-    Args:
-        cache_path (str): The path to the cache file.
+    def generate():
+        with data:
+            logger.debug("Connection established, streaming data")
+            try:
+                while True:
+                    chunk = read_chunk(data, chunk_size)
+                    if not chunk:
+                        break
+                    yield chunk
+            except Exception as e:
+                logger.error(f"Error streaming content: {str(e)}")
 
-    Returns:
-        str: The content type, or 'application/octet-stream' if not found.
-    """
-    meta_path = cache_path + ".meta"
-    if os.path.exists(meta_path):
+    return Response(
+        generate(), status=data.status, content_type=content_type, headers=headers
+    )
+
+
+def init_proxy_routes(app):
+    send_mode = app.config["CACHE_SEND_MODE"]
+    if send_mode not in SEND_MODES:
+        logger.warning(f"Unknown cache send mode {send_mode} - using sendfile")
+        send_mode = "sendfile"
+    logger.debug(f"Cache send mode: {send_mode}")
+
+    fills.configure(
+        app.config["CACHE_DETACHED_FILL_MAX_SIZE"],
+        app.config["CACHE_DETACHED_FILL_WORKERS"],
+    )
+
+    def get_send_path(entry):
+        """Get the path of a cached file for the web server in front.
+
+        Args:
+            entry (CacheEntry): The cache entry.
+
+        Returns:
+            str: The path, or None if files are sent by the app.
+        """
+        if send_mode == "x-sendfile":
+            return entry.path
+        if send_mode == "x-accel-redirect":
+            path = os.path.relpath(entry.path, proxy_cache.directory)
+            return app.config["CACHE_ACCEL_REDIRECT_PREFIX"] + path
+        return None
+
+    def open_fill(url):
+        """Join the download of a URL into the cache, or start it.
+
+        The first request for a URL that misses the cache starts a fill, and
+        concurrent requests for the same URL stream from it, so there is one
+        upstream request and one cache write per URL.
+
+        Args:
+            url (str): The upstream URL.
+
+        Returns:
+            FillReader: A reader on the download, or None if no temporary
+                cache file could be created.
+        """
         try:
-            with open(meta_path, "r") as f:
-                return f.read().strip()
-        except OSError:
-            logger.warning(
-                f"Failed to read content type from cache metadata: {meta_path}"
-            )
+            temp_base = proxy_cache.prepare_path(url)
+            reader, leader = fills.claim(url, temp_base)
+        except OSError as e:
+            logger.warning(f"Failed to create temporary cache file: {e}")
+            return None
 
-    return "application/octet-stream"
+        if leader:
+            try:
+                logger.debug(f"Opening connection to {url}")
+                reader.fill.begin(
+                    fetch(url),
+                    on_complete=lambda fill: proxy_cache.store(
+                        url,
+                        fill.temp_path,
+                        fill.content_type,
+                        fill.content_length,
+                        fill.response.headers.get("etag"),
+                    ),
+                )
+            except Exception as e:
+                reader.fill.fail(e)
+        else:
+            logger.debug(f"Joining download in progress for {url}")
 
+        return reader
 
-def maybe_cleanup_cache(app):
-    """Clean up the cache directory if it's time to do so.
+    prefetcher.configure(
+        app.config["PREFETCH_WORKERS"] if app.config["PREFETCH_ENABLED"] else 0,
+        app.config["PREFETCH_PER_PAGE"],
+        app.config["PREFETCH_RATE"],
+        open_fill,
+    )
 
-    Args:
-        app: The Flask app instance.
-    """
-    global last_cache_cleanup
+    def is_resizable(content_type, length):
+        if content_type is None:
+            return False
+        return (
+            content_type.split(";")[0].strip() in SOURCE_TYPES
+            and int(length or 0) <= MAX_SOURCE_SIZE
+        )
 
-    # If caching is disabled, don't do anything
-    if not app.config["CACHE_ENABLED"]:
-        return
+    def cache_original(url):
+        """Download an image into the cache, unless it is cached already.
 
-    # Check if it's time to run cleanup
-    current_time = time.time()
-    cleanup_interval = app.config["CACHE_CLEANUP_INTERVAL"]
+        Args:
+            url (str): The upstream URL.
 
-    if current_time - last_cache_cleanup < cleanup_interval:
-        logger.debug(
-            f"Cache cleanup skipped. Time since last cleanup: {current_time - last_cache_cleanup:.2f} seconds"
-        )
-        return
+        Returns:
+            CacheEntry: The entry of the image, or None if the URL is not a
+                cached image that can be resized.
+        """
+        entry = proxy_cache.lookup(url)
 
-    logger.debug("Starting cache cleanup")
-    last_cache_cleanup = current_time
+        if entry is None:
+            reader = open_fill(url)
+            if reader is None:
+                return None
 
-    try:
-        cache_dir = app.config["CACHE_DIR"]
-        max_size = app.config["CACHE_MAX_SIZE"]
-        max_age = app.config["CACHE_MAX_AGE"]
-
-        # Get all cache files with their modification times
-        cache_files = []
-        total_size = 0
-
-        for filename in os.listdir(cache_dir):
-            file_path = os.path.join(cache_dir, filename)
-            if os.path.isfile(file_path):
-                # Skip metadata files in the count
-                if file_path.endswith(".meta"):
-                    continue
-
-                file_size = os.path.getsize(file_path)
-                file_time = os.path.getmtime(file_path)
-                total_size += file_size
-                cache_files.append((file_path, file_time, file_size))
-
-        logger.debug(f"Current cache size: {total_size / (1024 * 1024):.2f} MB")
-
-        # First, remove expired files
-        current_time = time.time()
-        expired_files = [
-            (path, mtime, size)
-            for path, mtime, size in cache_files
-            if current_time - mtime > max_age
-        ]
-
-        for file_path, _, file_size in expired_files:
             try:
-                os.remove(file_path)
-                # Also remove metadata file if it exists
-                meta_path = file_path + ".meta"
-                if os.path.exists(meta_path):
-                    os.remove(meta_path)
-                total_size -= file_size
-                logger.debug(f"Removed expired cache file: {file_path}")
-            except OSError:
-                logger.warning(f"Failed to remove expired cache file: {file_path}")
-
-        # Remove files from the list that we've already deleted
-        cache_files = [
-            (path, mtime, size)
-            for path, mtime, size in cache_files
-            if (path, mtime, size) not in expired_files
-        ]
-
-        # If we're still over the size limit, remove oldest files first
-        if total_size > max_size:
-            logger.debug("Cache size exceeds limit, cleaning up")
-            # Sort by modification time (oldest first)
-            cache_files.sort(key=lambda x: x[1])
-
-            # Remove files until we're under the limit
-            for file_path, _, file_size in cache_files:
-                if total_size <= max_size:
-                    break
+                reader.wait()
+            except Exception as e:
+                logger.debug(f"Failed to download image to resize: {str(e)}")
+                return None
+
+            fill = reader.fill
+            if fill.status != 200 or not is_resizable(
+                fill.content_type, fill.content_length
+            ):
+                reader.close()
+                return None
+
+            # Reading the body drives the download to the end
+            for _ in reader:
+                pass
+
+            entry = proxy_cache.lookup(url)
+
+        if entry is None or not is_resizable(entry.content_type, entry.size):
+            return None
+        return entry
+
+    def open_variant(url, width):
+        """Open a resized variant of an image, generating it for GET requests
+        if needed.
+
+        The quality is taken from the `q` parameter and the format is
+        negotiated from the Accept header of the request.
+
+        Args:
+            url (str): The upstream URL of the original.
+            width (int): The width, as returned by `resizer.get_width()`.
+
+        Returns:
+            tuple: A tuple of (entry, file), or (None, None) if the original
+                should be sent instead.
+        """
+        quality = resizer.get_quality(request.args.get("q"))
+        format = resizer.negotiate(request.accept_mimetypes)
+        # Variants are cached under the URL of the original with a fragment,
+        # which is never sent upstream
+        variant_url = f"{url}#w={width}&q={quality}&f={format or 'auto'}"
+
+        entry, file = proxy_cache.open(variant_url, variant=True)
+        if entry is not None:
+            return entry, file
+
+        # Only GET requests download and resize the original
+        if request.method != "GET":
+            return None, None
+
+        def generate():
+            # The variant may have been generated by another thread just now
+            if proxy_cache.lookup(variant_url) is not None:
+                return True
+
+            source = cache_original(url)
+            if source is None:
+                return False
+
+            temp_path = (
+                proxy_cache.prepare_path(variant_url)
+                + f".{secrets.token_hex(8)}.tmp"
+            )
+            content_type = resizer.resize(
+                variant_url, source, temp_path, width, quality, format
+            )
+            if content_type is None:
+                proxy_cache.remove_file(temp_path)
+                return False
 
-                try:
-                    os.remove(file_path)
-                    # Also remove metadata file if it exists
-                    meta_path = file_path + ".meta"
-                    if os.path.exists(meta_path):
-                        os.remove(meta_path)
-
-                    total_size -= file_size
-                    logger.debug(f"Removed old cache file: {file_path}")
-                except OSError:
-                    logger.warning(f"Failed to remove cache file: {file_path}")
-
-        logger.debug(
-            f"Cache cleanup complete. New size: {total_size / (1024 * 1024):.2f} MB"
-        )
+            proxy_cache.store(variant_url, temp_path, content_type, variant=True)
+            return True
 
-    except Exception as e:
-        logger.error(f"Error during cache cleanup: {str(e)}")
+        try:
+            if not resizer.calls.do(variant_url, generate):
+                return None, None
+        except Exception as e:
+            logger.error(f"Error generating image variant: {str(e)}")
+            return None, None
 
+        entry = proxy_cache.lookup(variant_url)
+        if entry is None:
+            return None, None
 
-def init_proxy_routes(app):
-    # Create cache directory if it doesn't exist and caching is enabled
-    if app.config["CACHE_ENABLED"]:
-        cache_dir = app.config["CACHE_DIR"]
-        os.makedirs(cache_dir, exist_ok=True)
-        logger.debug(f"Cache directory: {cache_dir}")
-        logger.debug(f"Cache max age: {app.config['CACHE_MAX_AGE']} seconds")
-        logger.debug(
-            f"Cache max size: {app.config['CACHE_MAX_SIZE'] / (1024 * 1024):.2f} MB"
-        )
-        logger.debug(
-            f"Cache cleanup interval: {app.config['CACHE_CLEANUP_INTERVAL']} seconds"
-        )
-    else:
-        logger.debug("Caching is disabled")
+        try:
+            return entry, open(entry.path, "rb")
+        except OSError:
+            return None, None
 
     @app.route("/proxy/")
     def route_proxy():
@@ -222,129 +310,90 @@ def init_proxy_routes(app):
 
         logger.debug(f"Proxy request for URL: {url}, filename: {filename}")
 
-        # Clean up the cache if needed
-        maybe_cleanup_cache(app)
-
         if url is not None:
             if url.startswith("https://cdn.instructables.com/") or url.startswith(
                 "https://content.instructables.com/"
             ):
                 logger.debug(f"Valid proxy URL: {url}")
                 unquoted_url = unquote(url)
+                prefetcher.record_request(unquoted_url)
+
+                headers = dict()
+                if filename is not None:
+                    headers["Content-Disposition"] = (
+                        f'attachment; filename="{filename}"'
+                    )
+                    logger.debug(f"Added Content-Disposition header for {filename}")
+
+                def cache_headers(content_type):
+                    return get_cache_headers(app, content_type, filename is not None)
+
+                # Resized variants of images are served from the cache and
+                # generated on the first request
+                entry, cache_file = None, None
+                width = resizer.get_width(request.args.get("w"))
+                if (
+                    width is not None
+                    and filename is None
+                    and resizer.enabled
+                    and proxy_cache.enabled
+                ):
+                    headers["Vary"] = "Accept"
+                    entry, cache_file = open_variant(unquoted_url, width)
 
                 # Check if the content is already cached
-                if is_cached(app, unquoted_url):
+                if entry is None:
+                    entry, cache_file = proxy_cache.open(unquoted_url)
+                if entry is not None:
                     logger.debug(f"Serving cached content for: {unquoted_url}")
-                    cache_path = get_cache_path(app, unquoted_url)
-                    content_type = get_content_type(cache_path)
-
-                    def generate_from_cache():
-                        with open(cache_path, "rb") as f:
-                            while True:
-                                chunk = f.read(1024 * 1024)
-                                if not chunk:
-                                    break
-                                yield chunk
-
-                    headers = dict()
-                    if filename is not None:
-                        headers["Content-Disposition"] = (
-                            f'attachment; filename="{filename}"'
-                        )
-
-                    return Response(
-                        generate_from_cache(),
-                        content_type=content_type,
-                        headers=headers,
+                    headers.update(cache_headers(entry.content_type))
+                    return make_file_response(
+                        request.environ,
+                        cache_file,
+                        entry.size,
+                        entry.content_type,
+                        get_etag(entry),
+                        entry.created,
+                        headers,
+                        send_mode,
+                        get_send_path(entry),
                     )
 
-                # Content is not cached or caching is disabled, fetch it
-                def generate_and_maybe_cache():
-                    try:
-                        logger.debug(f"Opening connection to {unquoted_url}")
-                        with urlopen(unquoted_url) as data:
-                            logger.debug("Connection established, streaming data")
-
-                            # If caching is enabled, cache the content
-                            if app.config["CACHE_ENABLED"]:
-                                cache_path = get_cache_path(app, unquoted_url)
-                                temp_path = cache_path + ".tmp"
-                                with open(temp_path, "wb") as f:
-                                    while True:
-                                        chunk = data.read(1024 * 1024)
-                                        if not chunk:
-                                            break
-                                        f.write(chunk)
-                                        yield chunk
-
-                                # Save the content type
-                                try:
-                                    content_type = data.headers["content-type"]
-                                    with open(cache_path + ".meta", "w") as f:
-                                        f.write(content_type)
-                                except (KeyError, OSError):
-                                    logger.warning(
-                                        f"Failed to save content type for: {unquoted_url}"
-                                    )
-
-                                # Rename the temporary file to the final cache file
-                                try:
-                                    os.rename(temp_path, cache_path)
-                                    logger.debug(
-                                        f"Successfully cached content for: {unquoted_url}"
-                                    )
-                                except OSError:
-                                    logger.warning(
-                                        f"Failed to rename temporary cache file: {temp_path}"
-                                    )
-                                    # Try to copy and delete instead
-                                    try:
-                                        shutil.copy2(temp_path, cache_path)
-                                        os.remove(temp_path)
-                                        logger.debug(
-                                            f"Successfully cached content using copy method: {unquoted_url}"
-                                        )
-                                    except OSError:
-                                        logger.error(
-                                            f"Failed to cache content: {unquoted_url}"
-                                        )
-                            else:
-                                # If caching is disabled, just stream the data
-                                while True:
-                                    chunk = data.read(1024 * 1024)
-                                    if not chunk:
-                                        break
-                                    yield chunk
-
-                    except HTTPError as e:
-                        logger.error(f"HTTP error during streaming: {e.code}")
-                        abort(e.code)
-                    except Exception as e:
-                        logger.error(f"Error fetching content: {str(e)}")
-                        abort(500)
+                # Content is not cached yet
+                reader = None
+                if proxy_cache.enabled and request.method == "GET":
+                    reader = open_fill(unquoted_url)
+
+                if reader is None:
+                    return proxy_uncached(unquoted_url, headers, cache_headers)
 
                 try:
-                    logger.debug(f"Getting content type for {unquoted_url}")
-                    with urlopen(unquoted_url) as data:
-                        content_type = data.headers["content-type"]
-                        logger.debug(f"Content type: {content_type}")
+                    reader.wait()
                 except HTTPError as e:
-                    logger.error(f"HTTP error getting content type: {e.code}")
+                    logger.error(f"HTTP error fetching content: {e.code}")
                     abort(e.code)
-                except KeyError:
+                except Exception as e:
+                    logger.error(f"Error fetching content: {str(e)}")
+                    abort(500)
+
+                fill = reader.fill
+                if fill.content_type is None:
                     logger.error("Content-Type header missing")
+                    reader.close()
                     raise InternalServerError()
 
-                headers = dict()
-                if filename is not None:
-                    headers["Content-Disposition"] = (
-                        f'attachment; filename="{filename}"'
-                    )
-                    logger.debug(f"Added Content-Disposition header for {filename}")
+                logger.debug(f"Content type: {fill.content_type}")
+
+                if fill.content_length is not None:
+                    headers["Content-Length"] = fill.content_length
+
+                if fill.status == 200:
+                    headers.update(cache_headers(fill.content_type))
 
                 return Response(
-                    generate_and_maybe_cache(),
-                    content_type=content_type,
+                    reader,
+                    status=fill.status,
+                    content_type=fill.content_type,
                     headers=headers,
                 )
             else:
@@ -0,0 +1,50 @@
+from flask import jsonify
+import logging
+
+from ..utils.buffers import buffer_pool
+from ..utils.images import resizer
+from ..utils.inflight import fills
+from ..utils.page_cache import page_cache
+from ..utils.prefetch import prefetcher
+from ..utils.proxy_cache import evictor, proxy_cache
+from ..utils.response_cache import response_cache
+from ..utils.scheduler import scheduler
+from ..utils.upstream import client, requests_in_flight
+
+logger = logging.getLogger(__name__)
+
+
+def init_stats_routes(app):
+    """This function initializes the statistics route, if enabled.
+
+    Args:
+        app (Flask): The Flask app instance.
+    """
+    if not app.config["STATS_ENABLED"]:
+        logger.debug("Statistics route is disabled")
+        return
+
+    @app.route("/stats/")
+    def route_stats():
+        """Route to display internal statistics of this worker process.
+
+        Returns:
+            Response: The statistics as JSON.
+        """
+        logger.debug("Rendering statistics")
+
+        return jsonify(
+            {
+                "upstream": client.stats(),
+                "proxy_cache": proxy_cache.get_stats(),
+                "proxy_eviction": evictor.get_stats(),
+                "proxy_fills": fills.get_stats(),
+                "proxy_buffers": buffer_pool.get_stats(),
+                "image_resizing": resizer.get_stats(),
+                "prefetch": prefetcher.get_stats(),
+                "coalescing": requests_in_flight.get_stats(),
+                "response_cache": response_cache.get_stats(),
+                "page_cache": page_cache.get_stats(),
+                "scheduler": scheduler.get_stats(),
+            }
+        )
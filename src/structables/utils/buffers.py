@@ -0,0 +1,158 @@
+from contextlib import contextmanager
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Chunk sizes for reading upstream bodies. Buffers come in powers of two
+# between these sizes, so that they can be reused for other bodies.
+MIN_CHUNK_SIZE = 16 * 1024
+MAX_CHUNK_SIZE = 1024 * 1024
+
+# Chunk size for bodies of unknown length
+DEFAULT_CHUNK_SIZE = 256 * 1024
+
+# Total size of the idle buffers kept for reuse per process
+MAX_POOLED_BYTES = 8 * 1024 * 1024
+
+
+def get_chunk_size(content_length):
+    """Get the chunk size to read a body with.
+
+    Small files are read in one chunk, larger ones in chunks of up to
+    `MAX_CHUNK_SIZE` bytes.
+
+    Args:
+        content_length (str): The Content-Length header, or None.
+
+    Returns:
+        int: The chunk size in bytes.
+    """
+    try:
+        length = int(content_length)
+    except (TypeError, ValueError):
+        return DEFAULT_CHUNK_SIZE
+
+    size = MIN_CHUNK_SIZE
+    while size < length and size < MAX_CHUNK_SIZE:
+        size *= 2
+    return size
+
+
+class BufferPool:
+    """A pool of reusable read buffers.
+
+    Reading into a pooled buffer avoids allocating a new object for every
+    chunk of a streamed body. The memory used by one stream is bounded by
+    its chunk size.
+
+    Args:
+        max_bytes (int): The total size of the idle buffers to keep.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.free = {}
+        self.pooled_bytes = 0
+        self.in_use = 0
+        self.in_use_bytes = 0
+        self.stats = {
+            "allocated": 0,
+            "reused": 0,
+            "discarded": 0,
+            "peak_in_use_bytes": 0,
+        }
+
+    @contextmanager
+    def borrow(self, size):
+        """Borrow a buffer for the duration of a `with` block.
+
+        Args:
+            size (int): The size of the buffer, as returned by
+                `get_chunk_size()`.
+
+        Yields:
+            bytearray: The buffer.
+        """
+        with self.lock:
+            free = self.free.get(size)
+            if free:
+                buffer = free.pop()
+                self.pooled_bytes -= size
+                self.stats["reused"] += 1
+            else:
+                buffer = None
+                self.stats["allocated"] += 1
+
+            self.in_use += 1
+            self.in_use_bytes += size
+            self.stats["peak_in_use_bytes"] = max(
+                self.stats["peak_in_use_bytes"], self.in_use_bytes
+            )
+
+        if buffer is None:
+            buffer = bytearray(size)
+
+        try:
+            yield buffer
+        finally:
+            with self.lock:
+                self.in_use -= 1
+                self.in_use_bytes -= size
+
+                if self.pooled_bytes + size <= self.max_bytes:
+                    self.free.setdefault(size, []).append(buffer)
+                    self.pooled_bytes += size
+                else:
+                    self.stats["discarded"] += 1
+
+    def reset(self):
+        """Drop the buffers and stats inherited from the parent process after
+        a fork."""
+        self.lock = threading.Lock()
+        self.free = {}
+        self.pooled_bytes = 0
+        self.in_use = 0
+        self.in_use_bytes = 0
+        self.stats = dict.fromkeys(self.stats, 0)
+
+    def get_stats(self):
+        with self.lock:
+            stats = dict(self.stats)
+            stats["in_use"] = self.in_use
+            stats["in_use_bytes"] = self.in_use_bytes
+            stats["pooled_bytes"] = self.pooled_bytes
+            stats["max_chunk_size"] = MAX_CHUNK_SIZE
+            return stats
+
+
+def read_chunk(response, size, file=None):
+    """Read the next chunk of a response using a pooled buffer.
+
+    Args:
+        response (UpstreamResponse): The response to read from.
+        size (int): The chunk size.
+        file (file, optional): A file to also write the chunk to, straight
+            from the buffer.
+
+    Returns:
+        bytes: The chunk, or an empty bytes object at the end of the body.
+    """
+    with buffer_pool.borrow(size) as buffer, memoryview(buffer) as view:
+        n = response.readinto(view)
+        if not n:
+            return b""
+
+        if file is not None:
+            file.write(view[:n])
+
+        # WSGI servers only accept bytes
+        return bytes(view[:n])
+
+
+buffer_pool = BufferPool(MAX_POOLED_BYTES)
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=buffer_pool.reset)
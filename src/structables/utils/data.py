@@ -1,99 +1,121 @@
-from urllib.request import urlopen
 import logging
-import time
-from bs4 import BeautifulSoup
-from .helpers import proxy, projects_search
+from pathlib import Path
+from .helpers import project_card, projects_search
+from .index import DataIndex
+from .page_cache import page_cache
+from .parsing import SITEMAP, parse_html
+from .scheduler import scheduler
+from .upstream import fetch_text
 
 logger = logging.getLogger(__name__)
 
-# Track the last data update time
-last_data_update = 0
+def fetch_sitemap(app):
+    """Fetch the categories and their channels from the sitemap.
 
-def update_data(app):
-    """Update the application's cached data.
-    
-    This function fetches fresh data from Instructables.com and updates
-    the app's global cache.
-    
     Args:
         app: The Flask app instance.
+
+    Returns:
+        list: The categories, as dictionaries with the "name", the "link" and
+            the "channels" of each category. Channels are lists of their name
+            and link.
     """
-    logger.debug("Starting data update")
-
-    channels = []
-
-    try:
-        app.global_ibles
-    except AttributeError:
-        logger.debug("Initializing global_ibles dictionary")
-        app.global_ibles = {}
-
-    try:
-        logger.debug("Fetching sitemap data from instructables.com")
-        sitemap_data = urlopen("https://www.instructables.com/sitemap/")
-        sitemap_soup = BeautifulSoup(sitemap_data.read().decode(), "html.parser")
-        main = sitemap_soup.select("div.sitemap-content")[0]
-
-        for group in main.select("div.group-section"):
-            channels.append(group.select("h2 a")[0].text.lower())
-        
-        logger.debug(f"Found {len(channels)} channels in sitemap")
-
-        logger.debug("Fetching featured projects")
-        app.global_ibles["/projects"] = []
-        project_ibles, total = projects_search(app, filter_by="featureFlag:=true")
-        
-        logger.debug(f"Found {len(project_ibles)} featured projects")
-
-        while len(app.global_ibles["/projects"]) <= 0:
-            for ible in project_ibles:
-                link = f"/{ible['document']['urlString']}"
-                img = proxy(ible['document']['coverImageUrl'])
-
-                title = ible['document']['title']
-                author = ible['document']['screenName']
-                author_link = f"/member/{author}"
-
-                channel = ible['document']['primaryClassification']
-                channel_link = f"/channel/{channel}"
-
-                views = ible['document']['views']
-                favorites = ible['document']['favorites']
-
-                app.global_ibles["/projects"].append(
-                    {
-                        "link": link,
-                        "img": img,
-                        "title": title,
-                        "author": author,
-                        "author_link": author_link,
-                        "channel": channel,
-                        "channel_link": channel_link,
-                        "views": views,
-                        "favorites": favorites,
-                    }
-                )
-        
-        logger.debug(f"Updated global projects list with {len(app.global_ibles['/projects'])} projects")
-        logger.debug("Data update completed successfully")
-    except Exception as e:
-        logger.error(f"Error updating data: {str(e)}")
-
-
-def maybe_update_data(app):
-    """Updates the data if it's time to do so.
-
-    This replaces the background thread with a request-triggered update.
+    logger.debug("Fetching sitemap data from instructables.com")
+    sitemap_data = fetch_text("https://www.instructables.com/sitemap/")
+    sitemap_soup = parse_html(sitemap_data, SITEMAP, require="div.sitemap-content")
+    main = sitemap_soup.select("div.sitemap-content")[0]
+
+    groups = []
+    for group in main.select("div.group-section"):
+        category = group.select("h2 a")[0]
+        channels = [
+            [li.a.text, li.a["href"]]
+            for li in group.select("ul.sitemap-listing li")
+        ]
+        groups.append(
+            {"name": category.text, "link": category.get("href"), "channels": channels}
+        )
+
+    logger.debug(f"Found {len(groups)} categories in sitemap")
+    return groups
+
+
+def fetch_featured_projects(app):
+    """Fetch the featured projects.
 
     Args:
-        app (Flask): The Flask app instance.
+        app: The Flask app instance.
+
+    Returns:
+        list: The projects, as dictionaries for the project list template.
+
+    Raises:
+        ValueError: If no featured projects were found.
+    """
+    logger.debug("Fetching featured projects")
+    project_ibles, total = projects_search(app, filter_by="featureFlag:=true")
+
+    logger.debug(f"Found {len(project_ibles)} featured projects")
+
+    if not project_ibles:
+        raise ValueError("No featured projects found")
+
+    return [project_card(ible) for ible in project_ibles]
+
+
+def update_index(app):
+    app.data_index = DataIndex(app.global_ibles["/projects"], app.global_sitemap)
+
+
+def set_sitemap(app, sitemap):
+    app.global_sitemap = sitemap
+    update_index(app)
+
+
+def set_featured_projects(app, projects):
+    # Replace the dictionary instead of modifying it, so requests never see
+    # a partially updated list
+    app.global_ibles = dict(app.global_ibles, **{"/projects": projects})
+    logger.debug(f"Updated global projects list with {len(projects)} projects")
+    update_index(app)
+
+    # Pages listing channels and featured projects are now outdated
+    page_cache.invalidate("category", "projects")
+
+
+def init_data(app):
+    """Set up the background refresh of the application's cached data.
+
+    The data starts out as last published by another worker, or is fetched
+    right away if nothing was published yet, and is refreshed by the
+    scheduler once it runs in a worker process.
+
+    Args:
+        app: The Flask app instance.
     """
-    global last_data_update
-    current_time = time.time()
-    
-    # Update every 5 minutes (300 seconds)
-    if current_time - last_data_update >= 300:
-        logger.debug("Running scheduled data update")
-        update_data(app)
-        last_data_update = current_time
-        logger.debug("Data update complete")
\ No newline at end of file
+    app.global_ibles = {"/projects": []}
+    app.global_sitemap = []
+    app.data_index = DataIndex()
+
+    directory = (
+        Path(app.config["CACHE_DIR"]) / "data" if app.config["CACHE_ENABLED"] else None
+    )
+    scheduler.configure(app, directory, app.config["DATA_REFRESH_JITTER"])
+    scheduler.add(
+        "sitemap",
+        app.config["SITEMAP_REFRESH_INTERVAL"],
+        fetch_sitemap,
+        set_sitemap,
+    )
+    scheduler.add(
+        "projects",
+        app.config["PROJECTS_REFRESH_INTERVAL"],
+        fetch_featured_projects,
+        set_featured_projects,
+    )
+    scheduler.load_all()
+    scheduler.refresh_missing()
+
+    @app.before_request
+    def start_scheduler():
+        scheduler.start()
@@ -0,0 +1,86 @@
+from functools import lru_cache
+from html import unescape
+from urllib.parse import quote
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+IFRAME_PATTERN = re.compile(r"<iframe\b((?:[^>\"']|\"[^\"]*\"|'[^']*')*)>", re.IGNORECASE)
+ATTRIBUTE_PATTERN = re.compile(
+    r"""([^\s"'>/=]+)(?:\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s>]+)))?"""
+)
+
+
+@lru_cache(maxsize=1024)
+def get_iframe_attributes(embed_code):
+    """Get the attributes of the first iframe in an embed snippet.
+
+    The same snippets appear in many articles, so results are memoized.
+
+    Args:
+        embed_code (str): The HTML of the embed.
+
+    Returns:
+        tuple: The src, width and height of the iframe, each None if missing,
+            or None if the snippet contains no iframe.
+    """
+    match = IFRAME_PATTERN.search(embed_code)
+    if match is None:
+        return None
+
+    attributes = {}
+    for name, double_quoted, single_quoted, unquoted in ATTRIBUTE_PATTERN.findall(
+        match.group(1)
+    ):
+        value = double_quoted or single_quoted or unquoted
+        attributes[name.lower()] = unescape(value)
+
+    return attributes.get("src"), attributes.get("width"), attributes.get("height")
+
+
+class EmbedRules:
+    """Rewrites the sources of embedded iframes.
+
+    Content hosted by Instructables is proxied, YouTube videos are sent to
+    Invidious if an instance is configured, and everything else is wrapped in
+    the iframe page unless unsafe mode is enabled.
+
+    Args:
+        invidious (str): The URL of the Invidious instance, or None.
+        unsafe (bool): Whether to embed other sites directly.
+    """
+
+    def __init__(self, invidious, unsafe):
+        self.invidious = invidious
+        self.unsafe = unsafe
+
+        rules = [r"(?P<proxy>https://content\.instructables\.com)"]
+        if invidious:
+            rules.append(r"(?P<invidious>https://www\.youtube\.com)")
+
+        self.pattern = re.compile("|".join(rules))
+
+    def rewrite(self, src):
+        """Rewrite the source of an iframe.
+
+        Args:
+            src (str): The original source.
+
+        Returns:
+            str: The source to use.
+        """
+        match = self.pattern.match(src)
+        rule = match.lastgroup if match else None
+
+        if rule == "proxy":
+            src = f"/proxy/?url={src}"
+            logger.debug(f"Proxying instructables content: {src}")
+        elif rule == "invidious":
+            src = self.invidious + src[match.end() :]
+            logger.debug(f"Using Invidious for YouTube: {src}")
+        elif not self.unsafe:
+            src = "/iframe/?url=" + quote(src)
+            logger.debug(f"Using iframe wrapper for safety: {src}")
+
+        return src
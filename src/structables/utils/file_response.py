@@ -0,0 +1,244 @@
+from datetime import datetime, timezone
+from flask import Response
+from werkzeug.http import (
+    http_date,
+    is_resource_modified,
+    parse_if_range_header,
+    parse_range_header,
+    unquote_etag,
+)
+from werkzeug.wsgi import wrap_file
+import logging
+import secrets
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1024 * 1024
+
+# Requests for more ranges are answered with the whole file
+MAX_RANGES = 16
+
+# How files are sent: "stream" reads them in Python, "sendfile" hands them to
+# the server's wsgi.file_wrapper, and the others let the web server in front
+# send the file named in a header
+SEND_MODES = ("stream", "sendfile", "x-accel-redirect", "x-sendfile")
+
+
+def get_ranges(environ, length, etag, last_modified):
+    """Get the byte ranges requested by the client.
+
+    Args:
+        environ (dict): The WSGI environment of the request.
+        length (int): The length of the file.
+        etag (str): The ETag of the file.
+        last_modified (datetime): The modification time of the file.
+
+    Returns:
+        list: A list of (start, stop) tuples with exclusive stops, an empty
+            list if no requested range can be satisfied, or None if the whole
+            file should be sent.
+    """
+    ranges = parse_range_header(environ.get("HTTP_RANGE"))
+    if ranges is None or ranges.units != "bytes" or len(ranges.ranges) > MAX_RANGES:
+        return None
+
+    # Ranges of a file the client does not have yet make no sense
+    if_range = parse_if_range_header(environ.get("HTTP_IF_RANGE"))
+    if if_range.etag is not None:
+        current, weak = unquote_etag(etag)
+        if weak or if_range.etag != current:
+            return None
+    elif if_range.date is not None and if_range.date != last_modified:
+        return None
+
+    satisfiable = []
+    for start, stop in ranges.ranges:
+        if start < 0:
+            start, stop = max(length + start, 0), length
+        elif stop is None or stop > length:
+            stop = length
+
+        if start < stop:
+            satisfiable.append((start, stop))
+
+    return satisfiable
+
+
+def iter_range(file, start=0, stop=None):
+    """Read a part of a file in chunks.
+
+    Args:
+        file (file): The file, opened in binary mode.
+        start (int, optional): The offset to start at.
+        stop (int, optional): The offset to stop at, or None to read to the
+            end of the file.
+
+    Yields:
+        bytes: The chunks.
+    """
+    file.seek(start)
+    remaining = stop - start if stop is not None else None
+
+    while remaining is None or remaining > 0:
+        size = CHUNK_SIZE if remaining is None else min(CHUNK_SIZE, remaining)
+        chunk = file.read(size)
+        if not chunk:
+            break
+        if remaining is not None:
+            remaining -= len(chunk)
+        yield chunk
+
+
+def iter_file(file, start=0, stop=None):
+    """Read a part of a file in chunks, and close it afterwards.
+
+    Args:
+        file (file): The file, opened in binary mode.
+        start (int, optional): The offset to start at.
+        stop (int, optional): The offset to stop at, or None to read to the
+            end of the file.
+
+    Yields:
+        bytes: The chunks.
+    """
+    with file:
+        yield from iter_range(file, start, stop)
+
+
+def iter_multipart(file, parts, closing):
+    """Read the parts of a multipart/byteranges body.
+
+    Args:
+        file (file): The file, opened in binary mode.
+        parts (list): Tuples of (header, start, stop) for each part.
+        closing (bytes): The closing boundary.
+
+    Yields:
+        bytes: The chunks of the body.
+    """
+    with file:
+        for header, start, stop in parts:
+            yield header
+            yield from iter_range(file, start, stop)
+            yield b"\r\n"
+        yield closing
+
+
+def make_file_response(
+    environ, file, length, content_type, etag, modified, headers, mode, send_path=None
+):
+    """Send a file, answering conditional and range requests.
+
+    Requests with a matching If-None-Match or If-Modified-Since header get a
+    304 response, and requests with a Range header get the requested ranges.
+    The file is read only as far as needed and is closed when the response
+    is done.
+
+    Args:
+        environ (dict): The WSGI environment of the request.
+        file (file): The file, opened in binary mode.
+        length (int): The length of the file.
+        content_type (str): The content type of the file.
+        etag (str): The ETag of the file, including quotes.
+        modified (float): The modification time of the file as a timestamp.
+        headers (dict): Additional response headers.
+        mode (str): How to send the file, one of `SEND_MODES`.
+        send_path (str, optional): The path of the file to pass to the web
+            server in the "x-accel-redirect" and "x-sendfile" modes.
+
+    Returns:
+        Response: The response.
+    """
+    last_modified = datetime.fromtimestamp(int(modified), timezone.utc)
+    headers = {
+        **headers,
+        "ETag": etag,
+        "Last-Modified": http_date(last_modified),
+        "Accept-Ranges": "bytes",
+    }
+
+    if not is_resource_modified(environ, etag=etag, last_modified=last_modified):
+        file.close()
+        return Response(status=304, headers=headers)
+
+    if mode in ("x-accel-redirect", "x-sendfile"):
+        # The web server answers range requests for the file itself
+        file.close()
+        header = "X-Accel-Redirect" if mode == "x-accel-redirect" else "X-Sendfile"
+        headers[header] = send_path
+        response = Response(content_type=content_type, headers=headers)
+        # The web server sets the length of the file it sends
+        response.automatically_set_content_length = False
+        return response
+
+    ranges = get_ranges(environ, length, etag, last_modified)
+    is_head = environ["REQUEST_METHOD"] == "HEAD"
+
+    if ranges is None:
+        headers["Content-Length"] = str(length)
+        if is_head:
+            file.close()
+            body = None
+        elif mode == "sendfile":
+            body = wrap_file(environ, file, CHUNK_SIZE)
+        else:
+            body = iter_file(file)
+
+        return Response(
+            body, content_type=content_type, headers=headers, direct_passthrough=True
+        )
+
+    if not ranges:
+        file.close()
+        return Response(status=416, headers={"Content-Range": f"bytes */{length}"})
+
+    if len(ranges) == 1:
+        start, stop = ranges[0]
+        headers["Content-Range"] = f"bytes {start}-{stop - 1}/{length}"
+        headers["Content-Length"] = str(stop - start)
+        if is_head:
+            file.close()
+            body = None
+        else:
+            body = iter_file(file, start, stop)
+
+        return Response(
+            body,
+            status=206,
+            content_type=content_type,
+            headers=headers,
+            direct_passthrough=True,
+        )
+
+    boundary = secrets.token_hex(16)
+    parts = [
+        (
+            (
+                f"--{boundary}\r\n"
+                f"Content-Type: {content_type}\r\n"
+                f"Content-Range: bytes {start}-{stop - 1}/{length}\r\n\r\n"
+            ).encode(),
+            start,
+            stop,
+        )
+        for start, stop in ranges
+    ]
+    closing = f"--{boundary}--\r\n".encode()
+    headers["Content-Length"] = str(
+        sum(len(header) + stop - start + 2 for header, start, stop in parts)
+        + len(closing)
+    )
+
+    if is_head:
+        file.close()
+        body = None
+    else:
+        body = iter_multipart(file, parts, closing)
+
+    return Response(
+        body,
+        status=206,
+        content_type=f"multipart/byteranges; boundary={boundary}",
+        headers=headers,
+        direct_passthrough=True,
+    )
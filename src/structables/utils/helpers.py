@@ -1,14 +1,52 @@
+from collections import OrderedDict
 from urllib.parse import urlencode, urlparse, quote
-from urllib.request import urlopen, Request
-from bs4 import BeautifulSoup
-import re
-import logging
 import json
+import logging
 import math
-from flask import request, render_template, abort
+import threading
+from flask import request, abort
+
+from .parsing import Extractor, get_text
+from .prefetch import prefetcher
+from .streaming import PageStream
+from .typesense import with_api_key
+from .upstream import fetch, fetch_json
 
 logger = logging.getLogger(__name__)
 
+EXPLORE_CARD = Extractor(
+    {
+        "link": "a",
+        "img": "a img",
+        "title": "div strong a",
+        "author": "div span.ible-author a",
+        "channel": "div span.ible-channel a",
+        "views": "span.ible-views",
+        "favorites": "span.ible-favorites",
+    }
+)
+
+MEMBER_HEADER = Extractor(
+    {
+        "avatar": "div.profile-avatar-container img.profile-avatar",
+        "title": "div.profile-top div.profile-headline h1.profile-title",
+        "location": "span.member-location",
+        "signup": "span.member-signup-date",
+        "instructables": "span.ible-count",
+        "views": "span.total-views",
+        "comments": "span.total-comments",
+        "followers": "span.follower-count",
+        "bio": "span.member-bio",
+    }
+)
+
+# Channel names that returned projects, by category and slug
+channel_names = OrderedDict()
+channel_names_lock = threading.Lock()
+
+# Number of channel names remembered per process
+MAX_CHANNEL_NAMES = 1024
+
 def proxy(url, filename=None):
     """Generate a proxy URL for external content.
     
@@ -22,31 +60,6 @@ def proxy(url, filename=None):
     logger.debug(f"Generating proxy URL for {url}")
     return f"/proxy/?url={url}" + (f"&filename={filename}" if filename else "")
 
-def get_typesense_api_key():
-    """Extract the Typesense API key from Instructables.com.
-    
-    Returns:
-        str: The Typesense API key.
-    """
-    logger.debug("Getting Typesense API key...")
-
-    try:
-        data = urlopen("https://www.instructables.com/")
-        soup = BeautifulSoup(data.read().decode(), "html.parser")
-        scripts = soup.select("script")
-
-        for script in scripts:
-            if "typesense" in script.text and (
-                matches := re.search(r'"typesenseApiKey":\s?"(.*?)"', script.text)
-            ):
-                api_key = matches.group(1)
-                logger.debug(f"Identified Typesense API key: {api_key[:5]}...")
-                return api_key
-
-        logger.error("Failed to get Typesense API key")
-    except Exception as e:
-        logger.error(f"Error getting Typesense API key: {str(e)}")
-
 def unslugify(slug):
     """Return a list of possible original titles for a slug.
 
@@ -67,6 +80,40 @@ def unslugify(slug):
     logger.debug(f"Unslugify results: {results}")
     return results
 
+def project_card(ible):
+    """Build the template data for a project returned by a search.
+
+    Args:
+        ible (dict): The search hit.
+
+    Returns:
+        dict: The project information.
+    """
+    link = f"/{ible['document']['urlString']}"
+    img = proxy(ible['document']['coverImageUrl'])
+
+    title = ible['document']['title']
+    author = ible['document']['screenName']
+    author_link = f"/member/{author}"
+
+    channel = ible['document']['primaryClassification']
+    channel_link = f"/channel/{channel}"
+
+    views = ible['document']['views']
+    favorites = ible['document']['favorites']
+
+    return {
+        "link": link,
+        "img": img,
+        "title": title,
+        "author": author,
+        "author_link": author_link,
+        "channel": channel,
+        "channel_link": channel_link,
+        "views": views,
+        "favorites": favorites,
+    }
+
 def get_pagination(request, total, per_page=1):
     """Generate pagination links.
     
@@ -147,54 +194,18 @@ def member_header(header):
     logger.debug("Parsing member header")
     
     try:
-        avatar = proxy(
-            header.select("div.profile-avatar-container img.profile-avatar")[0].get("src")
-        )
-        title = header.select("div.profile-top div.profile-headline h1.profile-title")[
-            0
-        ].text
+        found = MEMBER_HEADER.extract(header)
 
-        location = header.select("span.member-location")
-        if location != []:
-            location = location[0].text
-        else:
-            location = 0
-
-        signup = header.select("span.member-signup-date")
-        if signup != []:
-            signup = signup[0].text
-        else:
-            signup = 0
-
-        instructables = header.select("span.ible-count")
-        if instructables != []:
-            instructables = instructables[0].text
-        else:
-            instructables = 0
-
-        views = header.select("span.total-views")
-        if views != []:
-            views = views[0].text
-        else:
-            views = 0
-
-        comments = header.select("span.total-comments")
-        if comments != []:
-            comments = comments[0].text
-        else:
-            comments = 0
-
-        followers = header.select("span.follower-count")
-        if followers != []:
-            followers = followers[0].text
-        else:
-            followers = 0
+        avatar = proxy(found["avatar"].get("src"))
+        title = found["title"].text
 
-        bio = header.select("span.member-bio")
-        if bio != []:
-            bio = bio[0].text
-        else:
-            bio = ""
+        location = get_text(found["location"])
+        signup = get_text(found["signup"])
+        instructables = get_text(found["instructables"])
+        views = get_text(found["views"])
+        comments = get_text(found["comments"])
+        followers = get_text(found["followers"])
+        bio = get_text(found["bio"], "")
 
         logger.debug(f"Parsed member header for {title}")
         
@@ -237,20 +248,17 @@ def explore_lists(soup):
     list_ = []
     try:
         for ible in soup.select(".home-content-explore-ible"):
-            link = ible.a["href"]
-            img = proxy(ible.select("a img")[0].get("data-src"))
-            alt = ible.select("a img")[0].get("alt")
-            title = ible.select("div strong a")[0].text
-            author = ible.select("div span.ible-author a")[0].text
-            author_link = ible.select("div span.ible-author a")[0].get("href")
-            channel = ible.select("div span.ible-channel a")[0].text
-            channel_link = ible.select("div span.ible-channel a")[0].get("href")
-            views = 0
-            if ible.select("span.ible-views") != []:
-                views = ible.select("span.ible-views")[0].text
-            favorites = 0
-            if ible.select("span.ible-favorites") != []:
-                favorites = ible.select("span.ible-favorites")[0].text
+            found = EXPLORE_CARD.extract(ible)
+            link = found["link"]["href"]
+            img = proxy(found["img"].get("data-src"))
+            alt = found["img"].get("alt")
+            title = found["title"].text
+            author = found["author"].text
+            author_link = found["author"].get("href")
+            channel = found["channel"].text
+            channel_link = found["channel"].get("href")
+            views = get_text(found["views"])
+            favorites = get_text(found["favorites"])
             list_.append(
                 {
                     "link": link,
@@ -297,7 +305,6 @@ def project_list(app, head, sort="", per_page=20):
     else:
         if "projects" in path.split("/"):
             logger.debug("Fetching projects for category/channel")
-            ibles = []
 
             parts = path.split("/")
             category = parts[1]
@@ -305,25 +312,12 @@ def project_list(app, head, sort="", per_page=20):
             
             logger.debug(f"Category: {category}, Channel: {channel}")
 
-            channel_names = unslugify(channel)
-
-            for channel_name in channel_names:
-                logger.debug(f"Trying channel name: {channel_name}")
-                project_ibles, total = projects_search(
-                    app,
-                    category=category,
-                    channel=channel_name,
-                    per_page=per_page,
-                    page=page,
-                )
-
-                if project_ibles:
-                    logger.debug(f"Found {len(project_ibles)} projects for {channel_name}")
-                    break
+            project_ibles, total = channel_search(
+                app, category, channel, per_page=per_page, page=page
+            )
 
         elif "search" in path.split("/"):
             logger.debug("Processing search request")
-            ibles = []
             query = (
                 request.args.get("q") if request.method == "GET" else request.form["q"]
             )
@@ -343,43 +337,18 @@ def project_list(app, head, sort="", per_page=20):
             logger.warning(f"Invalid path: {path}")
             abort(404)
 
-        for ible in project_ibles:
-            link = f"/{ible['document']['urlString']}"
-            img = proxy(ible['document']['coverImageUrl'])
-
-            title = ible['document']['title']
-            author = ible['document']['screenName']
-            author_link = f"/member/{author}"
-
-            channel = ible['document']['primaryClassification']
-            channel_link = f"/channel/{channel}"
+        ibles = [project_card(ible) for ible in project_ibles]
 
-            views = ible['document']['views']
-            favorites = ible['document']['favorites']
-
-            ibles.append(
-                {
-                    "link": link,
-                    "img": img,
-                    "title": title,
-                    "author": author,
-                    "author_link": author_link,
-                    "channel": channel,
-                    "channel_link": channel_link,
-                    "views": views,
-                    "favorites": favorites,
-                }
-            )
-        
-        logger.debug(f"Processed {len(ibles)} projects for display")
+    prefetcher.queue(ible["img"] for ible in ibles)
 
     pagination = get_pagination(request, total, per_page)
-    logger.debug(f"Rendering project list template with {len(ibles)} projects")
-    
-    return render_template(
+    logger.debug(f"Rendering project list template for {path}")
+
+    stream = PageStream()
+    return stream.render(
         "projects.html",
         title=unslugify(head)[0],
-        ibles=ibles,
+        ibles=stream.items(ibles),
         path=path,
         pagination=pagination,
     )
@@ -399,17 +368,10 @@ def category_page(app, name, teachers=False):
     path = urlparse(request.path).path
     page = request.args.get("page", 1, type=int)
 
-    ibles = []
-    channels = []
     contests = []
 
     # Get channels for this category
-    for channel in app.global_ibles["/projects"]:
-        if (
-            channel["channel"].startswith(name.lower())
-            and channel["channel"] not in channels
-        ):
-            channels.append(channel["channel"])
+    channels = list(app.data_index.get_category_channels(name))
     
     logger.debug(f"Found {len(channels)} channels for category {name}")
 
@@ -427,46 +389,21 @@ def category_page(app, name, teachers=False):
     
     logger.debug(f"Found {len(category_ibles)} featured projects")
 
-    for ible in category_ibles:
-        link = f"/{ible['document']['urlString']}"
-        img = proxy(ible['document']['coverImageUrl'])
-
-        title = ible['document']['title']
-        author = ible['document']['screenName']
-        author_link = f"/member/{author}"
-
-        channel = ible['document']['primaryClassification']
-        channel_link = f"/channel/{channel}"
-
-        views = ible['document']['views']
-        favorites = ible['document']['favorites']
+    ibles = [project_card(ible) for ible in category_ibles]
+    prefetcher.queue(ible["img"] for ible in ibles)
 
-        ibles.append(
-            {
-                "link": link,
-                "img": img,
-                "title": title,
-                "author": author,
-                "author_link": author_link,
-                "channel": channel,
-                "channel_link": channel_link,
-                "views": views,
-                "favorites": favorites,
-            }
-        )
-
-    logger.debug(f"Rendering category page template with {len(ibles)} projects")
-    return render_template(
+    logger.debug(f"Rendering category page template for {name}")
+    stream = PageStream()
+    return stream.render(
         "category.html",
         title=name,
         channels=channels,
-        ibles=ibles,
+        ibles=stream.items(ibles),
         contests=contests,
         path=path,
     )
 
-def projects_search(
-    app,
+def get_search_args(
     query="*",
     category="",
     teachers=False,
@@ -476,13 +413,12 @@ def projects_search(
     per_page=50,
     query_by="title,stepBody,screenName",
     sort_by="publishDate:desc",
-    timeout=5,
-    typesense_api_key=None,
 ):
-    """Search for projects using the Typesense API.
-    
+    """Build the Typesense parameters for a project search.
+
+    The parameters are not URL encoded.
+
     Args:
-        app: The Flask app instance.
         query (str, optional): The search query.
         category (str, optional): The category to filter by.
         teachers (bool, optional): Whether to filter for teacher projects.
@@ -492,11 +428,9 @@ def projects_search(
         per_page (int, optional): The number of results per page.
         query_by (str, optional): The fields to query.
         sort_by (str, optional): The sort order.
-        timeout (int, optional): The request timeout.
-        typesense_api_key (str, optional): The Typesense API key.
-        
+
     Returns:
-        tuple: A tuple of (projects, total_pages).
+        dict: The search parameters.
     """
     # Build filter string
     if category:
@@ -514,14 +448,7 @@ def projects_search(
             filter_by += " && "
         filter_by += "teachers:=Teachers"
 
-    query = quote(query)
-    filter_by = quote(filter_by)
-
-    logger.debug(f"Searching projects: query='{query}', filter='{filter_by}', page={page}, per_page={per_page}")
-
-    projects_headers = {"x-typesense-api-key": app.config["TYPESENSE_API_KEY"]}
-
-    request_args = {
+    return {
         "q": query,
         "query_by": query_by,
         "page": page,
@@ -531,15 +458,66 @@ def projects_search(
         "per_page": per_page,
     }
 
+def projects_search(
+    app,
+    query="*",
+    category="",
+    teachers=False,
+    channel="",
+    filter_by="",
+    page=1,
+    per_page=50,
+    query_by="title,stepBody,screenName",
+    sort_by="publishDate:desc",
+    timeout=5,
+    typesense_api_key=None,
+):
+    """Search for projects using the Typesense API.
+    
+    Args:
+        app: The Flask app instance.
+        query (str, optional): The search query.
+        category (str, optional): The category to filter by.
+        teachers (bool, optional): Whether to filter for teacher projects.
+        channel (str, optional): The channel to filter by.
+        filter_by (str, optional): Additional filter criteria.
+        page (int, optional): The page number.
+        per_page (int, optional): The number of results per page.
+        query_by (str, optional): The fields to query.
+        sort_by (str, optional): The sort order.
+        timeout (int, optional): The request timeout.
+        typesense_api_key (str, optional): The Typesense API key.
+        
+    Returns:
+        tuple: A tuple of (projects, total_pages).
+    """
+    request_args = get_search_args(
+        query=query,
+        category=category,
+        teachers=teachers,
+        channel=channel,
+        filter_by=filter_by,
+        page=page,
+        per_page=per_page,
+        query_by=query_by,
+        sort_by=sort_by,
+    )
+    request_args["q"] = quote(request_args["q"])
+    request_args["filter_by"] = quote(request_args["filter_by"])
+
+    logger.debug(f"Searching projects: query='{request_args['q']}', filter='{request_args['filter_by']}', page={page}, per_page={per_page}")
+
     args_str = "&".join([f"{key}={value}" for key, value in request_args.items()])
 
     url = f"https://www.instructables.com/api_proxy/search/collections/projects/documents/search?{args_str}"
     logger.debug(f"Making request to {url}")
     
     try:
-        projects_request = Request(url, headers=projects_headers)
-        projects_data = urlopen(projects_request, timeout=timeout)
-        project_obj = json.loads(projects_data.read().decode())
+        project_obj = with_api_key(
+            lambda headers: fetch_json(
+                url, headers=headers, timeout=timeout, cache="search"
+            )
+        )
         project_ibles = project_obj["hits"]
         total_found = project_obj["found"]
         
@@ -548,4 +526,163 @@ def projects_search(
         return project_ibles, math.ceil(total_found / per_page)
     except Exception as e:
         logger.error(f"Error searching projects: {str(e)}")
-        return [], 0
\ No newline at end of file
+        return [], 0
+
+def projects_multi_search(app, searches, timeout=5):
+    """Run several project searches in a single Typesense request.
+
+    Args:
+        app: The Flask app instance.
+        searches (list): A list of dictionaries with the keyword arguments of
+            `get_search_args` for each search.
+        timeout (int, optional): The request timeout.
+
+    Returns:
+        list: A list of (projects, total_pages) tuples, one per search.
+
+    Raises:
+        Exception: If the request or any of the searches fails.
+    """
+    body = {
+        "searches": [
+            dict(get_search_args(**search), collection="projects")
+            for search in searches
+        ]
+    }
+
+    logger.debug(f"Running {len(searches)} project searches in one request")
+
+    def search(headers):
+        with fetch(
+            "https://www.instructables.com/api_proxy/search/multi_search",
+            headers=dict(headers, **{"Content-Type": "application/json"}),
+            timeout=timeout,
+            method="POST",
+            body=json.dumps(body).encode(),
+        ) as response:
+            return json.loads(response.read().decode())
+
+    data = with_api_key(search)
+
+    results = []
+    for search_args, result in zip(body["searches"], data["results"]):
+        if "error" in result:
+            raise ValueError(f"Search failed: {result['error']}")
+
+        results.append(
+            (result["hits"], math.ceil(result["found"] / search_args["per_page"]))
+        )
+
+    return results
+
+def remember_channel_name(key, name):
+    """Remember the channel name that returned projects for a slug.
+
+    Args:
+        key (tuple): The category and the slug of the channel.
+        name (str): The channel name.
+    """
+    with channel_names_lock:
+        channel_names[key] = name
+        channel_names.move_to_end(key)
+
+        if len(channel_names) > MAX_CHANNEL_NAMES:
+            channel_names.popitem(last=False)
+
+def channel_search(app, category, channel, per_page=50, page=1):
+    """Search for the projects of a channel, given as a slug.
+
+    The name of the channel is looked up in the sitemap. Otherwise, a slug
+    can match several channel names, which are all searched in a single
+    request. The first name returning projects is remembered, so later
+    searches for the same slug only query that name.
+
+    Args:
+        app: The Flask app instance.
+        category (str): The category of the channel.
+        channel (str): The slug of the channel, or an empty string for all
+            channels in the category.
+        per_page (int, optional): The number of results per page.
+        page (int, optional): The page number.
+
+    Returns:
+        tuple: A tuple of (projects, total_pages).
+    """
+    key = (category, channel)
+
+    with channel_names_lock:
+        channel_name = channel_names.get(key)
+
+    if channel_name is not None:
+        logger.debug(f"Using known channel name: {channel_name}")
+        return projects_search(
+            app, category=category, channel=channel_name, per_page=per_page, page=page
+        )
+
+    candidates = unslugify(channel)
+
+    # The sitemap lists the names of most channels
+    sitemap_name = app.data_index.get_channel_name(channel)
+
+    if sitemap_name is not None:
+        logger.debug(f"Trying channel name from sitemap: {sitemap_name}")
+        project_ibles, total = projects_search(
+            app, category=category, channel=sitemap_name, per_page=per_page, page=page
+        )
+
+        if project_ibles:
+            remember_channel_name(key, sitemap_name)
+            return project_ibles, total
+
+        candidates = [name for name in candidates if name != sitemap_name]
+        if not candidates:
+            return project_ibles, total
+
+    if len(candidates) == 1:
+        results = [
+            projects_search(
+                app,
+                category=category,
+                channel=candidates[0],
+                per_page=per_page,
+                page=page,
+            )
+        ]
+    else:
+        try:
+            results = projects_multi_search(
+                app,
+                [
+                    {
+                        "category": category,
+                        "channel": channel_name,
+                        "per_page": per_page,
+                        "page": page,
+                    }
+                    for channel_name in candidates
+                ],
+            )
+        except Exception as e:
+            logger.warning(f"Multi search failed, searching one by one: {str(e)}")
+            results = []
+            for channel_name in candidates:
+                logger.debug(f"Trying channel name: {channel_name}")
+                results.append(
+                    projects_search(
+                        app,
+                        category=category,
+                        channel=channel_name,
+                        per_page=per_page,
+                        page=page,
+                    )
+                )
+                if results[-1][0]:
+                    break
+
+    for channel_name, (project_ibles, total) in zip(candidates, results):
+        if project_ibles:
+            logger.debug(f"Found {len(project_ibles)} projects for {channel_name}")
+            remember_channel_name(key, channel_name)
+            return project_ibles, total
+
+    return results[-1]
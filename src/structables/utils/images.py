@@ -0,0 +1,354 @@
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from markupsafe import Markup, escape
+import logging
+import multiprocessing
+import os
+import threading
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+from .singleflight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+# Widths that variants are generated in. Requested widths are rounded up to
+# the next one, so that each image has only a few variants in the cache.
+WIDTHS = (160, 320, 480, 640, 960, 1280)
+
+# Requested qualities are rounded to a multiple of this, for the same reason
+QUALITY_STEP = 5
+MIN_QUALITY = 10
+MAX_QUALITY = 95
+
+# Output formats that can be negotiated, in order of preference
+FORMATS = {
+    "avif": ("AVIF", "image/avif"),
+    "webp": ("WEBP", "image/webp"),
+}
+
+# Content types of the formats variants are written in
+CONTENT_TYPES = {
+    "AVIF": "image/avif",
+    "WEBP": "image/webp",
+    "JPEG": "image/jpeg",
+    "PNG": "image/png",
+}
+
+# Content types of originals that can be resized
+SOURCE_TYPES = ("image/jpeg", "image/png", "image/webp", "image/gif", "image/bmp")
+
+# Larger originals are always sent as they are
+MAX_SOURCE_SIZE = 32 * 1024 * 1024
+
+# Seconds a request waits for a worker process to resize an image before the
+# original is sent instead
+RESIZE_TIMEOUT = 5
+
+# Number of variants remembered as not worth generating per process
+MAX_UNSUPPORTED = 1024
+
+
+def remove_variant(dest_path):
+    """Remove a variant written after its request stopped waiting for it.
+
+    Args:
+        dest_path (str): The path the variant was written to.
+    """
+    try:
+        os.remove(dest_path)
+    except OSError:
+        pass
+
+
+def make_variant(source_path, dest_path, width, quality, format):
+    """Write a resized copy of an image. Runs in a worker process.
+
+    Args:
+        source_path (str): The path of the original image.
+        dest_path (str): The path to write the variant to.
+        width (int): The maximum width of the variant.
+        quality (int): The encoder quality.
+        format (str): The Pillow format to write, or None to keep JPEG
+            images as JPEG and write other images as PNG.
+
+    Returns:
+        str: The content type of the variant, or None if the image is
+            animated, or already small enough and in the requested format.
+    """
+    with Image.open(source_path) as image:
+        if getattr(image, "is_animated", False):
+            return None
+
+        if format is None:
+            format = "JPEG" if image.format == "JPEG" else "PNG"
+
+        if image.width <= width and image.format == format:
+            return None
+
+        # Lets JPEG images be decoded at a reduced scale. Both sides are kept
+        # at least as large as the width, in case the image is rotated.
+        image.draft(None, (width, width))
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((width, image.height))
+
+        if format == "JPEG":
+            if image.mode not in ("RGB", "L"):
+                image = image.convert("RGB")
+            options = {"quality": quality, "optimize": True, "progressive": True}
+        elif format == "PNG":
+            if image.mode not in ("RGB", "RGBA", "L", "LA", "P"):
+                image = image.convert("RGBA")
+            options = {"optimize": True}
+        else:
+            if image.mode not in ("RGB", "RGBA"):
+                image = image.convert("RGBA" if "A" in image.getbands() else "RGB")
+            options = {"quality": quality}
+
+        image.save(dest_path, format, **options)
+
+    return CONTENT_TYPES[format]
+
+
+class ImageResizer:
+    """Generates smaller variants of proxied images in worker processes.
+
+    Variants are written as separate entries of the proxy cache, keyed by
+    the URL of the original and the requested width, quality and format.
+    Resizing happens in a process pool, so that it neither blocks the
+    request threads nor holds the GIL. The pool is started with "spawn" to
+    keep the worker processes independent of the server's threads.
+    """
+
+    def __init__(self):
+        self.workers = 0
+        self.quality = 75
+        self.formats = ()
+        self.lock = threading.Lock()
+        self.executor = None
+        self.calls = SingleFlight()
+        self.unsupported = set()
+        self.stats = {
+            "resized": 0,
+            "unsupported": 0,
+            "failed": 0,
+            "timeouts": 0,
+            "source_bytes": 0,
+            "variant_bytes": 0,
+        }
+
+    @property
+    def enabled(self):
+        return Image is not None and self.workers > 0
+
+    def configure(self, workers, quality, formats):
+        """Set up the resizer.
+
+        Args:
+            workers (int): The number of worker processes, or 0 to disable
+                resizing.
+            quality (int): The quality used if none is requested.
+            formats (list): The names of the formats to negotiate, from
+                `FORMATS`, in order of preference.
+        """
+        if workers > 0 and Image is None:
+            logger.info("Pillow is not installed - image resizing is disabled")
+
+        self.workers = workers
+        self.quality = self.get_quality(quality)
+
+        if Image is not None:
+            Image.init()
+
+        self.formats = []
+        for name in formats:
+            if name not in FORMATS:
+                logger.warning(f"Unknown image format {name} - ignoring")
+            elif Image is not None and FORMATS[name][0] not in Image.SAVE:
+                logger.info(f"Pillow cannot write {name} images - ignoring")
+            else:
+                self.formats.append(name)
+
+        logger.debug(
+            f"Image resizing: {self.enabled}, formats: {', '.join(self.formats)}"
+        )
+
+    @staticmethod
+    def get_width(value):
+        """Round a requested width up to the next width of `WIDTHS`.
+
+        Args:
+            value (str): The width parameter, or None.
+
+        Returns:
+            int: The width, or None if no valid width was requested.
+        """
+        try:
+            width = int(value)
+        except (TypeError, ValueError):
+            return None
+
+        if width <= 0:
+            return None
+
+        for size in WIDTHS:
+            if size >= width:
+                return size
+        return WIDTHS[-1]
+
+    def get_quality(self, value):
+        """Round and clamp a requested quality.
+
+        Args:
+            value (str): The quality parameter, or None.
+
+        Returns:
+            int: The quality.
+        """
+        try:
+            quality = int(value)
+        except (TypeError, ValueError):
+            return self.quality
+
+        quality = round(quality / QUALITY_STEP) * QUALITY_STEP
+        return min(max(quality, MIN_QUALITY), MAX_QUALITY)
+
+    def negotiate(self, accept):
+        """Pick the output format from an Accept header.
+
+        Only formats the client lists explicitly are used, since wildcards
+        do not mean that a browser can decode them.
+
+        Args:
+            accept (MIMEAccept): The parsed Accept header of the request.
+
+        Returns:
+            str: The name of the format, or None to keep the original format.
+        """
+        accepted = {value for value, quality in accept if quality > 0}
+
+        for name in self.formats:
+            if FORMATS[name][1] in accepted:
+                return name
+        return None
+
+    def resize(self, key, source, dest_path, width, quality, format):
+        """Write a variant of an image, waiting for a worker process.
+
+        Args:
+            key (str): The cache URL of the variant.
+            source (CacheEntry): The cache entry of the original.
+            dest_path (str): The path to write the variant to.
+            width (int): The maximum width of the variant.
+            quality (int): The encoder quality.
+            format (str): The name of the format, or None.
+
+        Returns:
+            str: The content type of the variant, or None if the original
+                should be sent instead.
+        """
+        with self.lock:
+            if key in self.unsupported:
+                return None
+
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+            executor = self.executor
+
+        future = executor.submit(
+            make_variant,
+            source.path,
+            dest_path,
+            width,
+            quality,
+            FORMATS[format][0] if format else None,
+        )
+
+        try:
+            content_type = future.result(timeout=RESIZE_TIMEOUT)
+        except TimeoutError:
+            logger.warning(f"Timed out resizing {source.path}")
+            # A running task cannot be cancelled, so its file is removed
+            # once it is done
+            if not future.cancel():
+                future.add_done_callback(lambda _: remove_variant(dest_path))
+            self.count("timeouts")
+            return None
+        except Exception as e:
+            logger.warning(f"Failed to resize {source.path}: {str(e)}")
+            self.count("failed")
+            return None
+
+        if content_type is None:
+            self.count("unsupported")
+            with self.lock:
+                if len(self.unsupported) >= MAX_UNSUPPORTED:
+                    self.unsupported.clear()
+                self.unsupported.add(key)
+            return None
+
+        self.count("resized")
+        self.count("source_bytes", source.size)
+        self.count("variant_bytes", os.path.getsize(dest_path))
+        return content_type
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.stats[name] += value
+
+    def reset(self):
+        """Forget the worker processes of the parent process after a fork."""
+        self.lock = threading.Lock()
+        self.executor = None
+        self.calls = SingleFlight()
+        self.unsupported = set()
+
+    def get_stats(self):
+        with self.lock:
+            stats = dict(self.stats)
+            stats["enabled"] = self.enabled
+            stats["formats"] = list(self.formats)
+            return stats
+
+
+def srcset(url, sizes):
+    """Template filter adding `srcset` and `sizes` attributes for the resized
+    variants of a proxied image.
+
+    Args:
+        url (str): The proxy URL of the image.
+        sizes (str): The value of the `sizes` attribute.
+
+    Returns:
+        Markup: The attributes, or an empty string if resizing is disabled.
+    """
+    if not url or not resizer.enabled:
+        return ""
+
+    candidates = ", ".join(f"{url}&w={width} {width}w" for width in WIDTHS)
+    return Markup(f'srcset="{escape(candidates)}" sizes="{escape(sizes)}"')
+
+
+def init_images(app):
+    """Configure image resizing from the app config.
+
+    Args:
+        app: The Flask app instance.
+    """
+    resizer.configure(
+        app.config["IMAGE_RESIZE_WORKERS"],
+        app.config["IMAGE_QUALITY"],
+        app.config["IMAGE_FORMATS"],
+    )
+    app.add_template_filter(srcset)
+
+
+resizer = ImageResizer()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=resizer.reset)
@@ -0,0 +1,98 @@
+from types import MappingProxyType
+import logging
+
+logger = logging.getLogger(__name__)
+
+# The categories with their own pages
+CATEGORIES = ("circuits", "workshop", "craft", "cooking", "living", "outside", "teachers")
+
+
+def get_channel_slug(link):
+    """Get the slug of a channel from its link.
+
+    Args:
+        link (str): The link of the channel, e.g. "/circuits/arduino/".
+
+    Returns:
+        str: The slug, e.g. "arduino".
+    """
+    return link.rstrip("/").rsplit("/", 1)[-1]
+
+
+class DataIndex:
+    """Lookup tables built from the featured projects and the sitemap.
+
+    An index is never modified. When the data changes, a new index is built
+    and replaces the old one.
+
+    Args:
+        projects (list): The featured projects.
+        sitemap (list): The sitemap groups, as dictionaries with the
+            "name", "link" and "channels" of each category.
+    """
+
+    def __init__(self, projects=(), sitemap=()):
+        channel_projects = {}
+        for project in projects:
+            channel_projects.setdefault(project["channel"], []).append(project)
+
+        # Channels of featured projects, by the category their name starts with
+        category_channels = {}
+        for channel in channel_projects:
+            for category in CATEGORIES:
+                if channel.startswith(category):
+                    category_channels.setdefault(category, []).append(channel)
+
+        channel_names = {}
+        for group in sitemap:
+            for name, link in group["channels"]:
+                channel_names.setdefault(get_channel_slug(link), name)
+
+        self.category_channels = MappingProxyType(
+            {
+                category: tuple(channels)
+                for category, channels in category_channels.items()
+            }
+        )
+        self.channel_names = MappingProxyType(channel_names)
+        self.channel_projects = MappingProxyType(
+            {channel: tuple(items) for channel, items in channel_projects.items()}
+        )
+
+        logger.debug(
+            f"Built data index with {len(self.channel_projects)} featured channels "
+            f"and {len(self.channel_names)} sitemap channels"
+        )
+
+    def get_category_channels(self, category):
+        """Get the channels of a category with featured projects.
+
+        Args:
+            category (str): The category name.
+
+        Returns:
+            tuple: The channel names.
+        """
+        return self.category_channels.get(category.lower(), ())
+
+    def get_channel_name(self, slug):
+        """Get the display name of a channel.
+
+        Args:
+            slug (str): The slug of the channel.
+
+        Returns:
+            str: The name of the channel, or None if it is not in the sitemap.
+        """
+        return self.channel_names.get(slug)
+
+    def get_channel_projects(self, channel):
+        """Get the featured projects of a channel.
+
+        Args:
+            channel (str): The channel name.
+
+        Returns:
+            tuple: The projects.
+        """
+        return self.channel_projects.get(channel, ())
@@ -0,0 +1,487 @@
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from .buffers import DEFAULT_CHUNK_SIZE, get_chunk_size, read_chunk
+
+logger = logging.getLogger(__name__)
+
+# A claimed temporary file that has not been written to for this long is
+# assumed to belong to a crashed worker and may be taken over
+STALE_TEMP_AGE = 10 * 60
+
+
+class FillReader:
+    """One client's view of a cache fill.
+
+    Iterating yields the body from the start, waiting for more bytes while the
+    download is still in progress. The reader must be closed, which WSGI
+    servers do for response iterables.
+
+    Args:
+        fill (CacheFill): The fill to read from.
+        file (file): A file object opened on the fill's temporary file.
+    """
+
+    def __init__(self, fill, file):
+        self.fill = fill
+        self.file = file
+        self.offset = 0
+        self.closed = False
+
+    def wait(self):
+        """Wait until the upstream response is available.
+
+        Raises:
+            Exception: The error the upstream request failed with.
+        """
+        try:
+            self.fill.wait_ready()
+        except BaseException:
+            self.close()
+            raise
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        chunk = self.fill.read(self)
+        if not chunk:
+            self.close()
+            raise StopIteration
+        return chunk
+
+    def close(self):
+        if self.closed:
+            return
+
+        self.closed = True
+        self.file.close()
+        self.fill.detach()
+
+
+class CacheFill:
+    """A download of one upstream response into a temporary cache file.
+
+    Any number of readers can stream the body while it is downloaded. The
+    reader that runs out of bytes first reads the next chunk from upstream, so
+    the download continues as long as at least one client is connected. When
+    the last client leaves, the registry may finish the download in the
+    background instead of aborting it.
+
+    Args:
+        key (str): The key of the fill in its registry.
+        registry (FillRegistry): The registry the fill belongs to.
+        temp_base (str): The path to name the temporary file after, as
+            returned by `ProxyCache.prepare_path()`.
+    """
+
+    def __init__(self, key, registry, temp_base):
+        self.key = key
+        self.registry = registry
+        self.temp_base = temp_base
+        self.condition = threading.Condition()
+        self.response = None
+        self.error = None
+        self.on_complete = None
+        self.chunk_size = DEFAULT_CHUNK_SIZE
+        self.size = 0
+        self.done = False
+        self.driving = False
+        self.detached = False
+        self.readers = 0
+        self.temp_path, self.file, self.claimed = self.open_temp(temp_base)
+
+    @staticmethod
+    def open_temp(temp_base):
+        """Open a temporary file for a fill.
+
+        The temporary file named after the cache key is claimed exclusively,
+        so that only one process writes a given cache entry. If another process
+        holds the claim, a private temporary file is used instead, which is
+        discarded once the download is done.
+
+        Args:
+            temp_base (str): The path to name the temporary file after.
+
+        Returns:
+            tuple: A tuple of (temp_path, file, claimed).
+        """
+        temp_path = temp_base + ".tmp"
+
+        for _ in range(2):
+            try:
+                fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+                return temp_path, os.fdopen(fd, "wb"), True
+            except FileExistsError:
+                try:
+                    if time.time() - os.path.getmtime(temp_path) < STALE_TEMP_AGE:
+                        break
+                    logger.debug(f"Taking over stale temporary file: {temp_path}")
+                    os.remove(temp_path)
+                except OSError:
+                    pass
+
+        fd, temp_path = tempfile.mkstemp(
+            prefix=os.path.basename(temp_base) + ".",
+            suffix=".tmp",
+            dir=os.path.dirname(temp_base),
+        )
+        return temp_path, os.fdopen(fd, "wb"), False
+
+    @property
+    def status(self):
+        return self.response.status
+
+    @property
+    def content_type(self):
+        return self.response.headers.get("content-type")
+
+    @property
+    def content_length(self):
+        return self.response.headers.get("content-length")
+
+    def begin(self, response, on_complete=None):
+        """Start the download once the upstream response has arrived.
+
+        Args:
+            response (UpstreamResponse): The upstream response.
+            on_complete (callable, optional): Called with the fill once the
+                body was downloaded completely, to move the temporary file
+                into place.
+        """
+        with self.condition:
+            self.response = response
+            self.on_complete = on_complete
+            self.chunk_size = get_chunk_size(self.content_length)
+            self.condition.notify_all()
+
+    def fail(self, error):
+        """Mark the fill as failed and wake up all waiting readers.
+
+        Args:
+            error (Exception): The error to hand to the readers.
+        """
+        self.registry.remove(self)
+
+        with self.condition:
+            if self.done or self.error is not None:
+                return
+            self.error = error
+            self.driving = False
+            self.condition.notify_all()
+
+        if self.response is not None:
+            self.response.close()
+
+        self.file.close()
+        self.remove_temp()
+        self.registry.count("aborted")
+
+    def wait_ready(self):
+        with self.condition:
+            while self.response is None and self.error is None:
+                self.condition.wait()
+
+            if self.response is None:
+                raise self.error
+
+    def attach(self):
+        """Open a new reader on the fill. Called with the registry lock held.
+
+        Returns:
+            FillReader: The new reader.
+        """
+        file = open(self.temp_path, "rb")
+
+        with self.condition:
+            self.readers += 1
+
+        return FillReader(self, file)
+
+    def detach(self):
+        with self.registry.lock:
+            with self.condition:
+                self.readers -= 1
+                abandoned = (
+                    self.readers == 0
+                    and not self.done
+                    and self.error is None
+                    and not self.detached
+                )
+
+            if abandoned and self.registry.finish_in_background(self):
+                logger.debug(f"All clients left, finishing download of {self.key}")
+                self.detached = True
+                abandoned = False
+
+            # Nobody may join a fill that is about to be aborted
+            if abandoned and self.registry.fills.get(self.key) is self:
+                del self.registry.fills[self.key]
+
+        if abandoned:
+            logger.debug(f"All clients left, aborting download of {self.key}")
+            self.fail(ConnectionAbortedError("All clients disconnected"))
+
+    def read(self, reader):
+        """Read the next chunk of the body for a reader.
+
+        Args:
+            reader (FillReader): The reader to read for.
+
+        Returns:
+            bytes: The next chunk, or an empty bytes object at the end of the
+                body or if the download failed.
+        """
+        while True:
+            with self.condition:
+                while (
+                    reader.offset >= self.size
+                    and self.driving
+                    and not self.done
+                    and self.error is None
+                ):
+                    self.condition.wait()
+
+                if reader.offset < self.size:
+                    end = self.size
+                    break
+
+                if self.done or self.error is not None:
+                    return b""
+
+                self.driving = True
+
+            chunk = self.advance()
+            if chunk:
+                reader.offset += len(chunk)
+                return chunk
+
+        reader.file.seek(reader.offset)
+        chunk = reader.file.read(min(end - reader.offset, self.chunk_size))
+        reader.offset += len(chunk)
+        return chunk
+
+    def advance(self):
+        """Download the next chunk from upstream into the temporary file.
+
+        Returns:
+            bytes: The downloaded chunk, or an empty bytes object once the
+                download is finished.
+        """
+        try:
+            # The chunk is written to the file and returned from one buffer
+            chunk = read_chunk(self.response, self.chunk_size, self.file)
+            if chunk:
+                self.file.flush()
+        except Exception as e:
+            logger.error(f"Error downloading {self.key}: {str(e)}")
+            self.fail(e)
+            return b""
+
+        if not chunk:
+            self.complete()
+            return b""
+
+        with self.condition:
+            self.size += len(chunk)
+            self.driving = False
+            self.condition.notify_all()
+
+        return chunk
+
+    def finish(self):
+        """Download the rest of the body without any reader."""
+        limit = self.registry.max_detached_size
+
+        while True:
+            with self.condition:
+                # A client may have joined again and be downloading
+                while self.driving and not self.done and self.error is None:
+                    self.condition.wait()
+
+                if self.done or self.error is not None:
+                    break
+                self.driving = True
+
+            if self.size > limit:
+                self.fail(ValueError(f"Download exceeds {limit} bytes"))
+                break
+
+            self.advance()
+
+        if self.done:
+            self.registry.count("detached_completed")
+            self.registry.count("saved_bytes", self.size)
+        else:
+            logger.debug(f"Detached download of {self.key} failed: {self.error}")
+            self.registry.count("detached_failed")
+
+    def complete(self):
+        """Finish the download and move the temporary file into place."""
+        self.file.close()
+
+        # Nobody may join once the temporary file is about to be moved, but
+        # moving it and updating the index must not block other fills
+        self.registry.remove(self)
+
+        if self.claimed and self.status == 200 and self.on_complete is not None:
+            self.on_complete(self)
+        else:
+            self.remove_temp()
+
+        with self.condition:
+            self.done = True
+            self.driving = False
+            self.condition.notify_all()
+
+        self.registry.count("completed")
+
+    def remove_temp(self):
+        try:
+            os.remove(self.temp_path)
+        except FileNotFoundError:
+            pass
+        except OSError:
+            logger.warning(f"Failed to remove temporary cache file: {self.temp_path}")
+
+
+class FillRegistry:
+    """A registry of the cache fills in progress in this process.
+
+    The first request for a URL that misses the cache starts a fill, and all
+    later requests for the same URL stream from it until it is finished.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.fills = {}
+        self.max_detached_size = 0
+        self.workers = 0
+        self.detached = 0
+        self.executor = None
+        self.stats = {
+            "started": 0,
+            "joined": 0,
+            "completed": 0,
+            "aborted": 0,
+            "detached": 0,
+            "detached_completed": 0,
+            "detached_failed": 0,
+            "detached_rejected": 0,
+            "saved_bytes": 0,
+        }
+
+    def configure(self, max_detached_size, workers):
+        """Set the limits for finishing downloads without clients.
+
+        Args:
+            max_detached_size (int): The maximum size of a file downloaded
+                after all clients left, or 0 to abort such downloads.
+            workers (int): The number of background threads finishing
+                downloads. As many downloads can wait for a thread.
+        """
+        self.max_detached_size = max_detached_size
+        self.workers = workers
+
+    def claim(self, key, temp_base):
+        """Join the fill for a key, or start a new one.
+
+        Args:
+            key (str): The key, usually the upstream URL.
+            temp_base (str): The path to name the temporary file after.
+
+        Returns:
+            tuple: A tuple of (reader, leader). If leader is True, the caller
+                must fetch the upstream response and pass it to `begin()` or
+                `fail()` on `reader.fill`.
+        """
+        with self.lock:
+            fill = self.fills.get(key)
+            leader = fill is None
+
+            if leader:
+                fill = CacheFill(key, self, temp_base)
+                self.fills[key] = fill
+                self.stats["started"] += 1
+            else:
+                self.stats["joined"] += 1
+
+            return fill.attach(), leader
+
+    def remove(self, fill):
+        with self.lock:
+            if self.fills.get(fill.key) is fill:
+                del self.fills[fill.key]
+
+    def finish_in_background(self, fill):
+        """Finish a fill without readers in a background thread, if it is
+        small enough and a thread is available. Called with the lock held.
+
+        Args:
+            fill (CacheFill): The fill.
+
+        Returns:
+            bool: True if the fill will be finished in the background.
+        """
+        if not self.max_detached_size or not self.workers or not fill.claimed:
+            return False
+
+        if fill.response is None or fill.status != 200:
+            return False
+
+        try:
+            too_large = int(fill.content_length) > self.max_detached_size
+        except (TypeError, ValueError):
+            too_large = False
+
+        if too_large or self.detached >= self.workers * 2:
+            self.stats["detached_rejected"] += 1
+            return False
+
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(
+                max_workers=self.workers, thread_name_prefix="cache-fill"
+            )
+
+        self.detached += 1
+        self.stats["detached"] += 1
+        self.executor.submit(self.run_detached, fill)
+        return True
+
+    def run_detached(self, fill):
+        try:
+            fill.finish()
+        except Exception as e:
+            logger.error(f"Error finishing download of {fill.key}: {str(e)}")
+            fill.fail(e)
+        finally:
+            with self.lock:
+                self.detached -= 1
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.stats[name] += value
+
+    def reset(self):
+        """Forget the fills and threads of the parent process after a fork."""
+        self.lock = threading.Lock()
+        self.fills = {}
+        self.detached = 0
+        self.executor = None
+
+    def get_stats(self):
+        with self.lock:
+            stats = dict(self.stats)
+            stats["in_flight"] = len(self.fills)
+            stats["detached_in_progress"] = self.detached
+            return stats
+
+
+fills = FillRegistry()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=fills.reset)
@@ -0,0 +1,276 @@
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
+from flask import Response, make_response, request
+from werkzeug.exceptions import HTTPException
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class CachedPage:
+    """A rendered page stored in the page cache."""
+
+    def __init__(self, name, response, ttl, max_stale, body):
+        self.name = name
+        self.created = time.time()
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self.status = response.status_code
+        self.content_type = response.content_type
+        self.body = body
+
+    @property
+    def stale(self):
+        return time.time() - self.created > self.ttl
+
+    @property
+    def expired(self):
+        return time.time() - self.created > self.ttl + self.max_stale
+
+    def to_response(self):
+        return Response(self.body, status=self.status, content_type=self.content_type)
+
+
+class PageCache:
+    """An in-process cache for fully rendered pages.
+
+    Stale entries are served immediately while a background thread renders
+    the page again. Entries that could not be refreshed for `max_stale`
+    seconds are dropped, and the page is rendered in the request instead.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.ttls = {}
+        self.max_entries = 0
+        self.max_stale = 0
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.refreshing = set()
+        self.executor = None
+        self.stats = {
+            "hits": 0,
+            "stale_hits": 0,
+            "expired": 0,
+            "misses": 0,
+            "refreshes": 0,
+            "refresh_errors": 0,
+        }
+
+    def configure(self, enabled, ttls, max_entries, max_stale):
+        self.enabled = enabled
+        self.ttls = {name: ttl for name, ttl in ttls.items() if ttl > 0}
+        self.max_entries = max_entries
+        self.max_stale = max_stale
+
+    def count(self, name):
+        with self.lock:
+            self.stats[name] += 1
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+            return entry
+
+    def remove(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def store(self, key, name, response):
+        """Store a response, if it can be cached.
+
+        Streamed responses are stored once they have been sent completely.
+
+        Args:
+            key (str): The cache key.
+            name (str): The name of the cached route.
+            response (Response): The rendered response.
+        """
+        if response.status_code != 200 or response.direct_passthrough:
+            return
+
+        if response.is_streamed:
+            response.response = self.tee(key, name, response, response.response)
+            return
+
+        self.add(key, self.make_entry(name, response, response.get_data()))
+
+    def make_entry(self, name, response, body):
+        return CachedPage(name, response, self.ttls[name], self.max_stale, body)
+
+    def tee(self, key, name, response, chunks):
+        body = []
+
+        try:
+            for chunk in chunks:
+                body.append(chunk.encode() if isinstance(chunk, str) else chunk)
+                yield chunk
+        finally:
+            if hasattr(chunks, "close"):
+                chunks.close()
+
+        # Only reached if the response was sent completely
+        self.add(key, self.make_entry(name, response, b"".join(body)))
+
+    def add(self, key, entry):
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, *names):
+        """Remove cached pages.
+
+        Args:
+            *names (str): The names of the routes whose pages to remove. If
+                none are given, all pages are removed.
+        """
+        with self.lock:
+            if not names:
+                self.entries.clear()
+                return
+
+            for key in [k for k, e in self.entries.items() if e.name in names]:
+                del self.entries[key]
+
+    def refresh(self, app, key, name, view, args, kwargs, path, query_string):
+        """Schedule a background render of a stale page.
+
+        The stale page is removed if the view now returns or raises a client
+        error, e.g. because the article was deleted.
+
+        Args:
+            app: The Flask app instance.
+            key (str): The cache key.
+            name (str): The name of the cached route.
+            view (callable): The view function.
+            args (tuple): The positional arguments of the view.
+            kwargs (dict): The keyword arguments of the view.
+            path (str): The request path.
+            query_string (bytes): The request query string.
+        """
+        with self.lock:
+            if key in self.refreshing:
+                return
+            self.refreshing.add(key)
+
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(
+                    max_workers=2, thread_name_prefix="page-cache"
+                )
+
+        def run():
+            try:
+                with app.test_request_context(path, query_string=query_string):
+                    try:
+                        response = make_response(view(*args, **kwargs))
+                    except HTTPException as e:
+                        response = e.get_response()
+                    # Render streamed pages completely within the request context
+                    response.make_sequence()
+
+                    if 400 <= response.status_code < 500:
+                        self.remove(key)
+                        logger.debug(
+                            f"Removed cached page {key}: {response.status_code}"
+                        )
+                        return
+
+                    self.store(key, name, response)
+                self.count("refreshes")
+                logger.debug(f"Refreshed cached page {key}")
+            except Exception as e:
+                self.count("refresh_errors")
+                logger.error(f"Error refreshing cached page {key}: {str(e)}")
+            finally:
+                with self.lock:
+                    self.refreshing.discard(key)
+
+        self.executor.submit(run)
+
+    def get_stats(self):
+        with self.lock:
+            stats = dict(self.stats)
+            stats["entries"] = len(self.entries)
+            return stats
+
+
+page_cache = PageCache()
+
+
+def cached_page(app, name):
+    """Cache the pages rendered by a view, if the page cache is enabled.
+
+    Pages are keyed by path and query string, and only successful responses
+    to GET requests are cached. Pages stale for longer than the maximum
+    staleness are rendered again before they are sent.
+
+    Args:
+        app: The Flask app instance.
+        name (str): The name of the route, used to look up its TTL.
+
+    Returns:
+        callable: The decorator.
+    """
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if (
+                not page_cache.enabled
+                or name not in page_cache.ttls
+                or request.method != "GET"
+            ):
+                return view(*args, **kwargs)
+
+            query_string = request.query_string
+            key = f"{app.config['THEME']}:{request.path}?{query_string.decode()}"
+
+            entry = page_cache.get(key)
+
+            if entry is not None and entry.expired:
+                page_cache.count("expired")
+                page_cache.remove(key)
+                entry = None
+
+            if entry is not None:
+                if entry.stale:
+                    page_cache.count("stale_hits")
+                    page_cache.refresh(
+                        app, key, name, view, args, kwargs, request.path, query_string
+                    )
+                else:
+                    page_cache.count("hits")
+
+                return entry.to_response()
+
+            page_cache.count("misses")
+            response = make_response(view(*args, **kwargs))
+            page_cache.store(key, name, response)
+            return response
+
+        return wrapper
+
+    return decorator
+
+
+def init_page_cache(app):
+    """Configure the page cache from the app config.
+
+    Args:
+        app: The Flask app instance.
+    """
+    page_cache.configure(
+        app.config["PAGE_CACHE_ENABLED"],
+        app.config["PAGE_CACHE_TTLS"],
+        app.config["PAGE_CACHE_MAX_ENTRIES"],
+        app.config["PAGE_CACHE_MAX_STALE"],
+    )
+    logger.debug(f"Page cache enabled: {page_cache.enabled}")
@@ -0,0 +1,180 @@
+from bs4 import BeautifulSoup, SoupStrainer, Tag
+import logging
+import re
+import soupsieve
+
+try:
+    import lxml  # noqa: F401
+except ImportError:
+    lxml = None
+
+logger = logging.getLogger(__name__)
+
+FALLBACK_PARSER = "html.parser"
+
+# The parser used for scraped pages, set by `init_parsing`
+parser = "lxml" if lxml else FALLBACK_PARSER
+
+
+def has_class(*names):
+    """Match elements with any of the given classes while parsing.
+
+    Strainers see the raw attribute value while parsing, so an element with
+    several classes would not match a plain class name.
+
+    Args:
+        *names (str): The class names.
+
+    Returns:
+        callable: A function to pass as `class_` to a SoupStrainer.
+    """
+    names = frozenset(names)
+
+    def match(value):
+        if value is None:
+            return False
+        classes = value.split() if isinstance(value, str) else value
+        return not names.isdisjoint(classes)
+
+    return match
+
+
+# The parts of the scraped pages each route reads
+EXPLORE = SoupStrainer(class_=has_class("home-content-explore-wrap"))
+SITEMAP = SoupStrainer("div", class_=has_class("sitemap-content"))
+MEMBER = SoupStrainer(class_=has_class("profile-header", "member-profile-body"))
+MEMBER_INSTRUCTABLES = SoupStrainer(
+    class_=has_class("profile-header", "ible-list-items")
+)
+CONTEST = SoupStrainer(["h1", "img", "article", "section"])
+
+
+def parse_html(markup, only=None, require=None):
+    """Parse a scraped HTML page.
+
+    Args:
+        markup (str): The HTML to parse.
+        only (SoupStrainer, optional): Only build the parts of the document
+            matching this strainer, including their descendants.
+        require (str, optional): A CSS selector that must match in the parsed
+            document. If it does not, the document is parsed again with
+            html.parser, which may handle broken markup differently.
+
+    Returns:
+        BeautifulSoup: The parsed document.
+    """
+    soup = BeautifulSoup(markup, parser, parse_only=only)
+
+    if parser != FALLBACK_PARSER and require and soup.select_one(require) is None:
+        logger.debug(f"No match for {require} using {parser}, trying {FALLBACK_PARSER}")
+        soup = BeautifulSoup(markup, FALLBACK_PARSER, parse_only=only)
+
+    return soup
+
+
+# The type selector at the start of the last compound selector
+TAG_NAME_PATTERN = re.compile(r"(?:^|[\s>+~])([a-zA-Z][\w-]*)[^\s>+~]*$")
+
+
+class Extractor:
+    """Find the first element matching each of several selectors.
+
+    Instead of running a query over the whole tree for every selector, the
+    tree is walked once, and each element is only matched against the
+    selectors for its tag name. The results are the same as taking the first
+    element of `select()` for each selector.
+
+    Args:
+        selectors (dict): A dictionary mapping names to CSS selectors. A
+            selector can also be a tuple of the name of another selector and
+            a CSS selector, to only match within the element found for that
+            selector, which must come first in document order.
+    """
+
+    def __init__(self, selectors):
+        self.names = list(selectors)
+        self.by_tag = {}
+        self.any_tag = []
+
+        for name, selector in selectors.items():
+            scope, css = selector if isinstance(selector, tuple) else (None, selector)
+            entry = (name, scope, soupsieve.compile(css))
+
+            if "," not in css and (match := TAG_NAME_PATTERN.search(css)):
+                self.by_tag.setdefault(match.group(1).lower(), []).append(entry)
+            else:
+                self.any_tag.append(entry)
+
+    def extract(self, root):
+        """Walk the descendants of an element once.
+
+        Args:
+            root (Tag): The element to search in.
+
+        Returns:
+            dict: The first matching element for each name, or None.
+        """
+        found = dict.fromkeys(self.names)
+        remaining = len(self.names)
+
+        for element in root.descendants:
+            if not isinstance(element, Tag):
+                continue
+
+            for name, scope, selector in self.by_tag.get(element.name, ()):
+                if found[name] is None and self.matches(found, element, scope, selector):
+                    found[name] = element
+                    remaining -= 1
+
+            for name, scope, selector in self.any_tag:
+                if found[name] is None and self.matches(found, element, scope, selector):
+                    found[name] = element
+                    remaining -= 1
+
+            if not remaining:
+                break
+
+        return found
+
+    @staticmethod
+    def matches(found, element, scope, selector):
+        if scope is not None:
+            parent = found[scope]
+            if parent is None or not any(p is parent for p in element.parents):
+                return False
+
+        return selector.match(element)
+
+
+def get_text(element, default=0):
+    """Get the text of an element found by an `Extractor`.
+
+    Args:
+        element (Tag): The element, or None if it was not found.
+        default (optional): The value to return if there is no element.
+
+    Returns:
+        The text of the element, or the default.
+    """
+    return element.text if element is not None else default
+
+
+def init_parsing(app):
+    """Select the HTML parser from the app config.
+
+    Args:
+        app: The Flask app instance.
+    """
+    global parser
+
+    name = app.config["HTML_PARSER"]
+
+    if name == "auto":
+        parser = "lxml" if lxml else FALLBACK_PARSER
+    elif name == "lxml" and not lxml:
+        logger.warning("lxml is not installed - using html.parser")
+        parser = FALLBACK_PARSER
+    else:
+        parser = name
+
+    logger.debug(f"HTML parser: {parser}")
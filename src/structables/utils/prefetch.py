@@ -0,0 +1,261 @@
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl, unquote, urlsplit
+import logging
+import os
+import threading
+import time
+
+from .proxy_cache import proxy_cache
+
+logger = logging.getLogger(__name__)
+
+# Upstream URLs served by the proxy
+PROXY_PREFIXES = (
+    "https://cdn.instructables.com/",
+    "https://content.instructables.com/",
+)
+
+# URLs waiting for a thread, per process. Further URLs are dropped.
+MAX_PENDING = 100
+
+# Number of prefetched URLs remembered per process to count whether they were
+# requested afterwards
+MAX_TRACKED = 10000
+
+
+def get_upstream_url(proxy_url):
+    """Get the upstream URL of a proxy URL, as the proxy route would.
+
+    Args:
+        proxy_url (str): The proxy URL, as returned by `proxy()`.
+
+    Returns:
+        str: The upstream URL, or None if the proxy would reject it.
+    """
+    for name, value in parse_qsl(urlsplit(proxy_url).query, keep_blank_values=True):
+        if name == "url":
+            if value.startswith(PROXY_PREFIXES):
+                return unquote(value)
+            return None
+    return None
+
+
+class Prefetcher:
+    """Downloads images into the proxy cache before browsers request them.
+
+    Pages queue the proxy URLs of the images they show while they are
+    rendered. A few background threads download them through the cache fills
+    of the proxy route, so a browser requesting an image while it is being
+    prefetched streams from the same download.
+
+    Prefetching never delays a page: at most `per_page` URLs of a page are
+    considered, URLs are dropped when the rate limit is exceeded or too many
+    are waiting, and the threads only download one URL each at a time.
+    """
+
+    def __init__(self):
+        self.workers = 0
+        self.per_page = 0
+        self.rate = 0
+        self.open_fill = None
+        self.lock = threading.Lock()
+        self.executor = None
+        self.pending = 0
+        self.tokens = 0
+        self.updated = time.monotonic()
+        self.prefetched = OrderedDict()
+        self.stats = {
+            "queued": 0,
+            "duplicate": 0,
+            "rate_limited": 0,
+            "queue_full": 0,
+            "already_cached": 0,
+            "fetched": 0,
+            "failed": 0,
+            "fetched_bytes": 0,
+            "used": 0,
+            "used_early": 0,
+            "unused": 0,
+        }
+
+    @property
+    def enabled(self):
+        return self.workers > 0 and proxy_cache.enabled
+
+    def configure(self, workers, per_page, rate, open_fill):
+        """Set up the prefetcher.
+
+        Args:
+            workers (int): The number of background threads, or 0 to disable
+                prefetching.
+            per_page (int): The maximum number of URLs queued per page.
+            rate (float): The maximum number of URLs queued per second. Up to
+                `per_page` URLs can be queued at once.
+            open_fill (callable): A function taking an upstream URL and
+                returning a reader on its download into the cache, or None.
+        """
+        self.workers = workers
+        self.per_page = per_page
+        self.rate = rate
+        self.open_fill = open_fill
+        self.tokens = per_page
+
+        logger.debug(
+            f"Prefetching: {self.enabled}, {per_page} per page, {rate} per second"
+        )
+
+    def queue(self, proxy_urls):
+        """Queue the images of a page for prefetching.
+
+        Args:
+            proxy_urls (iterable): The proxy URLs of the images, in the order
+                the browser will likely request them.
+        """
+        if not self.enabled:
+            return
+
+        urls = []
+        for proxy_url in proxy_urls:
+            if len(urls) >= self.per_page:
+                break
+            url = get_upstream_url(proxy_url) if proxy_url else None
+            if url is not None and url not in urls:
+                urls.append(url)
+
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(
+                self.per_page, self.tokens + (now - self.updated) * self.rate
+            )
+            self.updated = now
+
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(
+                    max_workers=self.workers, thread_name_prefix="prefetch"
+                )
+
+            for url in urls:
+                if url in self.prefetched:
+                    self.stats["duplicate"] += 1
+                    continue
+
+                if self.pending >= MAX_PENDING:
+                    self.stats["queue_full"] += 1
+                    continue
+
+                if self.tokens < 1:
+                    self.stats["rate_limited"] += 1
+                    continue
+
+                self.tokens -= 1
+                self.pending += 1
+                self.track(url)
+                self.stats["queued"] += 1
+                self.executor.submit(self.run, url)
+
+    def track(self, url):
+        """Remember a URL as prefetched. Called with the lock held.
+
+        Args:
+            url (str): The upstream URL.
+        """
+        self.prefetched[url] = False
+
+        if len(self.prefetched) > MAX_TRACKED:
+            self.prefetched.popitem(last=False)
+            self.stats["unused"] += 1
+
+    def run(self, url):
+        try:
+            size = self.prefetch(url)
+        except Exception as e:
+            logger.debug(f"Failed to prefetch {url}: {str(e)}")
+            size = None
+
+        with self.lock:
+            self.pending -= 1
+
+            if size is None:
+                self.stats["failed"] += 1
+            elif size:
+                self.stats["fetched"] += 1
+                self.stats["fetched_bytes"] += size
+            else:
+                self.stats["already_cached"] += 1
+
+            # Only downloads count towards the hit rate
+            if url in self.prefetched:
+                if size:
+                    self.prefetched[url] = True
+                else:
+                    del self.prefetched[url]
+
+    def prefetch(self, url):
+        """Download a URL into the cache, unless it is cached already.
+
+        Args:
+            url (str): The upstream URL.
+
+        Returns:
+            int: The size of the download, 0 if the URL was cached already,
+                or None if the download failed.
+        """
+        if proxy_cache.lookup(url) is not None:
+            return 0
+
+        reader = self.open_fill(url)
+        if reader is None:
+            return None
+
+        reader.wait()
+
+        if reader.fill.status != 200:
+            reader.close()
+            return None
+
+        logger.debug(f"Prefetching {url}")
+
+        # Reading the body drives the download to the end
+        size = 0
+        for chunk in reader:
+            size += len(chunk)
+
+        return size if reader.fill.done else None
+
+    def record_request(self, url):
+        """Count a request for a URL that may have been prefetched.
+
+        Args:
+            url (str): The upstream URL.
+        """
+        if not self.prefetched:
+            return
+
+        with self.lock:
+            done = self.prefetched.pop(url, None)
+            if done is not None:
+                self.stats["used" if done else "used_early"] += 1
+
+    def reset(self):
+        """Forget the threads and URLs of the parent process after a fork."""
+        self.lock = threading.Lock()
+        self.executor = None
+        self.pending = 0
+        self.prefetched = OrderedDict()
+        self.stats = dict.fromkeys(self.stats, 0)
+
+    def get_stats(self):
+        with self.lock:
+            stats = dict(self.stats)
+            stats["pending"] = self.pending
+            stats["tracked"] = len(self.prefetched)
+            used = stats["used"] + stats["used_early"]
+            stats["hit_rate"] = used / stats["fetched"] if stats["fetched"] else 0
+            return stats
+
+
+prefetcher = Prefetcher()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=prefetcher.reset)
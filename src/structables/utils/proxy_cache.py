@@ -0,0 +1,978 @@
+from collections import namedtuple
+import hashlib
+import logging
+import os
+import re
+import shutil
+import sqlite3
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from .inflight import STALE_TEMP_AGE
+
+logger = logging.getLogger(__name__)
+
+# Names of cache files written by the flat layout used before the index
+FLAT_NAME_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    content_type TEXT NOT NULL,
+    content_length INTEGER,
+    created REAL NOT NULL,
+    atime REAL NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0,
+    etag TEXT,
+    priority REAL NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS entries_created ON entries (created);
+
+-- Running totals, kept up to date by triggers on every write
+CREATE TABLE IF NOT EXISTS totals (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    entries INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    inflation REAL NOT NULL DEFAULT 0
+);
+INSERT OR IGNORE INTO totals (id, entries, size)
+    SELECT 0, COUNT(*), COALESCE(SUM(size), 0) FROM entries;
+CREATE TRIGGER IF NOT EXISTS entries_insert AFTER INSERT ON entries BEGIN
+    UPDATE totals SET entries = entries + 1, size = size + NEW.size;
+END;
+CREATE TRIGGER IF NOT EXISTS entries_update AFTER UPDATE OF size ON entries BEGIN
+    UPDATE totals SET size = size - OLD.size + NEW.size;
+END;
+CREATE TRIGGER IF NOT EXISTS entries_delete AFTER DELETE ON entries BEGIN
+    UPDATE totals SET entries = entries - 1, size = size - OLD.size;
+END;
+"""
+
+# Columns added after the first version of the index
+UPGRADES = [
+    ("entries", "priority", "REAL NOT NULL DEFAULT 0"),
+    ("totals", "inflation", "REAL NOT NULL DEFAULT 0"),
+]
+
+COLUMNS = "key, path, size, content_type, content_length, created, atime, hits, etag"
+
+# The GDSF priority of an entry is its number of requests per byte plus an
+# inflation value, which rises to the priority of each evicted entry so that
+# entries that were popular long ago are evicted eventually.
+
+# Replacing a row with INSERT OR REPLACE would not run the delete trigger
+UPSERT = f"""
+INSERT INTO entries ({COLUMNS}, priority)
+VALUES (?, ?, ?, ?, ?, ?, ?, 0, ?, (SELECT inflation FROM totals) + 1.0 / MAX(?, 1))
+ON CONFLICT (key) DO UPDATE SET
+    path = excluded.path,
+    size = excluded.size,
+    content_type = excluded.content_type,
+    content_length = excluded.content_length,
+    created = excluded.created,
+    atime = excluded.atime,
+    hits = 0,
+    etag = excluded.etag,
+    priority = excluded.priority
+"""
+
+RECORD_ACCESS = """
+UPDATE entries SET
+    hits = hits + ?,
+    atime = MAX(atime, ?),
+    priority = (SELECT inflation FROM totals) + (hits + ? + 1.0) / MAX(size, 1)
+WHERE key = ?
+"""
+
+# The order in which each eviction policy evicts entries
+POLICIES = {
+    "fifo": "created",
+    "lru": "atime",
+    "lfu": "hits, atime",
+    "gdsf": "priority",
+}
+
+# Number of distinct entries with buffered accesses at which the buffer is
+# written to the index
+ACCESS_BUFFER_SIZE = 1000
+
+# Seconds between checks of the cache size by the eviction worker
+EVICTION_POLL_INTERVAL = 10
+
+# Seconds to pause between eviction batches, so that writes by requests
+# are not held up
+EVICTION_BATCH_PAUSE = 0.05
+
+# Directory within the cache directory holding the files being downloaded,
+# so that orphaned ones can be found without walking the shards
+TEMP_DIRECTORY = "tmp"
+
+CacheEntry = namedtuple("CacheEntry", COLUMNS)
+
+
+def get_cache_key(url):
+    """Get the cache key of a URL.
+
+    Args:
+        url (str): The URL.
+
+    Returns:
+        str: The SHA-256 hash of the URL.
+    """
+    return hashlib.sha256(url.encode()).hexdigest()
+
+
+def get_etag(entry):
+    """Get the ETag to send for a cache entry.
+
+    Args:
+        entry (CacheEntry): The entry.
+
+    Returns:
+        str: The upstream ETag if it was a strong one, or an ETag for the
+            version of the file in the cache.
+    """
+    if entry.etag and entry.etag.startswith('"'):
+        return entry.etag
+    return f'"{entry.key[:32]}-{int(entry.created)}"'
+
+
+class ProxyCache:
+    """A disk cache of proxied files with a metadata index.
+
+    Files are stored in a two-level sharded directory tree ("ab/cd/abcd..."),
+    and their size, content type, upstream headers and access times are kept
+    in an SQLite database next to them. Lookups and cleanups query the
+    database instead of scanning the directory.
+
+    The database is shared by all worker processes. Each thread uses its own
+    connection, and connections are never used across a fork.
+
+    Cache hits are counted in memory and written to the index in batches by
+    `flush_accesses()`, so that serving a cached file does not write to the
+    database.
+    """
+
+    def __init__(self):
+        self.directory = None
+        self.max_age = 0
+        self.max_size = 0
+        self.policy = "lru"
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.accesses = {}
+        self.stats = {
+            "hits": 0,
+            "misses": 0,
+            "hit_bytes": 0,
+            "miss_bytes": 0,
+            "variant_hits": 0,
+            "variant_misses": 0,
+        }
+        # Called when the eviction worker has work to do
+        self.notify = None
+
+    @property
+    def enabled(self):
+        return self.directory is not None
+
+    def configure(
+        self, directory, max_age, max_size, policy="lru", legacy_directory=None
+    ):
+        """Set the cache directory, limits and policy, and create the index.
+
+        Args:
+            directory (str): The directory to store files in, or None to
+                disable the cache.
+            max_age (int): Seconds after which cached files expire.
+            max_size (int): The maximum total size of cached files in bytes.
+            policy (str, optional): The eviction policy, one of `POLICIES`.
+            legacy_directory (str, optional): A directory with files cached in
+                the flat layout, which are moved into the index.
+        """
+        self.directory = directory
+        self.max_age = max_age
+        self.max_size = max_size
+        self.policy = policy
+
+        if directory is None:
+            return
+
+        os.makedirs(os.path.join(directory, TEMP_DIRECTORY), exist_ok=True)
+
+        db = self.connect()
+        db.executescript(SCHEMA)
+
+        # Other workers may be upgrading the index at the same time
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            for table, column, definition in UPGRADES:
+                columns = [row[1] for row in db.execute(f"PRAGMA table_info({table})")]
+                if column not in columns:
+                    logger.debug(f"Adding column {column} to the {table} table")
+                    db.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+                    if column == "priority":
+                        db.execute(
+                            "UPDATE entries SET priority = (hits + 1.0) / MAX(size, 1)"
+                        )
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+
+        db.execute(
+            f"CREATE INDEX IF NOT EXISTS entries_{policy} "
+            f"ON entries ({POLICIES[policy]})"
+        )
+
+        if legacy_directory is not None:
+            self.migrate(legacy_directory)
+
+        # The app may be loaded before the server forks its workers
+        self.close()
+
+    def connect(self):
+        """Get the database connection of the current thread.
+
+        Returns:
+            sqlite3.Connection: The connection.
+        """
+        pid = os.getpid()
+        db = getattr(self.local, "db", None)
+
+        if db is None or self.local.pid != pid:
+            db = sqlite3.connect(
+                os.path.join(self.directory, "index.sqlite3"),
+                timeout=10,
+                isolation_level=None,
+            )
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self.local.db = db
+            self.local.pid = pid
+
+        return db
+
+    def close(self):
+        db = getattr(self.local, "db", None)
+        if db is not None and self.local.pid == os.getpid():
+            db.close()
+        self.local.db = None
+
+    def get_path(self, key):
+        """Get the path of the file for a cache key.
+
+        Args:
+            key (str): The cache key.
+
+        Returns:
+            str: The path relative to the cache directory.
+        """
+        return os.path.join(key[:2], key[2:4], key)
+
+    def prepare_path(self, url):
+        """Create the directory for the file of a URL.
+
+        Args:
+            url (str): The URL.
+
+        Returns:
+            str: The absolute path to name the temporary files of the URL
+                after, in the temporary directory.
+        """
+        key = get_cache_key(url)
+        path = os.path.join(self.directory, self.get_path(key))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return os.path.join(self.directory, TEMP_DIRECTORY, key)
+
+    def lookup(self, url):
+        """Find the cache entry for a URL.
+
+        Expired entries are removed.
+
+        Args:
+            url (str): The URL.
+
+        Returns:
+            CacheEntry: The entry, with an absolute path, or None if the URL
+                is not cached.
+        """
+        if not self.enabled:
+            return None
+
+        key = get_cache_key(url)
+
+        try:
+            row = (
+                self.connect()
+                .execute(f"SELECT {COLUMNS} FROM entries WHERE key = ?", (key,))
+                .fetchone()
+            )
+        except sqlite3.Error as e:
+            logger.warning(f"Failed to look up cache entry for {url}: {e}")
+            return None
+
+        if row is None:
+            return None
+
+        entry = CacheEntry(*row)
+
+        if time.time() - entry.created > self.max_age:
+            logger.debug(f"Cache entry expired: {url}")
+            self.remove(entry)
+            return None
+
+        return entry._replace(path=os.path.join(self.directory, entry.path))
+
+    def open(self, url, variant=False):
+        """Open the cached file for a URL and count the hit or miss.
+
+        Args:
+            url (str): The URL.
+            variant (bool, optional): Whether the URL names a resized variant
+                of an image. Variants are counted separately, as a request
+                missing its variant may still be served from the cache.
+
+        Returns:
+            tuple: A tuple of (entry, file), or (None, None) if the URL is not
+                cached. Entries whose file is gone are removed.
+        """
+        if not self.enabled:
+            return None, None
+
+        entry = self.lookup(url)
+
+        if entry is not None:
+            try:
+                file = open(entry.path, "rb")
+            except OSError:
+                logger.warning(f"Cache file is missing: {entry.path}")
+                self.remove(entry)
+            else:
+                self.record_hit(entry, variant)
+                return entry, file
+
+        with self.lock:
+            self.stats["variant_misses" if variant else "misses"] += 1
+
+        return None, None
+
+    def record_hit(self, entry, variant=False):
+        """Buffer an access to an entry.
+
+        Args:
+            entry (CacheEntry): The entry.
+            variant (bool, optional): Whether the entry is a resized variant.
+        """
+        with self.lock:
+            if variant:
+                self.stats["variant_hits"] += 1
+            else:
+                self.stats["hits"] += 1
+                self.stats["hit_bytes"] += entry.size
+
+            hits, _ = self.accesses.get(entry.key, (0, 0))
+            self.accesses[entry.key] = (hits + 1, time.time())
+            full = len(self.accesses) >= ACCESS_BUFFER_SIZE
+
+        if full and self.notify is not None:
+            self.notify()
+
+    def flush_accesses(self):
+        """Write the buffered accesses to the index."""
+        with self.lock:
+            accesses = self.accesses
+            self.accesses = {}
+
+        if not accesses:
+            return
+
+        db = self.connect()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            db.executemany(
+                RECORD_ACCESS,
+                (
+                    (hits, atime, hits, key)
+                    for key, (hits, atime) in accesses.items()
+                ),
+            )
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+
+        logger.debug(f"Recorded accesses to {len(accesses)} cache entries")
+
+    def store(
+        self,
+        url,
+        temp_path,
+        content_type,
+        content_length=None,
+        etag=None,
+        variant=False,
+    ):
+        """Move a completely downloaded file into the cache.
+
+        Args:
+            url (str): The URL the file was downloaded from.
+            temp_path (str): The path of the temporary file, named after the
+                path returned by `prepare_path()`.
+            content_type (str): The content type of the file.
+            content_length (str, optional): The upstream Content-Length.
+            etag (str, optional): The upstream ETag.
+            variant (bool, optional): Whether the file is a resized variant
+                of an image, which is not counted as downloaded bytes.
+        """
+        key = get_cache_key(url)
+        path = self.get_path(key)
+        cache_path = os.path.join(self.directory, path)
+
+        try:
+            size = os.path.getsize(temp_path)
+        except OSError:
+            logger.error(f"Temporary cache file is missing: {temp_path}")
+            return
+
+        try:
+            os.rename(temp_path, cache_path)
+        except OSError:
+            logger.warning(f"Failed to rename temporary cache file: {temp_path}")
+            # Try to copy and delete instead
+            try:
+                shutil.copy2(temp_path, cache_path)
+                os.remove(temp_path)
+            except OSError:
+                logger.error(f"Failed to cache content: {url}")
+                return
+
+        now = time.time()
+
+        try:
+            db = self.connect()
+            db.execute(
+                UPSERT,
+                (
+                    key,
+                    path,
+                    size,
+                    content_type,
+                    int(content_length) if content_length else None,
+                    now,
+                    now,
+                    etag,
+                    size,
+                ),
+            )
+            total_size = self.get_size()
+        except (sqlite3.Error, ValueError) as e:
+            logger.error(f"Failed to index cached content for {url}: {e}")
+            self.remove_file(cache_path)
+            return
+
+        logger.debug(f"Successfully cached content for: {url}")
+
+        if not variant:
+            with self.lock:
+                self.stats["miss_bytes"] += size
+
+        if total_size > self.max_size and self.notify is not None:
+            self.notify()
+
+    def remove(self, entry):
+        """Remove an entry and its file.
+
+        Only removes the entry if it was not replaced in the meantime.
+
+        Args:
+            entry (CacheEntry): The entry, as returned by `lookup()`.
+        """
+        try:
+            cursor = self.connect().execute(
+                "DELETE FROM entries WHERE key = ? AND created = ?",
+                (entry.key, entry.created),
+            )
+        except sqlite3.Error as e:
+            logger.warning(f"Failed to remove cache entry {entry.key}: {e}")
+            return
+
+        if cursor.rowcount:
+            self.remove_file(os.path.join(self.directory, entry.path))
+
+    def remove_file(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError:
+            logger.warning(f"Failed to remove cache file: {path}")
+
+    def evict(self, rows, inflate=False):
+        """Remove a list of entries and their files.
+
+        Args:
+            rows (list): Tuples of (key, path, size, created, priority).
+            inflate (bool, optional): Whether to raise the GDSF inflation
+                value to the priority of the evicted entries.
+
+        Returns:
+            int: The number of bytes freed.
+        """
+        freed = 0
+
+        db = self.connect()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            for key, path, size, created, _ in rows:
+                cursor = db.execute(
+                    "DELETE FROM entries WHERE key = ? AND created = ?",
+                    (key, created),
+                )
+                if cursor.rowcount:
+                    self.remove_file(os.path.join(self.directory, path))
+                    freed += size
+
+            if inflate and rows:
+                db.execute(
+                    "UPDATE totals SET inflation = MAX(inflation, ?)",
+                    (max(row[4] for row in rows),),
+                )
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+
+        return freed
+
+    def sweep_temp_files(self):
+        """Remove temporary files left behind by crashed workers.
+
+        Only the temporary directory is searched, so this does not walk the
+        cached files.
+
+        Returns:
+            int: The number of files removed.
+        """
+        removed = 0
+        cutoff = time.time() - STALE_TEMP_AGE
+
+        for file in os.scandir(os.path.join(self.directory, TEMP_DIRECTORY)):
+            if not file.name.endswith(".tmp"):
+                continue
+            try:
+                if file.stat().st_mtime < cutoff:
+                    os.remove(file.path)
+                    removed += 1
+            except OSError:
+                pass
+
+        if removed:
+            logger.debug(f"Removed {removed} orphaned temporary cache files")
+        return removed
+
+    def get_size(self):
+        """Get the total size of the cached files.
+
+        Returns:
+            int: The size in bytes.
+        """
+        return self.connect().execute("SELECT size FROM totals").fetchone()[0]
+
+    def get_expired(self, limit):
+        """Find expired entries.
+
+        Args:
+            limit (int): The maximum number of entries to return.
+
+        Returns:
+            list: Tuples of (key, path, size, created, priority).
+        """
+        return (
+            self.connect()
+            .execute(
+                "SELECT key, path, size, created, priority FROM entries "
+                "WHERE created < ? LIMIT ?",
+                (time.time() - self.max_age, limit),
+            )
+            .fetchall()
+        )
+
+    def get_victims(self, limit):
+        """Find the entries to evict first when the cache is too large.
+
+        Args:
+            limit (int): The maximum number of entries to return.
+
+        Returns:
+            list: Tuples of (key, path, size, created, priority), in the
+                order of the eviction policy.
+        """
+        return (
+            self.connect()
+            .execute(
+                "SELECT key, path, size, created, priority FROM entries "
+                f"ORDER BY {POLICIES[self.policy]} LIMIT ?",
+                (limit,),
+            )
+            .fetchall()
+        )
+
+    def migrate(self, legacy_directory):
+        """Move files cached in the flat layout into the index.
+
+        Each file was named after its key, with the content type in a ".meta"
+        file next to it. Leftover temporary files are removed.
+
+        Args:
+            legacy_directory (str): The directory of the flat cache.
+        """
+        rows = []
+
+        for name in os.listdir(legacy_directory):
+            source = os.path.join(legacy_directory, name)
+            key = name.split(".", 1)[0]
+            if not FLAT_NAME_PATTERN.match(key):
+                continue
+
+            if name.endswith(".tmp"):
+                self.remove_file(source)
+                continue
+            if name != key:
+                continue
+
+            meta_path = source + ".meta"
+            try:
+                with open(meta_path, "r") as f:
+                    content_type = f.read().strip()
+            except OSError:
+                content_type = "application/octet-stream"
+
+            path = self.get_path(key)
+            target = os.path.join(self.directory, path)
+
+            try:
+                stat = os.stat(source)
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                os.rename(source, target)
+            except OSError as e:
+                # Another worker may be migrating the same directory
+                logger.debug(f"Failed to migrate cache file {source}: {e}")
+                continue
+
+            rows.append(
+                (key, path, stat.st_size, content_type, stat.st_mtime, stat.st_atime)
+            )
+            self.remove_file(meta_path)
+
+        db = self.connect()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            db.executemany(
+                f"INSERT OR IGNORE INTO entries ({COLUMNS}, priority) "
+                "VALUES (?, ?, ?, ?, NULL, ?, ?, 0, NULL, 1.0 / MAX(?, 1))",
+                (row + (row[2],) for row in rows),
+            )
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+
+        # Metadata of files that were already removed
+        for name in os.listdir(legacy_directory):
+            if name.endswith(".meta") and FLAT_NAME_PATTERN.match(name[:-5]):
+                self.remove_file(os.path.join(legacy_directory, name))
+
+        if rows:
+            logger.info(f"Moved {len(rows)} files into the proxy cache index")
+
+    def reset(self):
+        """Forget the accesses and stats inherited from the parent process
+        after a fork."""
+        self.lock = threading.Lock()
+        self.accesses = {}
+        self.stats = dict.fromkeys(self.stats, 0)
+
+    def get_stats(self):
+        if not self.enabled:
+            return {"enabled": False}
+
+        with self.lock:
+            stats = dict(self.stats)
+            stats["pending_accesses"] = len(self.accesses)
+
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_ratio"] = stats["hits"] / lookups if lookups else 0
+        served = stats["hit_bytes"] + stats["miss_bytes"]
+        stats["byte_hit_ratio"] = stats["hit_bytes"] / served if served else 0
+        variant_lookups = stats["variant_hits"] + stats["variant_misses"]
+        stats["variant_hit_ratio"] = (
+            stats["variant_hits"] / variant_lookups if variant_lookups else 0
+        )
+
+        try:
+            entries, size = (
+                self.connect().execute("SELECT entries, size FROM totals").fetchone()
+            )
+        except sqlite3.Error as e:
+            logger.warning(f"Failed to read cache stats: {e}")
+            entries = size = None
+
+        return {
+            "enabled": True,
+            "policy": self.policy,
+            "entries": entries,
+            "size": size,
+            "max_size": self.max_size,
+            **stats,
+        }
+
+
+class CacheEvictor:
+    """Keeps the proxy cache within its size limit in a background thread.
+
+    Each worker process runs the thread, but only the one holding a lock on a
+    file in the cache directory evicts entries. Once the cache grows beyond
+    its maximum size (the high watermark), entries are evicted in small
+    batches, in the order of the cache's eviction policy, until it is below
+    the low watermark. Expired entries and orphaned temporary files are
+    removed every cleanup interval, also only by the process holding the
+    lock.
+
+    Args:
+        cache (ProxyCache): The cache to keep in its limits.
+    """
+
+    def __init__(self, cache):
+        self.cache = cache
+        self.low_watermark = 0
+        self.batch_size = 0
+        self.cleanup_interval = 0
+        self.next_cleanup = 0
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.pid = None
+        self.lock_file = None
+        self.stats = {
+            "runs": 0,
+            "batches": 0,
+            "expired": 0,
+            "evicted": 0,
+            "evicted_bytes": 0,
+            "swept_temp_files": 0,
+            "errors": 0,
+        }
+
+    def configure(self, low_watermark, batch_size, cleanup_interval):
+        """Set the eviction parameters.
+
+        Args:
+            low_watermark (float): The fraction of the maximum size to shrink
+                the cache to once it is exceeded.
+            batch_size (int): The maximum number of entries removed at once.
+            cleanup_interval (int): Seconds between removals of expired
+                entries.
+        """
+        self.low_watermark = low_watermark
+        self.batch_size = batch_size
+        self.cleanup_interval = cleanup_interval
+        self.cache.notify = self.wakeup.set
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.stats[name] += value
+
+    def is_leader(self):
+        """Check whether this process evicts entries.
+
+        Returns:
+            bool: True if this process holds the eviction lock, or if there
+                is no lock to hold.
+        """
+        if fcntl is None or self.lock_file is not None:
+            return True
+
+        lock_file = open(os.path.join(self.cache.directory, "evictor.lock"), "a")
+
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+
+        logger.debug(f"Worker {os.getpid()} now evicts proxy cache entries")
+        self.lock_file = lock_file
+        return True
+
+    def remove_expired(self):
+        while True:
+            rows = self.cache.get_expired(self.batch_size)
+            if not rows:
+                return
+
+            self.cache.evict(rows)
+            self.count("batches")
+            self.count("expired", len(rows))
+            logger.debug(f"Removed {len(rows)} expired cache files")
+
+            if len(rows) < self.batch_size:
+                return
+            time.sleep(EVICTION_BATCH_PAUSE)
+
+    def shrink(self, size):
+        target = self.cache.max_size * self.low_watermark
+        logger.debug(
+            f"Cache size {size / (1024 * 1024):.2f} MB exceeds limit, "
+            f"evicting down to {target / (1024 * 1024):.2f} MB"
+        )
+
+        while size > target:
+            # Only select as many entries as might be needed
+            rows = []
+            excess = size - target
+            for row in self.cache.get_victims(self.batch_size):
+                rows.append(row)
+                excess -= row[2]
+                if excess <= 0:
+                    break
+
+            if not rows:
+                return
+
+            freed = self.cache.evict(rows, inflate=self.cache.policy == "gdsf")
+            self.count("batches")
+            self.count("evicted", len(rows))
+            self.count("evicted_bytes", freed)
+
+            # Requests keep adding files meanwhile
+            time.sleep(EVICTION_BATCH_PAUSE)
+            size = self.cache.get_size()
+
+        logger.debug(f"Cache size after eviction: {size / (1024 * 1024):.2f} MB")
+
+    def run_once(self):
+        now = time.time()
+        # Only called in the leader, so one process per host sweeps
+        if now >= self.next_cleanup:
+            self.next_cleanup = now + self.cleanup_interval
+            self.remove_expired()
+            self.count("swept_temp_files", self.cache.sweep_temp_files())
+
+        size = self.cache.get_size()
+        if size > self.cache.max_size:
+            self.shrink(size)
+
+        self.count("runs")
+
+    def run(self):
+        while True:
+            try:
+                self.cache.flush_accesses()
+                if self.is_leader():
+                    self.run_once()
+            except Exception as e:
+                self.count("errors")
+                logger.error(f"Error during cache eviction: {str(e)}")
+
+            self.wakeup.wait(EVICTION_POLL_INTERVAL)
+            self.wakeup.clear()
+
+    def start(self):
+        """Start the background thread, if it is not running in this process."""
+        if self.pid == os.getpid() or not self.cache.enabled:
+            return
+
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+
+        threading.Thread(target=self.run, name="cache-evictor", daemon=True).start()
+        logger.debug(f"Started cache evictor in worker {self.pid}")
+
+    def reset(self):
+        """Forget the state inherited from the parent process after a fork."""
+        self.pid = None
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.cache.notify = self.wakeup.set
+
+        if self.lock_file is not None:
+            self.lock_file.close()
+            self.lock_file = None
+
+    def get_stats(self):
+        with self.lock:
+            stats = dict(self.stats)
+
+        stats["leader"] = self.lock_file is not None or fcntl is None
+        return stats
+
+
+proxy_cache = ProxyCache()
+evictor = CacheEvictor(proxy_cache)
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=proxy_cache.reset)
+    os.register_at_fork(after_in_child=evictor.reset)
+
+
+def init_proxy_cache(app):
+    """Configure the proxy cache from the app config.
+
+    Args:
+        app: The Flask app instance.
+    """
+    if not app.config["CACHE_ENABLED"]:
+        logger.debug("Caching is disabled")
+        proxy_cache.configure(None, 0, 0)
+        return
+
+    cache_dir = str(app.config["CACHE_DIR"])
+    os.makedirs(cache_dir, exist_ok=True)
+
+    policy = app.config["CACHE_EVICTION_POLICY"]
+    if policy not in POLICIES:
+        logger.warning(f"Unknown cache eviction policy {policy} - using lru")
+        policy = "lru"
+
+    try:
+        proxy_cache.configure(
+            os.path.join(cache_dir, "proxy"),
+            app.config["CACHE_MAX_AGE"],
+            app.config["CACHE_MAX_SIZE"],
+            policy,
+            legacy_directory=cache_dir,
+        )
+    except (OSError, sqlite3.Error) as e:
+        logger.error(f"Could not open the proxy cache index: {e} - disabling cache")
+        proxy_cache.configure(None, 0, 0)
+        return
+
+    evictor.configure(
+        app.config["CACHE_LOW_WATERMARK"],
+        app.config["CACHE_EVICTION_BATCH_SIZE"],
+        app.config["CACHE_CLEANUP_INTERVAL"],
+    )
+
+    @app.before_request
+    def start_evictor():
+        evictor.start()
+
+    logger.debug(f"Cache directory: {proxy_cache.directory}")
+    logger.debug(f"Cache max age: {app.config['CACHE_MAX_AGE']} seconds")
+    logger.debug(
+        f"Cache max size: {app.config['CACHE_MAX_SIZE'] / (1024 * 1024):.2f} MB"
+    )
+    logger.debug(
+        f"Cache cleanup interval: {app.config['CACHE_CLEANUP_INTERVAL']} seconds"
+    )
+    logger.debug(f"Cache low watermark: {app.config['CACHE_LOW_WATERMARK']:.0%}")
+    logger.debug(f"Cache eviction policy: {policy}")
@@ -0,0 +1,375 @@
+from collections import OrderedDict
+from pathlib import Path
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from .inflight import STALE_TEMP_AGE
+
+logger = logging.getLogger(__name__)
+
+# Marker for cache misses, as None is a valid cached value
+MISSING = object()
+
+# Fraction of the maximum number of entries the disk backend removes entries
+# down to once it is exceeded
+LOW_WATERMARK = 0.9
+
+
+class MemoryBackend:
+    """An in-process LRU backend.
+
+    Values are stored as-is and shared between requests, so they must not be
+    modified.
+
+    Args:
+        max_entries (int): The maximum number of entries to keep.
+    """
+
+    name = "memory"
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        now = time.time()
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return MISSING
+
+            expires, value = entry
+            if expires <= now:
+                del self.entries[key]
+                return MISSING
+
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self.lock:
+            self.entries[key] = (time.time() + ttl, value)
+            self.entries.move_to_end(key)
+
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class DiskBackend:
+    """A backend storing entries as JSON files in a directory.
+
+    The directory is shared by all worker processes. The modification time of
+    each file is set to its expiry time. Expired entries are removed when they
+    are read, and by a background thread scanning the directory every
+    `cleanup_interval` seconds. The thread also removes the entries expiring
+    first while there are more than `max_entries`, and temporary files left
+    behind by failed writes. It is woken up early once this process has
+    written enough entries to exceed the limit.
+
+    Each worker process runs the thread, but only the one holding a lock on a
+    file in the directory scans it.
+
+    Args:
+        directory (str): The directory to store entries in.
+        max_entries (int): The maximum number of entries to keep.
+        cleanup_interval (int): Seconds between scans for expired entries.
+    """
+
+    name = "disk"
+
+    def __init__(self, directory, max_entries, cleanup_interval):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_entries = max_entries
+        self.cleanup_interval = cleanup_interval
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.thread = None
+        self.pid = None
+        self.lock_file = None
+        # The number of entries found by the last scan, plus the entries
+        # written by this process since
+        self.entries = 0
+
+    def get_path(self, key):
+        return self.directory / (hashlib.sha256(key.encode()).hexdigest() + ".json")
+
+    def get(self, key):
+        path = self.get_path(key)
+
+        try:
+            with path.open() as f:
+                entry = json.load(f)
+        except FileNotFoundError:
+            return MISSING
+        except (OSError, ValueError) as e:
+            logger.warning(f"Failed to read response cache entry {path}: {e}")
+            return MISSING
+
+        if entry["expires"] <= time.time():
+            self.remove(path)
+            return MISSING
+
+        return entry["value"]
+
+    def set(self, key, value, ttl):
+        path = self.get_path(key)
+
+        expires = time.time() + ttl
+        temp_path = None
+
+        try:
+            fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            with os.fdopen(fd, "w") as f:
+                json.dump({"expires": expires, "value": value}, f)
+            # Lets the cleanup find expired entries without reading them
+            os.utime(temp_path, (expires, expires))
+            os.replace(temp_path, path)
+        except (OSError, TypeError, ValueError) as e:
+            logger.warning(f"Failed to write response cache entry {path}: {e}")
+            if temp_path is not None:
+                self.remove(temp_path)
+            return
+
+        self.start()
+
+        with self.lock:
+            self.entries += 1
+            full = self.entries > self.max_entries
+
+        if full:
+            self.wakeup.set()
+
+    def remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def is_leader(self):
+        """Check whether this process cleans up the directory.
+
+        Returns:
+            bool: True if this process holds the cleanup lock, or if there is
+                no lock to hold.
+        """
+        if fcntl is None or self.lock_file is not None:
+            return True
+
+        lock_file = open(self.directory / "cleanup.lock", "a")
+
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+
+        logger.debug(f"Worker {os.getpid()} now cleans up the response cache")
+        self.lock_file = lock_file
+        return True
+
+    def cleanup(self):
+        """Remove expired entries, the entries expiring first while there are
+        too many, and orphaned temporary files."""
+        logger.debug("Removing expired response cache entries")
+
+        now = time.time()
+        entries = []
+
+        with os.scandir(self.directory) as scan:
+            for item in scan:
+                if item.name.endswith(".tmp"):
+                    try:
+                        # The modification time may already be the expiry
+                        # time, but the change time is when it was set
+                        if item.stat().st_ctime < now - STALE_TEMP_AGE:
+                            self.remove(item.path)
+                    except OSError:
+                        pass
+                    continue
+
+                if not item.name.endswith(".json"):
+                    continue
+
+                try:
+                    expires = item.stat().st_mtime
+                except OSError:
+                    continue
+
+                if expires <= now:
+                    self.remove(item.path)
+                else:
+                    entries.append((expires, item.path))
+
+        if len(entries) > self.max_entries:
+            keep = int(self.max_entries * LOW_WATERMARK)
+            logger.debug(f"Removing {len(entries) - keep} response cache entries")
+            entries.sort()
+            for _, path in entries[: len(entries) - keep]:
+                self.remove(path)
+            entries = entries[len(entries) - keep :]
+
+        with self.lock:
+            self.entries = len(entries)
+
+    def run(self):
+        while True:
+            self.wakeup.wait(self.cleanup_interval)
+            self.wakeup.clear()
+
+            try:
+                if self.is_leader():
+                    self.cleanup()
+            except Exception as e:
+                logger.error(f"Error cleaning up the response cache: {str(e)}")
+
+    def start(self):
+        """Start the cleanup thread of this process, if it is not running."""
+        with self.lock:
+            # Threads do not survive a fork
+            if self.thread is not None and self.pid == os.getpid():
+                return
+
+            self.pid = os.getpid()
+            self.wakeup = threading.Event()
+            # The lock of the parent process is not held by this one
+            if self.lock_file is not None:
+                self.lock_file.close()
+                self.lock_file = None
+            self.thread = threading.Thread(
+                target=self.run, name="response-cache-cleanup", daemon=True
+            )
+            self.thread.start()
+
+    def clear(self):
+        for path in self.directory.glob("*.json"):
+            self.remove(path)
+
+
+class ResponseCache:
+    """A cache for upstream API responses with a TTL per endpoint.
+
+    Endpoints without a configured TTL are not cached.
+    """
+
+    def __init__(self):
+        self.backend = None
+        self.ttls = {}
+        self.lock = threading.Lock()
+        self.stats = {}
+
+    def configure(self, backend, ttls):
+        """Set the backend and the TTLs.
+
+        Args:
+            backend (MemoryBackend or DiskBackend): The backend, or None to
+                disable caching.
+            ttls (dict): A dictionary mapping endpoint names to TTLs in
+                seconds.
+        """
+        self.backend = backend
+        self.ttls = {endpoint: ttl for endpoint, ttl in ttls.items() if ttl > 0}
+
+    def count(self, endpoint, name):
+        with self.lock:
+            endpoint_stats = self.stats.setdefault(
+                endpoint, {"hits": 0, "misses": 0, "stores": 0}
+            )
+            endpoint_stats[name] += 1
+
+    def get(self, endpoint, key):
+        """Look up a cached response.
+
+        Args:
+            endpoint (str): The endpoint name.
+            key (str): The cache key, usually the normalized URL.
+
+        Returns:
+            The cached value, or `MISSING`.
+        """
+        if self.backend is None or endpoint not in self.ttls:
+            return MISSING
+
+        value = self.backend.get(f"{endpoint}:{key}")
+        self.count(endpoint, "misses" if value is MISSING else "hits")
+        return value
+
+    def set(self, endpoint, key, value):
+        """Store a response.
+
+        Args:
+            endpoint (str): The endpoint name.
+            key (str): The cache key, usually the normalized URL.
+            value: The value to store. Must be JSON serializable.
+        """
+        if self.backend is None or endpoint not in self.ttls:
+            return
+
+        self.backend.set(f"{endpoint}:{key}", value, self.ttls[endpoint])
+        self.count(endpoint, "stores")
+
+    def clear(self):
+        if self.backend is not None:
+            self.backend.clear()
+
+    def get_stats(self):
+        with self.lock:
+            stats = {endpoint: dict(values) for endpoint, values in self.stats.items()}
+
+        for values in stats.values():
+            lookups = values["hits"] + values["misses"]
+            values["hit_ratio"] = values["hits"] / lookups if lookups else 0
+
+        return {
+            "backend": self.backend.name if self.backend else None,
+            "endpoints": stats,
+        }
+
+
+response_cache = ResponseCache()
+
+
+def init_response_cache(app):
+    """Configure the response cache from the app config.
+
+    Args:
+        app: The Flask app instance.
+    """
+    backend_name = app.config["RESPONSE_CACHE_BACKEND"]
+
+    if backend_name == "disk" and not app.config["CACHE_ENABLED"]:
+        logger.warning(
+            "Disk response cache requires STRUCTABLES_CACHE_ENABLED - using memory"
+        )
+        backend_name = "memory"
+
+    if backend_name == "disk":
+        backend = DiskBackend(
+            Path(app.config["CACHE_DIR"]) / "responses",
+            app.config["RESPONSE_CACHE_MAX_ENTRIES"],
+            app.config["CACHE_CLEANUP_INTERVAL"],
+        )
+    elif backend_name == "memory":
+        backend = MemoryBackend(app.config["RESPONSE_CACHE_MAX_ENTRIES"])
+    else:
+        logger.debug("Response cache is disabled")
+        backend = None
+
+    response_cache.configure(backend, app.config["RESPONSE_CACHE_TTLS"])
+    logger.debug(f"Response cache backend: {backend_name}")
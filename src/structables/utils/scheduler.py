@@ -0,0 +1,280 @@
+from pathlib import Path
+import logging
+import os
+import random
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from .snapshot import SnapshotError, read_snapshot, write_snapshot
+
+logger = logging.getLogger(__name__)
+
+# Seconds between checks for due datasets and for data published by the
+# worker refreshing them
+POLL_INTERVAL = 10
+
+# Seconds to wait before retrying a failed refresh
+RETRY_INTERVAL = 60
+
+
+class Dataset:
+    """A dataset refreshed periodically in the background.
+
+    Args:
+        name (str): The name of the dataset.
+        interval (int): Seconds between refreshes.
+        fetch (callable): A function taking the app and returning the new
+            value. The value must be JSON serializable, and changes to its
+            structure require a new `snapshot.VERSION`.
+        apply (callable): A function taking the app and a value, making the
+            value available to requests.
+    """
+
+    def __init__(self, name, interval, fetch, apply):
+        self.name = name
+        self.interval = interval
+        self.fetch = fetch
+        self.apply = apply
+        self.next_refresh = 0
+        self.loaded_mtime = None
+
+
+class Scheduler:
+    """Refreshes datasets in a background thread of each worker process.
+
+    If there is a data directory, only one worker process per host refreshes
+    the datasets: the one holding a lock on a file in that directory. It
+    publishes every new value to the directory as a snapshot, and the other
+    workers load it from there. Snapshots outlive the workers, so restarted
+    workers can serve the last published data right away. Without a data
+    directory, or on platforms without `fcntl`, every worker refreshes the
+    datasets itself.
+    """
+
+    def __init__(self):
+        self.app = None
+        self.directory = None
+        self.jitter = 0
+        self.datasets = {}
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.triggered = False
+        self.pid = None
+        self.lock_file = None
+        self.stats = {
+            "refreshes": 0,
+            "refresh_errors": 0,
+            "loads": 0,
+        }
+
+    def configure(self, app, directory, jitter):
+        """Set the app and the directory to share data in.
+
+        Args:
+            app: The Flask app instance.
+            directory (str): The directory to publish data to, or None.
+            jitter (int): The maximum number of seconds to randomly delay
+                each refresh by.
+        """
+        self.app = app
+        self.directory = Path(directory) if directory else None
+        self.jitter = jitter
+
+        if self.directory is not None:
+            self.directory.mkdir(parents=True, exist_ok=True)
+
+    def add(self, name, interval, fetch, apply):
+        """Register a dataset.
+
+        Args:
+            name (str): The name of the dataset.
+            interval (int): Seconds between refreshes.
+            fetch (callable): A function taking the app and returning the new
+                value.
+            apply (callable): A function taking the app and a value.
+        """
+        self.datasets[name] = Dataset(name, interval, fetch, apply)
+
+    def count(self, name):
+        with self.lock:
+            self.stats[name] += 1
+
+    def get_path(self, dataset):
+        return self.directory / f"{dataset.name}.snapshot"
+
+    def is_leader(self):
+        """Check whether this process refreshes the datasets.
+
+        Returns:
+            bool: True if this process holds the refresh lock, or if there is
+                no lock to hold.
+        """
+        if self.directory is None or fcntl is None:
+            return True
+
+        if self.lock_file is not None:
+            return True
+
+        lock_file = open(self.directory / "scheduler.lock", "a")
+
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+
+        logger.info(f"Worker {os.getpid()} now refreshes shared data")
+        self.lock_file = lock_file
+        return True
+
+    def publish(self, dataset, value):
+        if self.directory is None:
+            return
+
+        path = self.get_path(dataset)
+
+        try:
+            size = write_snapshot(path, value)
+            dataset.loaded_mtime = path.stat().st_mtime
+            logger.debug(f"Published {dataset.name} snapshot ({size} bytes)")
+        except (OSError, TypeError, ValueError) as e:
+            logger.warning(f"Failed to publish {dataset.name} data: {e}")
+
+    def load(self, dataset):
+        """Apply the published value of a dataset, if it changed.
+
+        Args:
+            dataset (Dataset): The dataset.
+
+        Returns:
+            bool: True if a value was loaded.
+        """
+        if self.directory is None:
+            return False
+
+        path = self.get_path(dataset)
+
+        try:
+            mtime = path.stat().st_mtime
+            if mtime == dataset.loaded_mtime:
+                return False
+
+            value = read_snapshot(path)
+        except FileNotFoundError:
+            return False
+        except (OSError, SnapshotError) as e:
+            logger.warning(f"Failed to load published {dataset.name} data: {e}")
+            return False
+
+        dataset.apply(self.app, value)
+        dataset.loaded_mtime = mtime
+        self.count("loads")
+        logger.debug(f"Loaded published {dataset.name} data")
+        return True
+
+    def refresh(self, dataset):
+        logger.debug(f"Refreshing {dataset.name} data")
+
+        try:
+            value = dataset.fetch(self.app)
+        except Exception as e:
+            self.count("refresh_errors")
+            logger.error(f"Error refreshing {dataset.name} data: {str(e)}")
+            dataset.next_refresh = time.time() + min(RETRY_INTERVAL, dataset.interval)
+            return
+
+        dataset.apply(self.app, value)
+        self.publish(dataset, value)
+        self.count("refreshes")
+        dataset.next_refresh = (
+            time.time() + dataset.interval + random.uniform(0, self.jitter)
+        )
+        logger.debug(f"Refreshed {dataset.name} data")
+
+    def load_all(self):
+        """Apply the published values of all datasets."""
+        for dataset in self.datasets.values():
+            self.load(dataset)
+
+    def refresh_missing(self):
+        """Refresh the datasets without a published value in the calling
+        thread, so that they are not empty until the first run."""
+        for dataset in self.datasets.values():
+            if dataset.loaded_mtime is None:
+                self.refresh(dataset)
+
+    def run(self):
+        # Data published before this worker started only needs a refresh
+        # once it is due
+        for dataset in self.datasets.values():
+            if dataset.loaded_mtime:
+                dataset.next_refresh = dataset.loaded_mtime + dataset.interval
+
+        while True:
+            with self.lock:
+                triggered = self.triggered
+                self.triggered = False
+
+            leader = triggered or self.is_leader()
+
+            for dataset in self.datasets.values():
+                if triggered or (leader and time.time() >= dataset.next_refresh):
+                    self.refresh(dataset)
+                else:
+                    self.load(dataset)
+
+            self.wakeup.wait(POLL_INTERVAL)
+            self.wakeup.clear()
+
+    def start(self):
+        """Start the background thread, if it is not running in this process."""
+        if self.pid == os.getpid() or not self.datasets:
+            return
+
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+
+        threading.Thread(target=self.run, name="scheduler", daemon=True).start()
+        logger.debug(f"Started scheduler in worker {self.pid}")
+
+    def trigger(self):
+        """Refresh all datasets in this process as soon as possible."""
+        with self.lock:
+            self.triggered = True
+        self.wakeup.set()
+
+    def reset(self):
+        """Forget the state inherited from the parent process after a fork."""
+        self.pid = None
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+
+        if self.lock_file is not None:
+            self.lock_file.close()
+            self.lock_file = None
+
+    def get_stats(self):
+        with self.lock:
+            stats = dict(self.stats)
+
+        stats["leader"] = self.lock_file is not None or (
+            self.directory is None or fcntl is None
+        )
+        stats["datasets"] = {
+            name: {"next_refresh": dataset.next_refresh}
+            for name, dataset in self.datasets.items()
+        }
+        return stats
+
+
+scheduler = Scheduler()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=scheduler.reset)
@@ -0,0 +1,84 @@
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class Call:
+    """A call in progress, shared by all callers with the same key."""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Coalesce concurrent calls with the same key into a single call.
+
+    While a call for a key is in progress, other threads calling `do()` with
+    the same key wait for it and receive its result (or its exception)
+    instead of making the call themselves. Results are shared, so callers
+    must treat them as read-only.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.stats = {
+            "calls": 0,
+            "executed": 0,
+            "shared": 0,
+            "errors": 0,
+        }
+
+    def do(self, key, function):
+        """Call a function, or wait for the call already in progress.
+
+        Args:
+            key (hashable): The key identifying the call.
+            function (callable): The function to call without arguments.
+
+        Returns:
+            The result of the function.
+
+        Raises:
+            Exception: The exception raised by the function.
+        """
+        with self.lock:
+            self.stats["calls"] += 1
+            call = self.calls.get(key)
+            leader = call is None
+
+            if leader:
+                call = Call()
+                self.calls[key] = call
+                self.stats["executed"] += 1
+            else:
+                self.stats["shared"] += 1
+
+        if leader:
+            try:
+                call.result = function()
+            except BaseException as e:
+                call.error = e
+                with self.lock:
+                    self.stats["errors"] += 1
+            finally:
+                with self.lock:
+                    del self.calls[key]
+                call.event.set()
+        else:
+            logger.debug(f"Waiting for call in progress: {key}")
+            call.event.wait()
+
+        if call.error is not None:
+            raise call.error
+
+        return call.result
+
+    def get_stats(self):
+        with self.lock:
+            stats = dict(self.stats)
+            stats["in_flight"] = len(self.calls)
+            return stats
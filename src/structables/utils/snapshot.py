@@ -0,0 +1,97 @@
+import json
+import logging
+import mmap
+import os
+import struct
+import tempfile
+import zlib
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"STRCTBLS"
+
+# Increase when the layout of the file or of the stored data changes, so
+# snapshots written by other versions are ignored
+VERSION = 2
+
+# Magic, version, reserved, payload length, payload CRC32
+HEADER = struct.Struct("<8sHHII")
+
+
+class SnapshotError(ValueError):
+    """Raised when a snapshot file is invalid or was written by another version."""
+
+
+def write_snapshot(path, value):
+    """Atomically write a value to a snapshot file.
+
+    The value is stored as zlib compressed JSON behind a header with a
+    version and a checksum.
+
+    Args:
+        path (Path): The path of the snapshot file.
+        value: The value to store. Must be JSON serializable.
+
+    Returns:
+        int: The size of the file in bytes.
+    """
+    payload = zlib.compress(json.dumps(value, separators=(",", ":")).encode())
+    header = HEADER.pack(MAGIC, VERSION, 0, len(payload), zlib.crc32(payload))
+
+    fd, temp_path = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(header)
+            f.write(payload)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+    return len(header) + len(payload)
+
+
+def read_snapshot(path):
+    """Read a value from a snapshot file.
+
+    Args:
+        path (Path): The path of the snapshot file.
+
+    Returns:
+        The stored value.
+
+    Raises:
+        FileNotFoundError: If the file does not exist.
+        SnapshotError: If the file is invalid or has another version.
+    """
+    with open(path, "rb") as f:
+        try:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            raise SnapshotError("Snapshot is empty")
+
+    with mapped:
+        if len(mapped) < HEADER.size:
+            raise SnapshotError("Snapshot is truncated")
+
+        magic, version, _, length, crc = HEADER.unpack_from(mapped)
+
+        if magic != MAGIC:
+            raise SnapshotError("Not a snapshot file")
+
+        if version != VERSION:
+            raise SnapshotError(f"Unsupported snapshot version {version}")
+
+        if len(mapped) != HEADER.size + length:
+            raise SnapshotError("Snapshot is truncated")
+
+        with memoryview(mapped)[HEADER.size :] as payload:
+            if zlib.crc32(payload) != crc:
+                raise SnapshotError("Snapshot checksum mismatch")
+
+            data = zlib.decompress(payload)
+
+    try:
+        return json.loads(data)
+    except ValueError as e:
+        raise SnapshotError(f"Invalid snapshot data: {e}")
@@ -0,0 +1,88 @@
+from flask import Response, current_app, render_template, stream_template
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Bytes of rendered output to collect before sending them
+CHUNK_SIZE = 16 * 1024
+
+
+class PageStream:
+    """Render a template while the data shown in it is produced.
+
+    Lists that take time to produce are passed to the template through
+    `items()`. The part of the page before the first item (the head and the
+    header) is sent as it is rendered, before the first item is produced,
+    and the rest of the page in chunks of `CHUNK_SIZE` bytes.
+
+    Errors raised while streaming cannot change the status of the response
+    any more, so they end the response early.
+    """
+
+    def __init__(self):
+        self.first_item = False
+
+    def items(self, iterable):
+        """Wrap an iterable passed to the template.
+
+        Args:
+            iterable (iterable): The items, usually produced by a generator.
+
+        Yields:
+            The items.
+        """
+        for item in iterable:
+            self.first_item = True
+            yield item
+
+        # The rest of the page is buffered even if there were no items
+        self.first_item = True
+
+    def chunks(self, parts):
+        buffer = []
+        size = 0
+
+        try:
+            for part in parts:
+                # Until the first item is produced, the template may wait for
+                # it after any part, so the shell is sent part by part
+                if not self.first_item:
+                    if part:
+                        yield part.encode()
+                    continue
+
+                buffer.append(part)
+                size += len(part)
+
+                if size >= CHUNK_SIZE:
+                    yield "".join(buffer).encode()
+                    buffer = []
+                    size = 0
+
+            if buffer:
+                yield "".join(buffer).encode()
+        finally:
+            # Ends the request context kept for rendering
+            parts.close()
+
+    def render(self, template_name, **context):
+        """Render a template as a streamed response.
+
+        If streaming is disabled, the template is rendered at once.
+
+        Args:
+            template_name (str): The name of the template.
+            **context: The variables to make available in the template.
+
+        Returns:
+            Response: The response.
+        """
+        if not current_app.config["STREAM_PAGES"]:
+            return render_template(template_name, **context)
+
+        logger.debug(f"Streaming template {template_name}")
+
+        return Response(
+            self.chunks(stream_template(template_name, **context)),
+            mimetype="text/html",
+        )
@@ -0,0 +1,173 @@
+from pathlib import Path
+from urllib.error import HTTPError
+import logging
+import os
+import re
+import tempfile
+import threading
+
+from .upstream import fetch_text
+
+logger = logging.getLogger(__name__)
+
+API_KEY_PATTERN = re.compile(r'"typesenseApiKey":\s?"(.*?)"')
+
+
+def get_typesense_api_key():
+    """Extract the Typesense API key from Instructables.com.
+
+    Returns:
+        str: The Typesense API key, or None if it could not be found.
+    """
+    logger.debug("Getting Typesense API key...")
+
+    try:
+        data = fetch_text("https://www.instructables.com/")
+
+        if matches := API_KEY_PATTERN.search(data):
+            api_key = matches.group(1)
+            logger.debug(f"Identified Typesense API key: {api_key[:5]}...")
+            return api_key
+
+        logger.error("Failed to get Typesense API key")
+    except Exception as e:
+        logger.error(f"Error getting Typesense API key: {str(e)}")
+
+
+class ApiKey:
+    """The Typesense API key, resolved on first use.
+
+    The key is stored in the cache directory, if there is one, so restarted
+    workers can use it without fetching the homepage again.
+    """
+
+    def __init__(self):
+        self.path = None
+        self.key = None
+        self.lock = threading.Lock()
+
+    def configure(self, cache_dir):
+        """Set the directory to store the key in.
+
+        Args:
+            cache_dir (str): The cache directory, or None to only keep the key
+                in memory.
+        """
+        self.path = Path(cache_dir) / "typesense_api_key" if cache_dir else None
+        self.key = None
+
+    def load(self):
+        if self.path is None:
+            return None
+
+        try:
+            return self.path.read_text().strip() or None
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            logger.warning(f"Failed to read stored Typesense API key: {e}")
+            return None
+
+    def save(self, key):
+        if self.path is None:
+            return
+
+        try:
+            fd, temp_path = tempfile.mkstemp(dir=self.path.parent, suffix=".tmp")
+            with os.fdopen(fd, "w") as f:
+                f.write(key)
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            logger.warning(f"Failed to store Typesense API key: {e}")
+
+    def get(self):
+        """Return the API key, fetching it if it is not known yet.
+
+        Returns:
+            str: The API key, or None if it could not be fetched.
+        """
+        if self.key is not None:
+            return self.key
+
+        with self.lock:
+            if self.key is None:
+                self.key = self.load()
+
+                if self.key is not None:
+                    logger.debug("Using stored Typesense API key")
+                elif key := get_typesense_api_key():
+                    self.key = key
+                    self.save(key)
+
+            return self.key
+
+    def refresh(self, rejected_key):
+        """Fetch the API key again after it was rejected.
+
+        If another thread or worker process already replaced the rejected
+        key, its new key is returned without fetching it again.
+
+        Args:
+            rejected_key (str): The key that was rejected.
+
+        Returns:
+            str: The new API key, or None if it could not be fetched.
+        """
+        with self.lock:
+            if self.key is not None and self.key != rejected_key:
+                return self.key
+
+            # Another worker process may already have stored a new key
+            stored_key = self.load()
+            if stored_key is not None and stored_key != rejected_key:
+                self.key = stored_key
+                return stored_key
+
+            logger.info("Typesense API key was rejected, fetching it again")
+
+            key = get_typesense_api_key()
+            if key is not None:
+                self.key = key
+                self.save(key)
+
+            return key
+
+
+api_key = ApiKey()
+
+
+def with_api_key(function):
+    """Call a function with the Typesense request headers.
+
+    If the request is rejected with 401 or 403, the API key is fetched again
+    and the function is called once more with the new key.
+
+    Args:
+        function (callable): A function taking the request headers as its only
+            argument.
+
+    Returns:
+        The result of the function.
+    """
+    key = api_key.get()
+
+    try:
+        return function({"x-typesense-api-key": key or ""})
+    except HTTPError as e:
+        if e.code not in (401, 403):
+            raise
+
+        new_key = api_key.refresh(key)
+        if new_key is None or new_key == key:
+            raise
+
+    return function({"x-typesense-api-key": new_key})
+
+
+def init_typesense(app):
+    """Configure where the Typesense API key is stored.
+
+    Args:
+        app: The Flask app instance.
+    """
+    api_key.configure(app.config["CACHE_DIR"] if app.config["CACHE_ENABLED"] else None)
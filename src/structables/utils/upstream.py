@@ -0,0 +1,548 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from email.message import Message
+from io import BytesIO
+from http.client import (
+    HTTPConnection,
+    HTTPSConnection,
+    HTTPException,
+    RemoteDisconnected,
+)
+from urllib.error import HTTPError
+from urllib.parse import parse_qsl, urlencode, urljoin, urlsplit
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+from .response_cache import MISSING, response_cache
+from .singleflight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+USER_AGENT = f"Python-urllib/{sys.version_info.major}.{sys.version_info.minor}"
+
+REDIRECT_CODES = (301, 302, 303, 307, 308)
+MAX_REDIRECTS = 5
+
+# Errors showing that a pooled connection was closed by the server while it
+# was idle. Requests failing with these before any response arrived were not
+# processed, so they can be sent again.
+STALE_CONNECTION_ERRORS = (RemoteDisconnected, ConnectionResetError, BrokenPipeError)
+
+
+class HostPool:
+    """A pool of persistent connections to a single upstream host.
+
+    Idle connections are kept in a LIFO queue so that the most recently used
+    (and therefore most likely still open) connection is reused first. When
+    more requests are in flight than the pool holds, extra connections are
+    opened and simply closed again when they are released.
+
+    Args:
+        scheme (str): Either "http" or "https".
+        host (str): The host name.
+        port (int): The port number.
+        maxsize (int): The maximum number of idle connections to keep.
+        idle_timeout (float): Seconds after which an idle connection is
+            discarded instead of reused.
+    """
+
+    def __init__(self, scheme, host, port, maxsize, idle_timeout):
+        self.scheme = scheme
+        self.host = host
+        self.port = port
+        self.maxsize = maxsize
+        self.idle_timeout = idle_timeout
+        self.lock = threading.Lock()
+        self.idle = deque()
+        self.stats = {
+            "requests": 0,
+            "connections_created": 0,
+            "connections_reused": 0,
+            "connections_discarded": 0,
+            "errors": 0,
+        }
+
+    def get(self, timeout, fresh=False):
+        """Get a connection from the pool, or open a new one.
+
+        Args:
+            timeout (float): The socket timeout for the connection.
+            fresh (bool, optional): Whether to always open a new connection.
+
+        Returns:
+            tuple: A tuple of (connection, reused).
+        """
+        now = time.monotonic()
+
+        with self.lock:
+            self.stats["requests"] += 1
+
+            while self.idle and not fresh:
+                conn, last_used = self.idle.pop()
+
+                if now - last_used > self.idle_timeout:
+                    self.stats["connections_discarded"] += 1
+                    conn.close()
+                    continue
+
+                self.stats["connections_reused"] += 1
+                conn.timeout = timeout
+                if conn.sock is not None:
+                    conn.sock.settimeout(timeout)
+                return conn, True
+
+            self.stats["connections_created"] += 1
+
+        connection_class = HTTPSConnection if self.scheme == "https" else HTTPConnection
+        return connection_class(self.host, self.port, timeout=timeout), False
+
+    def put(self, conn):
+        """Return a connection to the pool for later reuse.
+
+        Args:
+            conn (HTTPConnection): The connection to return.
+        """
+        with self.lock:
+            if len(self.idle) < self.maxsize:
+                self.idle.append((conn, time.monotonic()))
+                return
+
+            self.stats["connections_discarded"] += 1
+
+        conn.close()
+
+    def discard(self, conn, error=False):
+        """Close a connection that must not be reused.
+
+        Args:
+            conn (HTTPConnection): The connection to close.
+            error (bool, optional): Whether the connection failed.
+        """
+        with self.lock:
+            self.stats["connections_discarded"] += 1
+            if error:
+                self.stats["errors"] += 1
+
+        conn.close()
+
+    def clear(self):
+        """Close all idle connections."""
+        with self.lock:
+            while self.idle:
+                conn, _ = self.idle.pop()
+                conn.close()
+
+
+class UpstreamResponse:
+    """A response from an upstream server.
+
+    Mimics the parts of the object returned by `urllib.request.urlopen` that
+    the routes use. The underlying connection goes back to its pool once the
+    body has been read completely or the response is closed.
+
+    Args:
+        pool (HostPool): The pool the connection belongs to.
+        conn (HTTPConnection): The connection the response was read from.
+        response (HTTPResponse): The raw response.
+        url (str): The final URL of the response.
+    """
+
+    def __init__(self, pool, conn, response, url):
+        self.pool = pool
+        self.conn = conn
+        self.response = response
+        self.url = url
+        self.status = response.status
+        self.reason = response.reason
+        self.headers = response.headers
+
+    def read(self, amt=None):
+        data = self.response.read(amt)
+        if amt is None or not data:
+            self.release()
+        return data
+
+    def readinto(self, buffer):
+        n = self.response.readinto(buffer)
+        if not n:
+            self.release()
+        return n
+
+    def getcode(self):
+        return self.status
+
+    def geturl(self):
+        return self.url
+
+    def release(self):
+        """Hand the connection back to its pool, or close it if it is unusable."""
+        if self.conn is None:
+            return
+
+        conn, self.conn = self.conn, None
+
+        if self.response.isclosed() and not self.response.will_close:
+            self.pool.put(conn)
+        else:
+            self.response.close()
+            self.pool.discard(conn)
+
+    close = release
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.release()
+
+
+class UpstreamClient:
+    """An HTTP client with per-host pools of keep-alive connections.
+
+    Args:
+        pool_size (int, optional): The number of idle connections to keep per
+            host.
+        idle_timeout (float, optional): Seconds an idle connection is kept
+            before it is discarded.
+        timeout (float, optional): The default socket timeout for requests.
+        concurrency (int, optional): The number of worker threads for
+            requests made in parallel.
+    """
+
+    def __init__(self, pool_size=10, idle_timeout=60, timeout=30, concurrency=4):
+        self.pool_size = pool_size
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.concurrency = concurrency
+        self.lock = threading.Lock()
+        self.pools = {}
+        self.executor = None
+
+    def configure(
+        self, pool_size=None, idle_timeout=None, timeout=None, concurrency=None
+    ):
+        """Change the client settings.
+
+        Existing pools pick up the new pool size and idle timeout.
+        """
+        with self.lock:
+            if pool_size is not None:
+                self.pool_size = pool_size
+            if idle_timeout is not None:
+                self.idle_timeout = idle_timeout
+            if timeout is not None:
+                self.timeout = timeout
+            if concurrency is not None and concurrency != self.concurrency:
+                self.concurrency = concurrency
+                if self.executor is not None:
+                    self.executor.shutdown(wait=False)
+                    self.executor = None
+
+            for pool in self.pools.values():
+                pool.maxsize = self.pool_size
+                pool.idle_timeout = self.idle_timeout
+
+    def get_pool(self, scheme, host, port):
+        key = (scheme, host, port)
+
+        with self.lock:
+            pool = self.pools.get(key)
+            if pool is None:
+                pool = HostPool(scheme, host, port, self.pool_size, self.idle_timeout)
+                self.pools[key] = pool
+
+            return pool
+
+    def request(self, url, method="GET", headers=None, body=None, timeout=None):
+        """Make a request to an upstream server, following redirects.
+
+        Args:
+            url (str): The URL to request.
+            method (str, optional): The HTTP method.
+            headers (dict, optional): Additional request headers.
+            body (bytes, optional): The request body.
+            timeout (float, optional): The socket timeout.
+
+        Returns:
+            UpstreamResponse: The response. The caller must read it to the end
+                or close it.
+
+        Raises:
+            HTTPError: If the upstream server returns an error status.
+        """
+        timeout = self.timeout if timeout is None else timeout
+
+        for _ in range(MAX_REDIRECTS + 1):
+            response = self._request_once(url, method, headers, body, timeout)
+
+            if response.status in REDIRECT_CODES and "location" in response.headers:
+                location = urljoin(url, response.headers["location"])
+                logger.debug(f"Following {response.status} redirect to {location}")
+                response.response.read()
+                response.release()
+
+                if response.status == 303 and method != "HEAD":
+                    method, body = "GET", None
+
+                url = location
+                continue
+
+            if response.status >= 400:
+                error_body = response.response.read()
+                response.release()
+                raise HTTPError(
+                    url,
+                    response.status,
+                    response.reason,
+                    response.headers,
+                    BytesIO(error_body),
+                )
+
+            return response
+
+        raise HTTPError(url, 310, "Too many redirects", Message(), None)
+
+    def _request_once(self, url, method, headers, body, timeout):
+        parts = urlsplit(url)
+        scheme = parts.scheme.lower()
+        default_port = 443 if scheme == "https" else 80
+        pool = self.get_pool(scheme, parts.hostname, parts.port or default_port)
+
+        path = parts.path or "/"
+        if parts.query:
+            path += "?" + parts.query
+
+        request_headers = {
+            "User-Agent": USER_AGENT,
+            "Accept-Encoding": "identity",
+            "Connection": "keep-alive",
+        }
+        if headers:
+            request_headers.update(headers)
+
+        fresh = False
+
+        while True:
+            conn, reused = pool.get(timeout, fresh=fresh)
+
+            try:
+                conn.request(method, path, body=body, headers=request_headers)
+                response = conn.getresponse()
+            except STALE_CONNECTION_ERRORS:
+                pool.discard(conn, error=not reused)
+
+                # A pooled connection may have been closed by the server in
+                # the meantime, so retry once on a fresh connection. Timeouts
+                # and other errors are not retried.
+                if reused and not fresh:
+                    logger.debug(f"Stale pooled connection to {pool.host}, retrying")
+                    fresh = True
+                    continue
+                raise
+            except (HTTPException, OSError):
+                pool.discard(conn, error=True)
+                raise
+
+            return UpstreamResponse(pool, conn, response, url)
+
+    def submit(self, function, *args, **kwargs):
+        """Run a function on the shared pool of worker threads.
+
+        At most `concurrency` functions run at the same time; the others wait
+        in a queue.
+
+        Args:
+            function (callable): The function to run.
+            *args: Positional arguments for the function.
+            **kwargs: Keyword arguments for the function.
+
+        Returns:
+            Future: The future of the call.
+        """
+        with self.lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(
+                    max_workers=self.concurrency, thread_name_prefix="upstream"
+                )
+            executor = self.executor
+
+        return executor.submit(function, *args, **kwargs)
+
+    def stats(self):
+        """Return per-host connection statistics.
+
+        Returns:
+            dict: A dictionary mapping host names to their statistics.
+        """
+        with self.lock:
+            pools = list(self.pools.values())
+
+        stats = {}
+        for pool in pools:
+            with pool.lock:
+                host_stats = dict(pool.stats)
+                host_stats["idle"] = len(pool.idle)
+            stats[f"{pool.scheme}://{pool.host}:{pool.port}"] = host_stats
+
+        return stats
+
+    def reset(self):
+        """Drop all pooled connections and worker threads, e.g. after the
+        process was forked."""
+        with self.lock:
+            pools = list(self.pools.values())
+            self.pools = {}
+            self.executor = None
+
+        for pool in pools:
+            pool.clear()
+
+
+client = UpstreamClient()
+requests_in_flight = SingleFlight()
+
+# Connections opened in the uwsgi master must not be shared with its workers
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=client.reset)
+
+
+def fetch(url, headers=None, timeout=None, method="GET", body=None):
+    """Make a request using the shared upstream client.
+
+    Args:
+        url (str): The URL to request.
+        headers (dict, optional): Additional request headers.
+        timeout (float, optional): The socket timeout.
+        method (str, optional): The HTTP method.
+        body (bytes, optional): The request body.
+
+    Returns:
+        UpstreamResponse: The response.
+    """
+    return client.request(
+        url, method=method, headers=headers, body=body, timeout=timeout
+    )
+
+
+def normalize_url(url):
+    """Normalize a URL for use in cache keys.
+
+    Equivalent URLs, differing only in the case of the scheme and host or in
+    the order of query parameters, are normalized to the same string.
+
+    Args:
+        url (str): The URL to normalize.
+
+    Returns:
+        str: The normalized URL.
+    """
+    parts = urlsplit(url)
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return f"{parts.scheme.lower()}://{parts.netloc.lower()}{parts.path or '/'}?{query}"
+
+
+def map_concurrent(function, iterable):
+    """Call a function for each item on the shared worker threads.
+
+    Args:
+        function (callable): The function to call with each item.
+        iterable (iterable): The items.
+
+    Returns:
+        list: The results, in the order of the items.
+    """
+    futures = [client.submit(function, item) for item in iterable]
+    return [future.result() for future in futures]
+
+
+def request_key(url, headers=None):
+    """Build a key identifying an upstream request.
+
+    Args:
+        url (str): The URL to request.
+        headers (dict, optional): Additional request headers.
+
+    Returns:
+        tuple: The key.
+    """
+    header_items = tuple(
+        sorted((name.lower(), value) for name, value in (headers or {}).items())
+    )
+    return (normalize_url(url), header_items)
+
+
+def fetch_text(url, headers=None, timeout=None):
+    """Fetch a URL and return its decoded body.
+
+    Concurrent identical requests share a single upstream request.
+
+    Args:
+        url (str): The URL to request.
+        headers (dict, optional): Additional request headers.
+        timeout (float, optional): The socket timeout.
+
+    Returns:
+        str: The decoded body.
+    """
+
+    def load():
+        with fetch(url, headers=headers, timeout=timeout) as response:
+            return response.read().decode()
+
+    return requests_in_flight.do(("text",) + request_key(url, headers), load)
+
+
+def fetch_json(url, headers=None, timeout=None, cache=None):
+    """Fetch a URL and return its body parsed as JSON.
+
+    Concurrent identical requests share a single upstream request and the
+    parsed result, which must therefore not be modified.
+
+    Args:
+        url (str): The URL to request.
+        headers (dict, optional): Additional request headers.
+        timeout (float, optional): The socket timeout.
+        cache (str, optional): The endpoint name to cache the response under
+            in the response cache. Headers are not part of the cache key.
+
+    Returns:
+        The parsed JSON data.
+    """
+
+    def load():
+        with fetch(url, headers=headers, timeout=timeout) as response:
+            data = json.loads(response.read().decode())
+
+        if cache is not None:
+            response_cache.set(cache, normalize_url(url), data)
+
+        return data
+
+    if cache is not None:
+        data = response_cache.get(cache, normalize_url(url))
+        if data is not MISSING:
+            return data
+
+    return requests_in_flight.do(("json",) + request_key(url, headers), load)
+
+
+def init_upstream(app):
+    """Configure the shared upstream client from the app config.
+
+    Args:
+        app: The Flask app instance.
+    """
+    client.configure(
+        pool_size=app.config["UPSTREAM_POOL_SIZE"],
+        idle_timeout=app.config["UPSTREAM_POOL_IDLE_TIMEOUT"],
+        timeout=app.config["UPSTREAM_TIMEOUT"],
+        concurrency=app.config["UPSTREAM_CONCURRENCY"],
+    )
+    logger.debug(
+        f"Upstream pool size: {app.config['UPSTREAM_POOL_SIZE']}, "
+        f"idle timeout: {app.config['UPSTREAM_POOL_IDLE_TIMEOUT']} seconds"
+    )